@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import os
-import subprocess
-import sys
+import argparse
 from pathlib import Path
+from typing import Optional, Sequence
 
-# --- HARD LIMITS gegen Freeze/OOM-Spikes (muss vor ML Imports wirken) ---
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+from resource_governor import ResourceGovernor, core_count, limit_thread_env
+
+# --- Ressourcen-Budget statt harter Limits (batch 1 / 1 Thread) gegen OOM-SIGKILL ---
+# RSS-Budget in MB und maximale Cores; der Governor tastet sich an Batchgröße/Threads heran
+# (als Split-Job von run_all.py --jobs N: nur der zugeteilte Core-Slice)
+RSS_BUDGET_MB = 6000
+CORE_BUDGET = core_count()
+
+# muss vor ML Imports wirken
+limit_thread_env(CORE_BUDGET)
 
 ROOT = Path(__file__).resolve().parents[1]
 
@@ -19,15 +22,38 @@ QUESTION_ENCODER = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-encoder"
 DOCUMENT_INDEX = str(ROOT / "data/index/mitre_index")
 
 
-# Noch konservativer, weil du SIGKILL gesehen hast:
-TOP_K = "10"
-BATCH_SIZE = "1"
-NUM_WORKERS = "0"
+TOP_K = 10
+# Ranking wird einmal bis K_MAX gespeichert (<out>.topk/), TOP_K <= K_MAX wird daraus nur geschnitten
+# -> TOP_K-Änderungen kosten Sekunden statt eines Retriever-Laufs (None = direkt mit TOP_K)
+K_MAX = 100
+# Startwert, falls noch keine Governor-Einstellungen gespeichert sind
+START_TOKENS_PER_BATCH = 2048
+MAX_BATCH_SIZE = 256
 
 DEVICE = "cpu"
 INDEX_DEVICE = "cpu"     # <<< wichtig: explizit setzen
 PRECISION = "fp16"
 
+# Ausgabe in Shards: nach Abbruch (SIGKILL) geht max. ein Shard-Rest verloren.
+# Nur ohne K_MAX: der Top-K_MAX-Speicher setzt nach einem Abbruch selbst nach der letzten Zeile fort
+SHARD_SIZE = 2000
+
+# Wörterbuch-Fast-Path (dictionary_linker.py): exakte IDs/Titel/Aliases aus der KB werden gepinnt,
+# "unresolved" = Encoder nur für Windows ohne exakten Treffer, Rest-Slots per BM25 (--bm25, sonst leer)
+# (None = aus)
+DICTIONARY_KB = None     # z.B. ROOT / "data/index/mitre_documents.jsonl"
+DENSE_POLICY = "unresolved"
+
+# hybrides Retrieval: BM25-Index (bm25_index.py build) + Dense, per Reciprocal Rank Fusion (None = nur Dense)
+BM25_INDEX = None        # z.B. ROOT / "data/index/bm25"
+FUSION_DEPTH = 50
+
+# nur in diesen Entity-Typ-Partitionen suchen (metadata.entity_type, z.B. ["TECHNIQUE", "TACTIC"]; None = alle)
+CANDIDATE_TYPES = None
+
+# Embedding-Cache: unveränderte Window-Texte werden nicht neu encodiert (None = aus)
+EMBEDDING_CACHE_DIR = ROOT / "data/cache/query_embeddings"
+
 WIN_DIR = ROOT / "data/windowed/relik"
 OUT_DIR = ROOT / "data/candidates/relik"
 OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -38,31 +64,96 @@ SPLITS = [
     ("test",  WIN_DIR / "test.window.jsonl",  OUT_DIR / "test.window.candidates.jsonl"),
 ]
 
-def run_add_candidates(inp: Path, out: Path) -> None:
-    out.parent.mkdir(parents=True, exist_ok=True)
-    cmd = [
-        sys.executable, "-m", "relik.cli.cli",
-        "retriever", "add-candidates",
-        QUESTION_ENCODER, DOCUMENT_INDEX,
-        str(inp), str(out),
-        "--top-k", TOP_K,
-        "--batch-size", BATCH_SIZE,
-        "--num-workers", NUM_WORKERS,
-        "--device", DEVICE,
-        "--index-device", INDEX_DEVICE,  # <<< neu
-        "--precision", PRECISION,
-        "--no-log-recall",
-    ]
-    print("RUN:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
+def build_generator(
+    question_encoder: str = QUESTION_ENCODER,
+    document_index: str = DOCUMENT_INDEX,
+    rss_budget_mb: float = RSS_BUDGET_MB,
+    cores: int = CORE_BUDGET,
+    dictionary: Optional[Path] = DICTIONARY_KB,
+    dense_policy: str = DENSE_POLICY,
+    types: Optional[Sequence[str]] = CANDIDATE_TYPES,
+    bm25: Optional[Path] = BM25_INDEX,
+    fusion_depth: int = FUSION_DEPTH,
+):
+    """CandidateGenerator with resource governor and embedding cache (this script and run_all.py in-process)."""
+    from bm25_index import BM25Index
+    from candidates import CandidateGenerator
+    from dictionary_linker import DictionaryLinker, warn_without_bm25
+
+    warn_without_bm25(dictionary, dense_policy, bm25)
+    # RSS-Baseline misst der CandidateGenerator nach dem Laden von Encoder/Index neu (governor.rebase())
+    governor = ResourceGovernor(
+        rss_budget_mb=rss_budget_mb,
+        cores=cores,
+        key=f"{question_encoder}|{DEVICE}|{PRECISION}",
+        start_tokens=START_TOKENS_PER_BATCH,
+        max_batch_size=MAX_BATCH_SIZE,
+    )
+    return CandidateGenerator(
+        question_encoder=question_encoder,
+        document_index=document_index,
+        device=DEVICE,
+        index_device=INDEX_DEVICE,
+        precision=PRECISION,
+        max_batch_size=MAX_BATCH_SIZE,
+        cache_dir=EMBEDDING_CACHE_DIR,
+        governor=governor,
+        dictionary=DictionaryLinker.from_kb(dictionary) if dictionary else None,
+        dense_policy=dense_policy,
+        types=types,
+        lexical=BM25Index.load(bm25) if bm25 else None,
+        fusion_depth=fusion_depth,
+    )
+
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="window jsonl -> window candidates jsonl")
+    parser.add_argument("--split", action="append", choices=[name for name, _, _ in SPLITS],
+                        help="only this split (repeatable; default: all)")
+    parser.add_argument("--question-encoder", default=QUESTION_ENCODER)
+    parser.add_argument("--document-index", default=DOCUMENT_INDEX)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--k-max", type=int, default=K_MAX, help="stored ranking depth (0 = no ranking store)")
+    parser.add_argument("--min-score", type=float, default=None, help="drop candidates below this score")
+    parser.add_argument("--rss-budget-mb", type=float, default=RSS_BUDGET_MB)
+    parser.add_argument("--dictionary", type=Path, default=DICTIONARY_KB,
+                        help="KB documents jsonl for the exact-match fast path (default: off)")
+    parser.add_argument("--dense-policy", choices=["always", "unresolved"], default=DENSE_POLICY,
+                        help="with --dictionary: dense retrieval for every window or only for unresolved ones")
+    parser.add_argument("--types", nargs="+", default=CANDIDATE_TYPES,
+                        help="search only these entity-type partitions of the index (default: all)")
+    parser.add_argument("--bm25", type=Path, default=BM25_INDEX,
+                        help="BM25 index dir: fuse dense and lexical rankings by RRF (default: dense only)")
+    parser.add_argument("--fusion-depth", type=int, default=FUSION_DEPTH, help="with --bm25: depth of each ranking")
+    args = parser.parse_args()
+
+    from window_store import window_source
+
+    # Encoder + Index nur einmal laden, für alle Splits
+    generator = build_generator(
+        question_encoder=args.question_encoder,
+        document_index=args.document_index,
+        rss_budget_mb=args.rss_budget_mb,
+        dictionary=args.dictionary,
+        dense_policy=args.dense_policy,
+        types=args.types,
+        bm25=args.bm25,
+        fusion_depth=args.fusion_depth,
+    )
+
     for name, inp, out in SPLITS:
+        if args.split and name not in args.split:
+            continue
+        # gepackter Window-Store (create_windows.py --pack) hat Vorrang, sonst jsonl
+        inp = window_source(inp)
         if not inp.exists():
             print(f"[{name}] missing input: {inp}")
             continue
         print(f"\n==> [{name}] {inp} -> {out}")
-        run_add_candidates(inp, out)
+        k_max = args.k_max or None
+        n = generator.add_candidates(inp, out, top_k=args.top_k, shard_size=None if k_max else SHARD_SIZE,
+                                     k_max=k_max, min_score=args.min_score)
+        print(f"[{name}] wrote {n} windows")
 
     print("\n✅ candidates created")
 
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Benchmark-Suite für die Pipeline-Stages (Durchsatz, Latenz, Peak-RSS) mit Baseline-Vergleich.
+
+Stages:   convert, windows, candidates, reader_train, inference
+Korpora:  "bundled" = data/raw/annoctr/linking_mitre_only (alle vorhandenen Splits),
+          "synthetic_x<N>" = bundled N-mal repliziert (Dokumente umbenannt, Kontexte leicht
+          verändert, damit Dedup/Cache die Kopien nicht wegoptimieren)
+
+Jede Stage läuft pro Korpus in einem eigenen (spawn-)Prozess, damit Peak-RSS
+(ru_maxrss) pro Stage gemessen wird. Ergebnis pro Stage:
+  docs_per_s, windows_per_s, latency_ms {p50, p90, p99, max}, peak_rss_mb
+Latenz = Zeit pro Einheit der Stage (Roh-Zeile, Dokument, Candidate-Batch,
+Train-Step, Window). Stages ohne installierte Abhängigkeit (relik, torch) werden
+als "skipped" vermerkt und beim Vergleich ignoriert.
+
+  python src/benchmark.py run --scales 1 4 16 --save-baseline
+  python src/benchmark.py run --scales 1 4 16                  # vergleicht gegen die Baseline
+  python src/benchmark.py compare data/bench/latest.json --max-throughput-drop 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from queue import Empty
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+RAW_DIR = ROOT / "data/raw/annoctr/linking_mitre_only"
+BENCH_DIR = ROOT / "data/bench"
+WORK_DIR = ROOT / "data/cache/bench"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+LATEST_FILE = BENCH_DIR / "latest.json"
+
+STAGES = ["convert", "windows", "candidates", "reader_train", "inference"]
+SCALES = [1, 4]
+
+# candidate generation (no embedding cache: every run encodes everything)
+QUESTION_ENCODER = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-encoder"
+DOCUMENT_INDEX = str(ROOT / "data/index/mitre_index")
+TOP_K = 10
+CANDIDATE_BATCH = 256
+
+# reader
+READER_CONFIG = ROOT / "configs/reader/base.yaml"
+READER_TRAIN_STEPS = 20
+READER_MODEL = "sapienzanlp/relik-reader-deberta-v3-base-aida"
+# windows predicted one by one for the inference latency
+INFERENCE_WINDOWS = 200
+
+# seconds between liveness checks while waiting for a stage result
+RESULT_POLL_S = 1.0
+
+# default regression thresholds (relative to the baseline)
+MAX_THROUGHPUT_DROP = 0.10
+MAX_LATENCY_INCREASE = 0.20
+MAX_RSS_INCREASE = 0.15
+
+PERCENTILES = (50, 90, 99)
+THROUGHPUT_KEYS = ("docs_per_s", "windows_per_s")
+
+
+# --- corpora ---
+
+def bundled_splits() -> List[Path]:
+    return [p for p in (RAW_DIR / f"{s}.jsonl" for s in ("train", "val", "test")) if p.exists()]
+
+
+def synthetic_rows(lines: Sequence[str], scale: int) -> Iterator[str]:
+    """`scale` copies of the raw rows; copy c>0 gets its own report names and a context suffix."""
+    for c in range(scale):
+        for line in lines:
+            if c == 0:
+                yield line if line.endswith("\n") else line + "\n"
+                continue
+            ex = json.loads(line)
+            ex["document"] = f"{ex.get('document')}#syn{c}"
+            for key in ("context_right", "_context_right"):
+                if key in ex and ex[key] is not None:
+                    ex[key] = f"{ex[key]} [copy {c}]"
+            yield json.dumps(ex) + "\n"
+
+
+def make_corpus(scale: int, work_dir: Path = WORK_DIR) -> Path:
+    """Raw input of one corpus: <work_dir>/<name>/raw.jsonl (rebuilt if the bundled data changed)."""
+    name = "bundled" if scale == 1 else f"synthetic_x{scale}"
+    corpus = work_dir / name
+    raw = corpus / "raw.jsonl"
+    sources = bundled_splits()
+    if not sources:
+        raise FileNotFoundError(f"no raw splits in {RAW_DIR}")
+    newest = max(p.stat().st_mtime for p in sources)
+    if raw.exists() and raw.stat().st_mtime >= newest:
+        return corpus
+
+    if corpus.exists():
+        shutil.rmtree(corpus)
+    corpus.mkdir(parents=True)
+    lines = [line for p in sources for line in p.read_text(encoding="utf-8").splitlines() if line.strip()]
+    with raw.open("w", encoding="utf-8") as f:
+        f.writelines(synthetic_rows(lines, scale))
+    return corpus
+
+
+def count_lines(path: Path) -> int:
+    with path.open("rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+# --- measurements ---
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process and its (finished) children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak = max(own, children)
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    out = {f"p{p}": round(float(np.percentile(ms, p)), 3) for p in PERCENTILES}
+    out["max"] = round(float(ms.max()), 3)
+    out["n"] = int(len(ms))
+    return out
+
+
+def timed(fn: Callable[[], Any], latencies: List[float]) -> Any:
+    t0 = time.perf_counter()
+    result = fn()
+    latencies.append(time.perf_counter() - t0)
+    return result
+
+
+# --- stages (each runs in its own process, paths relative to the corpus dir) ---
+
+def bench_convert(corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    from convert_annoctr_to_relik import convert_example, convert_split
+    from jsonl_io import loads
+
+    raw, out = corpus / "raw.jsonl", corpus / "processed.jsonl"
+    workers = opts["workers"]
+
+    t0 = time.perf_counter()
+    if workers > 1:
+        with mp.Pool(workers) as pool:
+            convert_split("bench", raw, out, opts["group_by_document"], pool=pool, workers=workers)
+    else:
+        convert_split("bench", raw, out, opts["group_by_document"])
+    seconds = time.perf_counter() - t0
+
+    # per-row latency: single-threaded pass over the same rows
+    latencies: List[float] = []
+    with raw.open("rb") as f:
+        for i, line in enumerate(f):
+            ex = loads(line)
+            timed(lambda: convert_example(i, ex), latencies)
+
+    return {"seconds": seconds, "docs": count_lines(raw), "latencies": latencies, "latency_unit": "raw row"}
+
+
+def bench_windows(corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    from create_windows import build_windows, iter_batches, load_tokenizer, window_split
+
+    inp, out = corpus / "processed.jsonl", corpus / "windows.jsonl"
+    nlp = load_tokenizer()
+
+    t0 = time.perf_counter()
+    n_windows = window_split(nlp, inp, out, n_process=opts["workers"])
+    seconds = time.perf_counter() - t0
+
+    # per-document latency: tokenize + build windows
+    latencies: List[float] = []
+    for batch in iter_batches(inp, 10_000):
+        for doc in batch:
+            timed(lambda: list(build_windows(doc, [(t.text, t.idx) for t in nlp(doc["doc_text"])], None)),
+                  latencies)
+
+    return {"seconds": seconds, "docs": count_lines(inp), "windows": n_windows, "latencies": latencies,
+            "latency_unit": "document"}
+
+
+def bench_candidates(corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    from candidates import CandidateGenerator, iter_buffers, iter_windows
+
+    inp, out = corpus / "windows.jsonl", corpus / "candidates.jsonl"
+    generator = CandidateGenerator(question_encoder=opts["question_encoder"], document_index=opts["document_index"])
+
+    # same loop as CandidateGenerator.add_candidates, timed per batch
+    latencies: List[float] = []
+    n = 0
+    t0 = time.perf_counter()
+    with out.open("w", encoding="utf-8") as fout:
+        for windows in iter_buffers(iter_windows(inp), CANDIDATE_BATCH):
+            timed(lambda: generator.annotate(windows, opts["top_k"]), latencies)
+            fout.writelines(json.dumps(w) + "\n" for w in windows)
+            n += len(windows)
+    seconds = time.perf_counter() - t0
+
+    docs = len({w["doc_id"] for w in iter_windows(inp)})
+    return {"seconds": seconds, "docs": docs, "windows": n, "latencies": latencies,
+            "latency_unit": f"batch of {CANDIDATE_BATCH} windows"}
+
+
+def bench_reader_train(corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    from lightning.pytorch import Callback, Trainer
+    from omegaconf import OmegaConf
+    from relik.reader.reader import Reader
+
+    cands = str(corpus / "candidates.jsonl")
+    cfg = OmegaConf.load(READER_CONFIG)
+    cfg.data.train_dataset_path = cands
+    cfg.data.val_dataset_path = cands
+    cfg.data.test_dataset_path = cands
+
+    latencies: List[float] = []
+
+    class StepTimer(Callback):
+        def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+            self.t0 = time.perf_counter()
+
+        def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+            latencies.append(time.perf_counter() - self.t0)
+
+    model = Reader(cfg)
+    trainer = Trainer(max_steps=opts["train_steps"], accelerator="cpu", devices=1, logger=False,
+                      enable_checkpointing=False, limit_val_batches=0, callbacks=[StepTimer()])
+    t0 = time.perf_counter()
+    trainer.fit(model)
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds, "steps": len(latencies), "latencies": latencies, "latency_unit": "train step"}
+
+
+def bench_inference(corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    from relik.reader.data.relik_reader_sample import RelikReaderSample
+    from relik.reader.pytorch_modules.span import RelikReaderForSpanExtraction
+
+    from candidates import iter_windows
+
+    reader = RelikReaderForSpanExtraction(opts["reader_model"], device="cpu")
+    windows = []
+    for w in iter_windows(corpus / "candidates.jsonl"):
+        windows.append(w)
+        if len(windows) >= opts["inference_windows"]:
+            break
+    if windows:
+        # warm-up (lazy weight init, first allocation)
+        reader.read(samples=[RelikReaderSample(**windows[0])], max_batch_size=1, progress_bar=False)
+
+    latencies: List[float] = []
+    t0 = time.perf_counter()
+    for w in windows:
+        timed(lambda: reader.read(samples=[RelikReaderSample(**w)], max_batch_size=1, progress_bar=False),
+              latencies)
+    seconds = time.perf_counter() - t0
+    return {"seconds": seconds, "docs": len({w["doc_id"] for w in windows}), "windows": len(windows),
+            "latencies": latencies, "latency_unit": "window"}
+
+
+BENCHES: Dict[str, Callable[[Path, Dict[str, Any]], Dict[str, Any]]] = {
+    "convert": bench_convert,
+    "windows": bench_windows,
+    "candidates": bench_candidates,
+    "reader_train": bench_reader_train,
+    "inference": bench_inference,
+}
+# input file each stage needs from the previous one
+NEEDS = {
+    "windows": "processed.jsonl",
+    "candidates": "windows.jsonl",
+    "reader_train": "candidates.jsonl",
+    "inference": "candidates.jsonl",
+}
+
+
+def _child(stage: str, corpus: str, opts: Dict[str, Any], queue) -> None:
+    try:
+        raw = BENCHES[stage](Path(corpus), opts)
+    except ImportError as e:
+        queue.put({"skipped": f"missing dependency: {e}"})
+        return
+    except Exception as e:  # noqa: BLE001 - reported as stage error, the suite continues
+        queue.put({"error": repr(e)})
+        return
+    raw["peak_rss_mb"] = peak_rss_mb()
+    queue.put(raw)
+
+
+def summarize(raw: Dict[str, Any]) -> Dict[str, Any]:
+    if "skipped" in raw or "error" in raw:
+        return raw
+    seconds = max(raw["seconds"], 1e-9)
+    out: Dict[str, Any] = {"seconds": round(raw["seconds"], 3)}
+    if "docs" in raw:
+        out["docs"] = raw["docs"]
+        out["docs_per_s"] = round(raw["docs"] / seconds, 2)
+    if "windows" in raw:
+        out["windows"] = raw["windows"]
+        out["windows_per_s"] = round(raw["windows"] / seconds, 2)
+    if "steps" in raw:
+        out["steps"] = raw["steps"]
+        out["steps_per_s"] = round(raw["steps"] / seconds, 3)
+    out["latency_ms"] = latency_summary(raw["latencies"])
+    out["latency_unit"] = raw["latency_unit"]
+    out["peak_rss_mb"] = round(raw["peak_rss_mb"], 1)
+    return out
+
+
+def run_stage(stage: str, corpus: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    need = NEEDS.get(stage)
+    if need and not (corpus / need).exists():
+        return {"skipped": f"no {need} (upstream stage did not run)"}
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(stage, str(corpus), opts, queue))
+    proc.start()
+    # read before join: the child only exits once its result (latency lists can exceed the
+    # pipe buffer) has been consumed
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=RESULT_POLL_S)
+        except Empty:
+            if not proc.is_alive():
+                break
+    if result is None:
+        # the child may have put its result right before exiting
+        try:
+            result = queue.get(timeout=RESULT_POLL_S)
+        except Empty:
+            pass
+    proc.join()
+    if result is None:
+        return {"error": f"benchmark process exited with {proc.exitcode} without a result"}
+    return result
+
+
+def merge_repeats(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median throughput/seconds over the repeats, pooled latencies, max peak RSS."""
+    ok = [r for r in runs if "skipped" not in r and "error" not in r]
+    if not ok:
+        return runs[0]
+    merged = dict(ok[0])
+    merged["seconds"] = float(np.median([r["seconds"] for r in ok]))
+    merged["latencies"] = [x for r in ok for x in r["latencies"]]
+    merged["peak_rss_mb"] = max(r["peak_rss_mb"] for r in ok)
+    return merged
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def run_suite(stages: Sequence[str], scales: Sequence[int], opts: Dict[str, Any], repeat: int = 1,
+              work_dir: Path = WORK_DIR) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"environment": environment(), "options": opts, "corpora": {}}
+    for scale in scales:
+        corpus = make_corpus(scale, work_dir)
+        rows = count_lines(corpus / "raw.jsonl")
+        print(f"\n==> corpus {corpus.name} ({rows} raw rows)")
+        entry = {"scale": scale, "raw_rows": rows, "stages": {}}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            summary = summarize(merge_repeats([run_stage(stage, corpus, opts) for _ in range(repeat)]))
+            entry["stages"][stage] = summary
+            print(f"  {stage:<13} {format_summary(summary)}")
+        results["corpora"][corpus.name] = entry
+    return results
+
+
+def format_summary(s: Dict[str, Any]) -> str:
+    if "skipped" in s:
+        return f"skipped ({s['skipped']})"
+    if "error" in s:
+        return f"ERROR {s['error']}"
+    parts = [f"{s['seconds']:.2f}s"]
+    for key in THROUGHPUT_KEYS + ("steps_per_s",):
+        if key in s:
+            parts.append(f"{s[key]} {key.replace('_per_s', '/s')}")
+    lat = s.get("latency_ms") or {}
+    if lat:
+        parts.append(f"p50 {lat['p50']}ms p99 {lat['p99']}ms")
+    parts.append(f"rss {s['peak_rss_mb']}MB")
+    return ", ".join(parts)
+
+
+# --- comparison ---
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_throughput_drop: float = MAX_THROUGHPUT_DROP,
+            max_latency_increase: float = MAX_LATENCY_INCREASE,
+            max_rss_increase: float = MAX_RSS_INCREASE) -> List[Dict[str, Any]]:
+    """One row per compared metric; rows with `regression=True` exceed their threshold."""
+    rows = []
+
+    def add(corpus, stage, metric, base, new, change, limit):
+        rows.append({"corpus": corpus, "stage": stage, "metric": metric, "baseline": base, "current": new,
+                     "change": round(change, 4), "limit": limit, "regression": change > limit})
+
+    for corpus, entry in current.get("corpora", {}).items():
+        base_entry = baseline.get("corpora", {}).get(corpus)
+        if not base_entry:
+            continue
+        for stage, new in entry["stages"].items():
+            base = base_entry["stages"].get(stage)
+            if not base or any(k in new or k in base for k in ("skipped", "error")):
+                continue
+            for key in THROUGHPUT_KEYS + ("steps_per_s",):
+                if base.get(key) and key in new:
+                    # relative drop (positive = slower)
+                    add(corpus, stage, key, base[key], new[key], 1 - new[key] / base[key], max_throughput_drop)
+            for p in PERCENTILES:
+                key = f"p{p}"
+                b, n = base.get("latency_ms", {}).get(key), new.get("latency_ms", {}).get(key)
+                if b and n is not None:
+                    add(corpus, stage, f"latency_{key}_ms", b, n, n / b - 1, max_latency_increase)
+            if base.get("peak_rss_mb") and "peak_rss_mb" in new:
+                add(corpus, stage, "peak_rss_mb", base["peak_rss_mb"], new["peak_rss_mb"],
+                    new["peak_rss_mb"] / base["peak_rss_mb"] - 1, max_rss_increase)
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], current: Dict[str, Any], baseline: Dict[str, Any]) -> int:
+    env_new, env_base = current.get("environment", {}), baseline.get("environment", {})
+    if (env_new.get("machine"), env_new.get("cpus")) != (env_base.get("machine"), env_base.get("cpus")):
+        print(f"warning: baseline was recorded on {env_base.get('machine')} / {env_base.get('cpus')} cpus, "
+              f"this run on {env_new.get('machine')} / {env_new.get('cpus')} cpus")
+    print(f"\ncomparison against baseline {env_base.get('commit')} ({env_base.get('created')}):")
+    regressions = [r for r in rows if r["regression"]]
+    for r in rows:
+        flag = "REGRESSION" if r["regression"] else "ok"
+        print(f"  {r['corpus']:<16} {r['stage']:<13} {r['metric']:<18} "
+              f"{r['baseline']:>10} -> {r['current']:>10} ({r['change']:+.1%}, limit {r['limit']:.0%})  {flag}")
+    print(f"\n{len(regressions)} regression(s) in {len(rows)} compared metrics")
+    return len(regressions)
+
+
+def load_json(path: Path) -> Dict[str, Any]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_json(path: Path, obj: Any) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def add_threshold_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--max-throughput-drop", type=float, default=MAX_THROUGHPUT_DROP,
+                        help="allowed relative drop of docs/s, windows/s, steps/s")
+    parser.add_argument("--max-latency-increase", type=float, default=MAX_LATENCY_INCREASE,
+                        help="allowed relative increase of p50/p90/p99 latency")
+    parser.add_argument("--max-rss-increase", type=float, default=MAX_RSS_INCREASE,
+                        help="allowed relative increase of peak RSS")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="pipeline benchmarks + regression check")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="run the benchmarks (and compare against the baseline if one exists)")
+    p_run.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    p_run.add_argument("--scales", nargs="+", type=int, default=SCALES,
+                       help="1 = bundled data, N > 1 = synthetic corpus with N copies")
+    p_run.add_argument("--repeat", type=int, default=1)
+    p_run.add_argument("--workers", type=int, default=1, help="converter workers / spaCy processes")
+    p_run.add_argument("--group-by-document", action="store_true")
+    p_run.add_argument("--question-encoder", default=QUESTION_ENCODER)
+    p_run.add_argument("--document-index", default=DOCUMENT_INDEX)
+    p_run.add_argument("--top-k", type=int, default=TOP_K)
+    p_run.add_argument("--train-steps", type=int, default=READER_TRAIN_STEPS)
+    p_run.add_argument("--reader-model", default=READER_MODEL)
+    p_run.add_argument("--inference-windows", type=int, default=INFERENCE_WINDOWS)
+    p_run.add_argument("--out", type=Path, default=LATEST_FILE)
+    p_run.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    add_threshold_args(p_run)
+
+    p_cmp = sub.add_parser("compare", help="compare a stored result against the baseline")
+    p_cmp.add_argument("result", type=Path)
+    add_threshold_args(p_cmp)
+
+    args = parser.parse_args()
+    thresholds = dict(max_throughput_drop=args.max_throughput_drop, max_latency_increase=args.max_latency_increase,
+                      max_rss_increase=args.max_rss_increase)
+
+    if args.cmd == "run":
+        opts = {
+            "workers": args.workers,
+            "group_by_document": args.group_by_document,
+            "question_encoder": args.question_encoder,
+            "document_index": args.document_index,
+            "top_k": args.top_k,
+            "train_steps": args.train_steps,
+            "reader_model": args.reader_model,
+            "inference_windows": args.inference_windows,
+        }
+        current = run_suite(args.stages, args.scales, opts, repeat=args.repeat)
+        write_json(args.out, current)
+        print(f"\nresults -> {args.out}")
+        if args.save_baseline:
+            write_json(args.baseline, current)
+            print(f"baseline -> {args.baseline}")
+            return
+    else:
+        current = load_json(args.result)
+
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline} (create one with `run --save-baseline`)")
+        return
+    baseline = load_json(args.baseline)
+    n = print_comparison(compare(current, baseline, **thresholds), current, baseline)
+    if n:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Lexikalischer BM25-Index über die KB-Dokumente, als zweite Quelle neben dem Dense-Retriever.
+
+Pro Dokument werden ID, Titel und Aliases (TITLE_BOOST-fach gewichtet) sowie die
+Beschreibung indexiert: `metadata.description` (build_mitre_documents.py), für
+ältere KB-Dateien ohne Beschreibung das Roh-Feld `label` aus den AnnoCTR-Splits.
+
+  data/index/bm25/
+    bm25_index.json   k1, b, Zeilen, Terme, Fingerprint der KB
+    terms.json        Terme in Zeilen-Reihenfolge der Postings
+    indptr.npy        int64   [terms + 1]   CSR-Zeiger pro Term
+    doc_ids.npy       int32   [postings]    Dokument-Zeilen, pro Term aufsteigend
+    impacts.npy       float32 [postings]    fertiger BM25-Beitrag idf * tf-Sättigung
+    documents.jsonl   {"text", "entity_type"} pro Zeile (Candidate-Text wie im Dense-Index)
+
+Eine Query kostet nur noch das Aufsummieren der Postings ihrer Terme (np.bincount).
+`reciprocal_rank_fusion` mischt BM25- und Dense-Rankings (benutzt von candidates.py).
+
+  python src/bm25_index.py build
+  python src/bm25_index.py search "spearphishing attachment with a malicious macro"
+  python src/bm25_index.py fuse data/candidates/relik/val.window.candidates.jsonl /tmp/val.hybrid.jsonl
+  python src/retriever_recall.py --splits val --candidates-dir /tmp   # recall@k vorher/nachher
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+KB_FILE = ROOT / "data/index/mitre_documents.jsonl"
+RAW_DIR = ROOT / "data/raw/annoctr/linking_mitre_only"
+BM25_DIR = ROOT / "data/index/bm25"
+
+META_FILE = "bm25_index.json"
+SPLITS = ["train", "val", "test"]
+
+K1 = 1.2
+B = 0.75
+# ID, title and aliases count this many times (short fields, most specific terms)
+TITLE_BOOST = 3
+
+# reciprocal rank fusion: score = sum 1 / (RRF_K + rank); depth taken from each ranking
+RRF_K = 60
+FUSION_DEPTH = 50
+
+# sub-technique IDs stay one token ("t1055.001")
+TOKEN = re.compile(r"[0-9a-z]+(?:\.[0-9]+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have in into is it its may of on or that the their this to "
+    "used uses using was were which with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN.findall(text.casefold()) if t not in STOPWORDS]
+
+
+def raw_descriptions(raw_dir: Path, splits: Sequence[str]) -> Dict[str, str]:
+    """KB id -> cleaned AnnoCTR `label` description (first one seen)."""
+    from build_mitre_documents import iter_raw_docs
+
+    out: Dict[str, str] = {}
+    for doc in iter_raw_docs(raw_dir, list(splits)):
+        description = doc["metadata"].get("description")
+        if description:
+            out.setdefault(doc["id"], description)
+    return out
+
+
+def index_text(doc: Dict[str, Any], description: str = "") -> str:
+    meta = doc.get("metadata") or {}
+    names = [str(doc.get("id", "")), meta.get("title") or doc.get("text", "")] + list(meta.get("aliases") or [])
+    return " ".join(names * TITLE_BOOST + [meta.get("description") or description])
+
+
+class BM25Index:
+    """CSR postings with precomputed BM25 impacts; all arrays may be memory-mapped."""
+
+    def __init__(self, terms: List[str], indptr: np.ndarray, doc_ids: np.ndarray, impacts: np.ndarray,
+                 documents: List[Dict[str, Any]], meta: Dict[str, Any]):
+        self.term_ids = {t: i for i, t in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.texts = [d["text"] for d in documents]
+        self.entity_types = [d.get("entity_type") for d in documents]
+        self.meta = meta
+        from mmap_index import partition_rows
+
+        self.partitions = partition_rows([{"metadata": {"entity_type": t}} for t in self.entity_types])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def fingerprint(self) -> str:
+        return self.meta["fingerprint"]
+
+    @classmethod
+    def build(cls, documents: Sequence[Dict[str, Any]], descriptions: Optional[Dict[str, str]] = None,
+              k1: float = K1, b: float = B, fingerprint: str = "") -> "BM25Index":
+        descriptions = descriptions or {}
+        counts = [Counter(tokenize(index_text(d, descriptions.get(d.get("id"), "")))) for d in documents]
+        lengths = np.asarray([sum(c.values()) for c in counts], dtype=np.float32)
+        avgdl = float(lengths.mean()) if len(lengths) else 0.0
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for row, c in enumerate(counts):
+            for term, tf in c.items():
+                postings.setdefault(term, []).append((row, tf))
+        terms = sorted(postings)
+        n = len(documents)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids = np.empty(sum(len(p) for p in postings.values()), dtype=np.int32)
+        impacts = np.empty(len(doc_ids), dtype=np.float32)
+        pos = 0
+        for i, term in enumerate(terms):
+            rows = np.asarray([r for r, _ in postings[term]], dtype=np.int32)
+            tf = np.asarray([f for _, f in postings[term]], dtype=np.float32)
+            idf = np.log1p((n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = k1 * (1 - b + b * lengths[rows] / avgdl)
+            doc_ids[pos:pos + len(rows)] = rows
+            impacts[pos:pos + len(rows)] = idf * tf * (k1 + 1) / (tf + norm)
+            pos += len(rows)
+            indptr[i + 1] = pos
+
+        docs = [{"text": d["text"], "entity_type": (d.get("metadata") or {}).get("entity_type")} for d in documents]
+        meta = {"k1": k1, "b": b, "rows": n, "terms": len(terms), "postings": int(pos),
+                "avgdl": round(avgdl, 3), "fingerprint": fingerprint}
+        return cls(terms, indptr, doc_ids, impacts, docs, meta)
+
+    def save(self, out_dir: Path) -> None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        np.save(out_dir / "indptr.npy", self.indptr)
+        np.save(out_dir / "doc_ids.npy", self.doc_ids)
+        np.save(out_dir / "impacts.npy", self.impacts)
+        terms = sorted(self.term_ids, key=self.term_ids.get)
+        (out_dir / "terms.json").write_text(json.dumps(terms, ensure_ascii=False), encoding="utf-8")
+        with (out_dir / "documents.jsonl").open("w", encoding="utf-8") as f:
+            for text, entity_type in zip(self.texts, self.entity_types):
+                f.write(json.dumps({"text": text, "entity_type": entity_type}, ensure_ascii=False) + "\n")
+        # meta last: its presence marks a complete index
+        (out_dir / META_FILE).write_text(json.dumps(self.meta, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BM25Index":
+        path = Path(path)
+        meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+        terms = json.loads((path / "terms.json").read_text(encoding="utf-8"))
+        with (path / "documents.jsonl").open(encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        return cls(terms, np.load(path / "indptr.npy", mmap_mode="r"), np.load(path / "doc_ids.npy", mmap_mode="r"),
+                   np.load(path / "impacts.npy", mmap_mode="r"), documents, meta)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for one query (float32 [rows])."""
+        ids = [self.term_ids[t] for t in set(tokenize(query)) if t in self.term_ids]
+        if not ids:
+            return np.zeros(len(self), dtype=np.float32)
+        rows = np.concatenate([self.doc_ids[self.indptr[i]:self.indptr[i + 1]] for i in ids])
+        weights = np.concatenate([self.impacts[self.indptr[i]:self.indptr[i + 1]] for i in ids])
+        return np.bincount(rows, weights=weights, minlength=len(self)).astype(np.float32)
+
+    def rows_for(self, types: Sequence[str]) -> np.ndarray:
+        parts = [self.partitions[t] for t in types if t in self.partitions]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def search(self, queries: Sequence[str], k: int,
+               types: Optional[Sequence[str]] = None) -> List[Tuple[List[str], List[float]]]:
+        """(document texts, scores) per query, best first; documents without a shared term are left out."""
+        subset = self.rows_for(types) if types is not None else None
+        out = []
+        for query in queries:
+            scores = self.scores(query)
+            if subset is not None:
+                masked = np.zeros_like(scores)
+                masked[subset] = scores[subset]
+                scores = masked
+            hits = np.flatnonzero(scores)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.lexsort((hits, -scores[hits]))]
+            out.append(([self.texts[r] for r in hits], [float(scores[r]) for r in hits]))
+        return out
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int, rrf_k: int = RRF_K,
+                           depth: int = FUSION_DEPTH) -> Tuple[List[str], List[float]]:
+    """Top-k texts by sum of 1 / (rrf_k + rank) over the rankings (rank 1-based, first `depth` of each)."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, text in enumerate(ranking[:depth], start=1):
+            fused[text] = fused.get(text, 0.0) + 1.0 / (rrf_k + rank)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+    return [t for t, _ in best], [round(s, 6) for _, s in best]
+
+
+def kb_fingerprint(documents: Path, raw_dir: Path, splits: Sequence[str], k1: float, b: float) -> str:
+    h = hashlib.sha1(Path(documents).read_bytes())
+    for split in splits:
+        raw = raw_dir / f"{split}.jsonl"
+        if raw.exists():
+            st = raw.stat()
+            h.update(f"|{split}:{st.st_size}:{st.st_mtime_ns}".encode())
+    h.update(f"|{k1}|{b}|{TITLE_BOOST}".encode())
+    return h.hexdigest()
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def fuse_file(index: BM25Index, inp: Path, out: Path, top_k: int, depth: int = FUSION_DEPTH) -> int:
+    """Re-ranks stored (dense) `span_candidates` with BM25 via RRF, without the encoder; returns #windows."""
+    n = 0
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as fout:
+        for window in iter_jsonl(inp):
+            types = window.get("candidate_types")
+            (lexical, _), = index.search([window["text"]], depth, types)
+            texts, scores = reciprocal_rank_fusion([window.get("span_candidates") or [], lexical], top_k,
+                                                   depth=depth)
+            window["span_candidates"], window["span_candidates_scores"] = texts, scores
+            fout.write(json.dumps(window) + "\n")
+            n += 1
+    return n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="BM25 inverted index over the KB + RRF fusion with dense candidates")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="KB documents jsonl -> BM25 index dir")
+    p.add_argument("--documents", type=Path, default=KB_FILE)
+    p.add_argument("--raw-dir", type=Path, default=RAW_DIR, help="descriptions for KB entries without one")
+    p.add_argument("--splits", nargs="+", default=SPLITS)
+    p.add_argument("--out", type=Path, default=BM25_DIR)
+    p.add_argument("--k1", type=float, default=K1)
+    p.add_argument("--b", type=float, default=B)
+
+    p = sub.add_parser("search", help="top-k KB documents for a query")
+    p.add_argument("query")
+    p.add_argument("--index", type=Path, default=BM25_DIR)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--types", nargs="+", default=None)
+
+    p = sub.add_parser("fuse", help="RRF of stored dense candidates and BM25 -> new candidates file")
+    p.add_argument("inp", type=Path)
+    p.add_argument("out", type=Path)
+    p.add_argument("--index", type=Path, default=BM25_DIR)
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--depth", type=int, default=FUSION_DEPTH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        documents = list(iter_jsonl(args.documents))
+        index = BM25Index.build(documents, raw_descriptions(args.raw_dir, args.splits), args.k1, args.b,
+                                kb_fingerprint(args.documents, args.raw_dir, args.splits, args.k1, args.b))
+        index.save(args.out)
+        print(f"✅ BM25 index: {index.meta['rows']} documents, {index.meta['terms']} terms, "
+              f"{index.meta['postings']} postings -> {args.out}")
+    elif args.command == "search":
+        index = BM25Index.load(args.index)
+        (texts, scores), = index.search([args.query], args.k, args.types)
+        for text, score in zip(texts, scores):
+            print(f"  {score:8.3f}  {text}")
+    else:
+        n = fuse_file(BM25Index.load(args.index), args.inp, args.out, args.top_k, args.depth)
+        print(f"✅ {n} windows -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
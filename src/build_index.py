@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Inkrementelles Update des Document-Index (`data/index/mitre_index`, relik InMemoryDocumentIndex)
+aus `mitre_documents.jsonl`.
+
+Pro Dokument wird ein Content-Hash (Encoder + embeddeter Text) in
+`<index>/doc_hashes.json` gespeichert. Beim nächsten Lauf:
+  - unveränderte Dokumente  -> Embedding-Zeile wird übernommen
+  - neue/geänderte          -> werden (gebatcht) neu embedded
+  - entfernte               -> fliegen aus Index und documents.jsonl
+Ein neues ATT&CK-Release kostet damit nur die Embeddings der geänderten Objekte.
+Ohne `doc_hashes.json` (Index mit `relik retriever create-index` gebaut, anderer
+Encoder) wird einmal alles embedded. Existiert `<index>/mmap/`, wird er aus den
+neuen Embeddings mitgeschrieben (mmap_index.write, ohne Encoder).
+
+  python src/build_index.py
+  python src/build_index.py --documents data/index/mitre_documents.jsonl --index data/index/mitre_index
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+DOCUMENTS = ROOT / "data/index/mitre_documents.jsonl"
+INDEX_DIR = ROOT / "data/index/mitre_index"
+
+ENCODER = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-encoder"
+PRECISION = "fp32"
+DEVICE = "cpu"
+BATCH_SIZE = 64
+MAX_LENGTH = 64
+
+HASH_FILE = "doc_hashes.json"
+DOCS_FILE = "documents.jsonl"
+EMBEDDINGS_FILE = "embeddings.pt"
+CONFIG_FILE = "config.yaml"
+CONFIG = """_target_: relik.retriever.indexers.inmemory.InMemoryDocumentIndex
+metadata_fields: []
+separator: null
+name_or_path: null
+"""
+
+TORCH_DTYPES = {"fp16": "float16", "bf16": "bfloat16", "fp32": "float32"}
+
+
+def content_hash(encoder: str, text: str) -> str:
+    return hashlib.sha1(f"{encoder}\n{text}".encode("utf-8")).hexdigest()
+
+
+def read_jsonl(path: Path) -> List[Dict[str, Any]]:
+    if not path.exists():
+        return []
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class PassageEncoder:
+    """Document-side encoder of the relik retriever (the question encoder if there is no separate one)."""
+
+    def __init__(self, encoder: str = ENCODER, device: str = DEVICE, max_length: int = MAX_LENGTH):
+        from relik.retriever import GoldenRetriever
+        from transformers import AutoTokenizer
+
+        self.retriever = GoldenRetriever(question_encoder=encoder, device=device)
+        self.retriever.eval()
+        self.model = getattr(self.retriever, "passage_encoder", None) or self.retriever.question_encoder
+        self.tokenizer = AutoTokenizer.from_pretrained(encoder)
+        self.device = device
+        self.max_length = max_length
+
+    def encode(self, texts: Sequence[str], batch_size: int = BATCH_SIZE) -> np.ndarray:
+        import torch
+
+        out = []
+        for a in range(0, len(texts), batch_size):
+            batch = self.tokenizer(list(texts[a:a + batch_size]), padding=True, truncation=True,
+                                   max_length=self.max_length, return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                out.append(self.model(**batch).pooler_output.float().cpu().numpy())
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def load_embeddings(index_dir: Path) -> np.ndarray:
+    import torch
+
+    path = index_dir / EMBEDDINGS_FILE
+    if not path.exists():
+        return np.zeros((0, 0), dtype=np.float32)
+    return torch.load(path, map_location="cpu").float().numpy()
+
+
+def save_index(index_dir: Path, documents: List[Dict[str, Any]], embeddings: np.ndarray, hashes: Dict[str, str],
+               encoder: str, precision: str) -> None:
+    """Writes documents, embeddings and hashes via temp files + rename (manifest last)."""
+    import torch
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    tmp_docs = index_dir / (DOCS_FILE + ".tmp")
+    with tmp_docs.open("w", encoding="utf-8") as f:
+        for doc in documents:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    tmp_emb = index_dir / (EMBEDDINGS_FILE + ".tmp")
+    tensor = torch.from_numpy(np.ascontiguousarray(embeddings)).to(getattr(torch, TORCH_DTYPES[precision]))
+    torch.save(tensor, tmp_emb)
+    if not (index_dir / CONFIG_FILE).exists():
+        (index_dir / CONFIG_FILE).write_text(CONFIG, encoding="utf-8")
+
+    os.replace(tmp_docs, index_dir / DOCS_FILE)
+    os.replace(tmp_emb, index_dir / EMBEDDINGS_FILE)
+    tmp_hashes = index_dir / (HASH_FILE + ".tmp")
+    tmp_hashes.write_text(json.dumps({"encoder": encoder, "precision": precision, "docs": hashes}, indent=1),
+                          encoding="utf-8")
+    os.replace(tmp_hashes, index_dir / HASH_FILE)
+
+
+def update_index(documents: Path, index_dir: Path, encoder: str = ENCODER, precision: str = PRECISION,
+                 device: str = DEVICE, batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Brings `index_dir` in line with `documents`; returns counts of added/changed/removed/unchanged docs."""
+    docs = read_jsonl(documents)
+    manifest_path = index_dir / HASH_FILE
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+    same_setup = manifest.get("encoder") == encoder and manifest.get("precision") == precision
+    old_hashes: Dict[str, str] = manifest.get("docs", {}) if same_setup else {}
+
+    old_rows: Dict[str, int] = {}
+    old_embeddings = np.zeros((0, 0), dtype=np.float32)
+    if old_hashes:
+        old_rows = {doc["id"]: row for row, doc in enumerate(read_jsonl(index_dir / DOCS_FILE))}
+        old_embeddings = load_embeddings(index_dir)
+        if len(old_embeddings) != len(old_rows):
+            print(f"  {index_dir}: {len(old_embeddings)} embeddings vs {len(old_rows)} documents -> full rebuild")
+            old_rows, old_hashes = {}, {}
+
+    hashes = {doc["id"]: content_hash(encoder, doc["text"]) for doc in docs}
+    reuse = [old_hashes.get(doc_id) == h and doc_id in old_rows for doc_id, h in hashes.items()]
+    todo = [i for i, keep in enumerate(reuse) if not keep]
+    counts = {
+        "added": sum(1 for i in todo if docs[i]["id"] not in old_hashes),
+        "changed": sum(1 for i in todo if docs[i]["id"] in old_hashes),
+        "removed": len(set(old_hashes) - set(hashes)),
+        "unchanged": len(docs) - len(todo),
+    }
+    if not todo and not counts["removed"] and len(old_rows) == len(docs):
+        return counts
+
+    new_vectors = PassageEncoder(encoder, device).encode([docs[i]["text"] for i in todo], batch_size) if todo else None
+    dim = new_vectors.shape[1] if new_vectors is not None else old_embeddings.shape[1]
+    embeddings = np.zeros((len(docs), dim), dtype=np.float32)
+    keep_rows = [i for i, keep in enumerate(reuse) if keep]
+    if keep_rows:
+        embeddings[keep_rows] = old_embeddings[[old_rows[docs[i]["id"]] for i in keep_rows]]
+    if todo:
+        embeddings[todo] = new_vectors
+
+    save_index(index_dir, docs, embeddings, hashes, encoder, precision)
+
+    from mmap_index import has_mmap_index, mmap_dir_for, write
+
+    if has_mmap_index(index_dir):
+        meta = json.loads((mmap_dir_for(index_dir) / "mmap_index.json").read_text(encoding="utf-8"))
+        write(embeddings, docs, mmap_dir_for(index_dir), dtype=meta["dtype"], source=str(index_dir),
+              rerank=meta.get("rerank", "f32"))
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="incrementally (re-)embed KB documents into the document index")
+    parser.add_argument("--documents", type=Path, default=DOCUMENTS)
+    parser.add_argument("--index", type=Path, default=INDEX_DIR)
+    parser.add_argument("--encoder", default=ENCODER)
+    parser.add_argument("--precision", choices=list(TORCH_DTYPES), default=PRECISION)
+    parser.add_argument("--device", default=DEVICE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    counts = update_index(args.documents, args.index, args.encoder, args.precision, args.device, args.batch_size)
+    print(f"✅ {args.index}: {counts} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,106 @@
 #!/usr/bin/env python3
+"""
+Baut die KB (`data/index/mitre_documents.jsonl`) für alle Entity-Typen:
+
+  - ATT&CK-STIX-Bundle (optional, `--stix`, z.B. enterprise-attack.json):
+      attack-pattern -> TECHNIQUE (T…), x-mitre-tactic -> TACTIC (TA…),
+      intrusion-set -> GROUP (G…), malware -> MALWARE (S…), tool -> TOOL (S…)
+    inkl. Aliases; revoked/deprecated Objekte werden übersprungen
+  - AnnoCTR-Rohdaten (alle vorhandenen Splits): jedes Label mit ATT&CK-Link
+    (techniques, Sub-Techniques `/T1055/012` -> T1055.012, tactics, groups, software)
+    sowie Labels mit anderen Links (z.B. bosch.com), die kein ATT&CK-Objekt haben
+
+Dokument-Format wie bisher: {"id", "text": "<ID> <Titel>", "metadata": {"entity_type", "title", ...}};
+Nicht-ATT&CK-Einträge haben den Link als id und nur den Titel als text.
+`metadata.description` (Roh-Feld `label` bzw. STIX `description`, ohne Markdown-Links
+und Citations) wird nicht embedded, nur vom BM25-Index (bm25_index.py) benutzt.
+Für STIX und Rohdaten mit derselben ID gewinnt STIX (Titel, Aliases).
+
+  python src/build_mitre_documents.py
+  python src/build_mitre_documents.py --stix data/raw/attack/enterprise-attack.json
+  python src/build_index.py          # danach: nur neue/geänderte Dokumente embedden
+"""
 from __future__ import annotations
 
+import argparse
 import json
-from pathlib import Path
 import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
 
 ROOT = Path(__file__).resolve().parents[1]
 RAW_DIR = ROOT / "data/raw/annoctr/linking_mitre_only"
+STIX_FILE = ROOT / "data/raw/attack/enterprise-attack.json"
 OUT_DIR = ROOT / "data/index"
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 OUT_FILE = OUT_DIR / "mitre_documents.jsonl"
 
-MITRE_REGEX = re.compile(r"/(T\d+(?:\.\d+)?)")
+SPLITS = ["train", "val", "test"]
+
+# ATT&CK object URL -> ID; sub-techniques are linked as /techniques/T1055/012
+MITRE_REGEX = re.compile(r"attack\.mitre\.org/(?:techniques|tactics|groups|software)/([A-Z]{1,2}\d+)(?:[/.](\d+))?")
+
+STIX_TYPES = {
+    "attack-pattern": "TECHNIQUE",
+    "x-mitre-tactic": "TACTIC",
+    "intrusion-set": "GROUP",
+    "malware": "MALWARE",
+    "tool": "TOOL",
+}
+STIX_SOURCE = "mitre-attack"
+
+MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+CITATION = re.compile(r"\(Citation:[^)]*\)")
+
 
 def extract_mitre_id(link: str | None) -> str | None:
     if not link:
         return None
     match = MITRE_REGEX.search(link)
-    return match.group(1) if match else None
+    if not match:
+        return None
+    return f"{match.group(1)}.{match.group(2)}" if match.group(2) else match.group(1)
 
-def main():
-    unique = {}
 
-    for split in ["train", "val", "test"]:
-        path = RAW_DIR / f"{split}.jsonl"
+def clean_description(text: str | None) -> str:
+    """ATT&CK description without markdown links (their text is kept) and citations."""
+    if not text:
+        return ""
+    text = CITATION.sub("", MARKDOWN_LINK.sub(r"\1", text))
+    return " ".join(text.split())
+
+
+def make_doc(doc_id: str, title: str, entity_type: Optional[str], link: Optional[str], source: str,
+             aliases: Optional[List[str]] = None, mitre: bool = True, description: str = "") -> Dict[str, Any]:
+    metadata: Dict[str, Any] = {"entity_type": entity_type, "title": title}
+    if aliases:
+        metadata["aliases"] = aliases
+    if description:
+        metadata["description"] = description
+    if link:
+        metadata["link"] = link
+    metadata["source"] = source
+    return {"id": doc_id, "text": f"{doc_id} {title}" if mitre else title, "metadata": metadata}
+
+
+def iter_stix_docs(path: Path) -> Iterator[Dict[str, Any]]:
+    bundle = json.loads(path.read_text(encoding="utf-8"))
+    for obj in bundle.get("objects", []):
+        entity_type = STIX_TYPES.get(obj.get("type"))
+        if entity_type is None or obj.get("revoked") or obj.get("x_mitre_deprecated"):
+            continue
+        ref = next((r for r in obj.get("external_references", []) if r.get("source_name") == STIX_SOURCE), None)
+        if ref is None or not ref.get("external_id"):
+            continue
+        name = obj.get("name", "").strip()
+        aliases = [a for a in obj.get("aliases", []) + obj.get("x_mitre_aliases", []) if a and a != name]
+        yield make_doc(ref["external_id"], name, entity_type, ref.get("url"), "stix",
+                       aliases=list(dict.fromkeys(aliases)), description=clean_description(obj.get("description")))
+
+
+def iter_raw_docs(raw_dir: Path, splits: List[str]) -> Iterator[Dict[str, Any]]:
+    for split in splits:
+        path = raw_dir / f"{split}.jsonl"
         if not path.exists():
             continue
 
@@ -38,26 +114,55 @@ def main():
                 except json.JSONDecodeError:
                     continue
 
-                mitre_id = extract_mitre_id(ex.get("label_link"))
-                label_title = ex.get("label_title")
-                entity_type = ex.get("entity_type")
-
-                if mitre_id and mitre_id not in unique:
-                    unique[mitre_id] = {
-                        "id": mitre_id,
-                        "text": f"{mitre_id} {label_title}",
-                        "metadata": {
-                            "entity_type": entity_type,
-                            "title": label_title
-                        }
-                    }
-
-    with OUT_FILE.open("w", encoding="utf-8") as f:
-        for doc in unique.values():
+                label_title = (ex.get("label_title") or "").strip()
+                link = ex.get("label_link")
+                if not label_title or not link:
+                    continue
+                mitre_id = extract_mitre_id(link)
+                description = clean_description(ex.get("label"))
+                if mitre_id:
+                    yield make_doc(mitre_id, label_title, ex.get("entity_type"), link, "annoctr",
+                                   description=description)
+                else:
+                    yield make_doc(link, label_title, ex.get("entity_type"), link, "annoctr", mitre=False,
+                                   description=description)
+
+
+def build(stix: Optional[Path], raw_dir: Path, splits: List[str]) -> List[Dict[str, Any]]:
+    unique: Dict[str, Dict[str, Any]] = {}
+    if stix is not None:
+        for doc in iter_stix_docs(stix):
+            unique[doc["id"]] = doc
+    for doc in iter_raw_docs(raw_dir, splits):
+        unique.setdefault(doc["id"], doc)
+    return sorted(unique.values(), key=lambda d: d["id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ATT&CK STIX bundle + AnnoCTR labels -> KB documents jsonl")
+    parser.add_argument("--stix", type=Path, default=None, help=f"STIX bundle (default: {STIX_FILE} if present)")
+    parser.add_argument("--raw-dir", type=Path, default=RAW_DIR)
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--out", type=Path, default=OUT_FILE)
+    args = parser.parse_args()
+
+    stix = args.stix or (STIX_FILE if STIX_FILE.exists() else None)
+    if stix is None:
+        print("no STIX bundle -> KB from the AnnoCTR labels only")
+    docs = build(stix, args.raw_dir, args.splits)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with args.out.open("w", encoding="utf-8") as f:
+        for doc in docs:
             f.write(json.dumps(doc, ensure_ascii=False) + "\n")
 
-    print(f"✅ Built {len(unique)} MITRE documents")
-    print(f"Saved to: {OUT_FILE}")
+    by_type: Dict[str, int] = {}
+    for doc in docs:
+        key = doc["metadata"]["entity_type"] or "UNKNOWN"
+        by_type[key] = by_type.get(key, 0) + 1
+    print(f"✅ Built {len(docs)} KB documents: {by_type}")
+    print(f"Saved to: {args.out}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Kompakter Top-K_max-Speicher der Retriever-Ergebnisse pro Split.
+
+Der Retriever (Encoder + Index-Suche) läuft einmal mit K_MAX; jedes kleinere k
+(und optional eine Score-Schwelle) wird danach nur noch aus diesem Speicher
+geschnitten, ohne Encoder:
+
+  <split>.window.candidates.jsonl.topk/
+    meta.json      k_max, Windows-Quelle, Fingerprint (Encoder/Index/Precision/Input), rows, complete
+    texts.jsonl    Candidate-Texte, Zeile = id
+    ids.i32        int32   [rows, k_max]  id in texts.jsonl, -1 = kein Candidate
+    scores.f32     float32 [rows, k_max]
+
+Geschrieben wird append-only mit fsync pro Buffer (erst Texte, dann Scores, dann
+IDs); nach einem Abbruch wird nach der letzten vollständigen Zeile weitergemacht.
+
+  python src/candidate_store.py slice data/candidates/relik/val.window.candidates.jsonl.topk \\
+      data/candidates/relik/val.window.candidates.jsonl --k 20 --min-score 230
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from window_store import iter_window_lines
+
+META_FILE = "meta.json"
+TEXTS_FILE = "texts.jsonl"
+IDS_FILE = "ids.i32"
+SCORES_FILE = "scores.f32"
+
+WRITE_BUFFER = 4 * 1024 * 1024
+
+
+def store_dir_for(out: Path) -> Path:
+    return out.with_name(out.name + ".topk")
+
+
+def _fsync_append(path: Path, data: bytes) -> None:
+    with path.open("ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_meta(path: Path, meta: Dict[str, Any]) -> None:
+    tmp = path / (META_FILE + ".tmp")
+    tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp, path / META_FILE)
+
+
+class RankingWriter:
+    """Appends ranked (texts, scores) per window; resumes an interrupted store with the same fingerprint."""
+
+    def __init__(self, path: Path, k_max: int, fingerprint: Dict[str, Any], windows: Path):
+        self.path = Path(path)
+        self.k_max = k_max
+        self.meta = {"k_max": k_max, "windows": str(windows), "fingerprint": fingerprint, "rows": 0,
+                     "complete": False}
+
+        previous = self._read_meta()
+        if previous is not None and (previous.get("fingerprint") != fingerprint or previous.get("k_max") != k_max):
+            print(f"  retriever settings or input changed -> discarding {self.path}")
+            shutil.rmtree(self.path)
+            previous = None
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.text_ids: Dict[str, int] = {}
+        self.rows = 0
+        if previous is not None:
+            self._recover()
+        _write_meta(self.path, self.meta)
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        meta = self.path / META_FILE
+        if not meta.exists():
+            return None
+        try:
+            return json.loads(meta.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _recover(self) -> None:
+        """Cut torn tails; only rows complete in both arrays count (ids are written last)."""
+        texts = self.path / TEXTS_FILE
+        data = texts.read_bytes() if texts.exists() else b""
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            with texts.open("r+b") as f:
+                f.truncate(end)
+        for i, line in enumerate(data[:end].splitlines()):
+            self.text_ids[json.loads(line)] = i
+
+        row_bytes = 4 * self.k_max
+        sizes = [(self.path / name).stat().st_size if (self.path / name).exists() else 0
+                 for name in (IDS_FILE, SCORES_FILE)]
+        self.rows = min(sizes) // row_bytes
+        for name in (IDS_FILE, SCORES_FILE):
+            p = self.path / name
+            if p.exists() and p.stat().st_size != self.rows * row_bytes:
+                with p.open("r+b") as f:
+                    f.truncate(self.rows * row_bytes)
+
+    def append(self, hits: Sequence[Tuple[Sequence[str], Sequence[float]]]) -> None:
+        ids = np.full((len(hits), self.k_max), -1, dtype=np.int32)
+        scores = np.zeros((len(hits), self.k_max), dtype=np.float32)
+        new_texts: List[str] = []
+        for r, (texts, values) in enumerate(hits):
+            for j, (text, score) in enumerate(zip(texts[:self.k_max], values[:self.k_max])):
+                i = self.text_ids.get(text)
+                if i is None:
+                    i = self.text_ids[text] = len(self.text_ids)
+                    new_texts.append(text)
+                ids[r, j] = i
+                scores[r, j] = score
+
+        if new_texts:
+            _fsync_append(self.path / TEXTS_FILE,
+                          "".join(json.dumps(t, ensure_ascii=False) + "\n" for t in new_texts).encode("utf-8"))
+        _fsync_append(self.path / SCORES_FILE, scores.tobytes())
+        _fsync_append(self.path / IDS_FILE, ids.tobytes())
+        self.rows += len(hits)
+
+    def finish(self) -> None:
+        self.meta.update(rows=self.rows, texts=len(self.text_ids), complete=True)
+        _write_meta(self.path, self.meta)
+
+
+class RankingStore:
+    """Read side: memory-mapped ids/scores + candidate texts."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / META_FILE).read_text(encoding="utf-8"))
+        self.k_max = int(self.meta["k_max"])
+        self.rows = int(self.meta["rows"])
+        shape = (self.rows, self.k_max)
+        if self.rows:
+            self.ids = np.memmap(self.path / IDS_FILE, dtype=np.int32, mode="r", shape=shape)
+            self.scores = np.memmap(self.path / SCORES_FILE, dtype=np.float32, mode="r", shape=shape)
+        else:
+            self.ids = np.zeros(shape, dtype=np.int32)
+            self.scores = np.zeros(shape, dtype=np.float32)
+        self.texts: List[str] = []
+        if (self.path / TEXTS_FILE).exists():
+            with (self.path / TEXTS_FILE).open(encoding="utf-8") as f:
+                self.texts = [json.loads(line) for line in f]
+
+    @classmethod
+    def open(cls, path: Path) -> Optional["RankingStore"]:
+        meta = Path(path) / META_FILE
+        if not meta.exists():
+            return None
+        try:
+            store = cls(path)
+        except (OSError, ValueError, KeyError, json.JSONDecodeError):
+            return None
+        return store if store.meta.get("complete") else None
+
+    def covers(self, fingerprint: Dict[str, Any], k: int) -> bool:
+        return self.meta.get("fingerprint") == fingerprint and self.k_max >= k
+
+    def row(self, r: int, k: int, min_score: Optional[float] = None) -> Tuple[List[str], List[float]]:
+        ids = self.ids[r, :k]
+        scores = self.scores[r, :k]
+        keep = ids >= 0
+        if min_score is not None:
+            keep &= scores >= min_score
+        return [self.texts[i] for i in ids[keep]], [float(s) for s in scores[keep]]
+
+
+def slice_candidates(store: RankingStore, windows: Path, out: Path, k: int,
+                     min_score: Optional[float] = None) -> int:
+    """`windows` + top-k of the store (optionally score >= min_score) -> candidates jsonl; returns #windows."""
+    if k > store.k_max:
+        raise ValueError(f"k={k} > k_max={store.k_max} of {store.path}; regenerate with a larger K_MAX")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    n = 0
+    with tmp.open("w", encoding="utf-8", buffering=WRITE_BUFFER) as fout:
+        for line in iter_window_lines(windows):
+            if n >= store.rows:
+                raise ValueError(f"{windows} has more windows than {store.path} ({store.rows} rows)")
+            window = json.loads(line)
+            window["span_candidates"], window["span_candidates_scores"] = store.row(n, k, min_score)
+            fout.write(json.dumps(window) + "\n")
+            n += 1
+    if n != store.rows:
+        raise ValueError(f"{windows} has {n} windows, {store.path} has {store.rows} rows")
+    os.replace(tmp, out)
+    return n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="materialize *.window.candidates.jsonl from a top-K_max store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_slice = sub.add_parser("slice", help="write candidates for k <= k_max")
+    p_slice.add_argument("store", type=Path)
+    p_slice.add_argument("out", type=Path)
+    p_slice.add_argument("--k", type=int, required=True)
+    p_slice.add_argument("--min-score", type=float, default=None, help="drop candidates below this score")
+    p_slice.add_argument("--windows", type=Path, default=None, help="default: windows file recorded in the store")
+
+    p_info = sub.add_parser("info", help="show the store metadata")
+    p_info.add_argument("store", type=Path)
+    args = parser.parse_args()
+
+    store = RankingStore.open(args.store)
+    if store is None:
+        raise FileNotFoundError(f"no complete candidate store at {args.store}")
+
+    if args.cmd == "info":
+        print(json.dumps(store.meta, indent=2))
+        return
+
+    windows = args.windows or Path(store.meta["windows"])
+    n = slice_candidates(store, windows, args.out, args.k, args.min_score)
+    print(f"✅ {n} windows, top-{args.k}{f' score >= {args.min_score}' if args.min_score is not None else ''} "
+          f"-> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+In-Process Candidate-Generierung (Ersatz für `relik retriever add-candidates` pro Split):
+  - Question-Encoder und Document-Index werden einmal geladen und für alle Splits benutzt
+  - Windows werden nach Encoder-Tokenlänge sortiert und dynamisch gebatcht
+    (Token-Budget pro Batch statt fester Batchgröße)
+  - Ausgabe wie relik: Window + `span_candidates` + `span_candidates_scores`, Reihenfolge bleibt erhalten
+  - optional: Embedding-Cache (embedding_cache.py), dann werden nur neue/geänderte Window-Texte encodiert
+  - liegt unter dem Index ein `mmap/`-Verzeichnis (mmap_index.py), wird statt `embeddings.pt` dieses benutzt
+  - `shard_size`: Ausgabe in Shards mit Manifest, nach SIGKILL wird beim letzten committeten Window weitergemacht
+  - `k_max`: Ranking wird einmal bis K_MAX gespeichert (candidate_store.py), jedes TOP_K <= K_MAX
+    wird danach nur noch daraus geschnitten
+  - optional `dictionary` (dictionary_linker.py): exakte KB-Treffer werden vorne gepinnt, mit
+    `dense_policy="unresolved"` werden nur Windows mit ungelösten Spans encodiert
+  - `types` / Window-Feld `candidate_types`: Suche nur in den Partitionen dieser Entity-Typen
+    (metadata.entity_type), z.B. aus Typ-Hinweisen oder einem Typ-Klassifikator
+  - optional `lexical` (bm25_index.BM25Index): Dense- und BM25-Ranking (je `fusion_depth` tief)
+    werden per Reciprocal Rank Fusion gemischt; die Scores sind dann RRF-Scores
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from window_store import iter_window_lines, source_stat, window_source
+from window_store import iter_windows as iter_source_windows
+
+ROOT = Path(__file__).resolve().parents[1]
+
+QUESTION_ENCODER = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-encoder"
+DOCUMENT_INDEX = str(ROOT / "data/index/mitre_index")
+
+TOP_K = 10
+DEVICE = "cpu"
+INDEX_DEVICE = "cpu"
+PRECISION = "fp16"
+
+# dynamic batching: padded tokens per encoder batch and hard cap on windows per batch
+MAX_TOKENS_PER_BATCH = 8192
+MAX_BATCH_SIZE = 128
+MAX_QUESTION_LENGTH = 256
+# windows read ahead and sorted by length before batching
+SORT_BUFFER = 4096
+
+# windows per resumable output shard (add_candidates_sharded)
+SHARD_SIZE = 2000
+
+# windows per index search call
+SEARCH_BATCH_SIZE = 256
+
+TORCH_DTYPES = {"fp16": "float16", "bf16": "bfloat16", "fp32": None}
+
+
+def iter_windows(path: Path) -> Iterator[Dict[str, Any]]:
+    """Windows of a `*.window.jsonl` file or its `.windows` store (see window_store.py)."""
+    return iter_source_windows(window_source(path), as_dict=True)
+
+
+def iter_buffers(items: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    buf = []
+    for item in items:
+        buf.append(item)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def dynamic_batches(
+    lengths: Sequence[int],
+    budget: Callable[[int], int],
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> Iterator[List[int]]:
+    """
+    Index batches over `lengths`, sorted by length so that padding stays small.
+    A batch is closed as soon as (#items * longest item) would exceed the token
+    budget; `budget(shortest pending length)` is asked again before every batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    pos = 0
+    while pos < len(order):
+        limit = budget(lengths[order[pos]])
+        batch: List[int] = []
+        longest = 0
+        while pos < len(order) and len(batch) < max_batch_size:
+            longest_new = max(longest, lengths[order[pos]])
+            if batch and longest_new * (len(batch) + 1) > limit:
+                break
+            batch.append(order[pos])
+            longest = longest_new
+            pos += 1
+        yield batch
+
+
+def token_budget_batches(
+    lengths: Sequence[int],
+    max_tokens: int = MAX_TOKENS_PER_BATCH,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> List[List[int]]:
+    """Static version of `dynamic_batches` with a fixed token budget."""
+    return list(dynamic_batches(lengths, lambda _: max_tokens, max_batch_size))
+
+
+class RelikIndex:
+    """Adapter: relik document index (loaded by GoldenRetriever) with the MmapDocumentIndex search interface."""
+
+    def __init__(self, document_index):
+        self.document_index = document_index
+        self._texts: Optional[List[str]] = None
+        self._partitions: Optional[Dict[str, np.ndarray]] = None
+
+    def rows_for(self, types: Sequence[str]) -> np.ndarray:
+        if self._partitions is None:
+            from mmap_index import partition_rows
+
+            docs = [d.to_dict() if hasattr(d, "to_dict") else dict(d) for d in self.document_index.documents]
+            self._texts = [d["text"] for d in docs]
+            self._partitions = partition_rows(docs)
+        parts = [self._partitions[t] for t in types if t in self._partitions]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def search(self, query: np.ndarray, k: int,
+               types: Optional[Sequence[str]] = None) -> List[Tuple[List[str], List[float]]]:
+        import torch
+
+        embeddings = self.document_index.embeddings
+        query = torch.from_numpy(np.ascontiguousarray(query)).to(embeddings.dtype)
+        if types is None:
+            hits = self.document_index.search(query, k)
+            return [([r.document.text for r in h], [float(r.score) for r in h]) for h in hits]
+
+        # partition search: score only the rows of the requested entity types
+        rows = self.rows_for(types)
+        if len(rows) == 0:
+            return [([], []) for _ in range(len(query))]
+        sub = embeddings[torch.from_numpy(rows).to(embeddings.device)]
+        top = torch.topk((query.to(sub.device) @ sub.T).float(), min(k, len(rows)), dim=1)
+        return [([self._texts[rows[j]] for j in idx], [float(v) for v in vals])
+                for vals, idx in zip(top.values.cpu().tolist(), top.indices.cpu().tolist())]
+
+
+class CandidateGenerator:
+    """Keeps the question encoder and the document index in memory across splits."""
+
+    def __init__(
+        self,
+        question_encoder: str = QUESTION_ENCODER,
+        document_index: str = DOCUMENT_INDEX,
+        device: str = DEVICE,
+        index_device: str = INDEX_DEVICE,
+        precision: str = PRECISION,
+        max_tokens_per_batch: int = MAX_TOKENS_PER_BATCH,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_question_length: int = MAX_QUESTION_LENGTH,
+        cache_dir: Optional[Path] = None,
+        governor=None,
+        dictionary=None,
+        dense_policy: str = "always",
+        types: Optional[Sequence[str]] = None,
+        lexical=None,
+        fusion_depth: Optional[int] = None,
+    ):
+        import torch
+        from relik.retriever import GoldenRetriever
+        from transformers import AutoTokenizer
+
+        from mmap_index import MmapDocumentIndex, has_mmap_index
+
+        use_mmap = has_mmap_index(document_index)
+        print(f"loading retriever: {question_encoder} + {document_index}{' (mmap)' if use_mmap else ''}")
+        self.retriever = GoldenRetriever(
+            question_encoder=question_encoder,
+            document_index=None if use_mmap else document_index,
+            device=device,
+            index_device=index_device,
+            index_precision=precision,
+        )
+        self.retriever.eval()
+        self.index = MmapDocumentIndex(document_index) if use_mmap else RelikIndex(self.retriever.document_index)
+        self.tokenizer = AutoTokenizer.from_pretrained(question_encoder)
+        self.question_encoder = question_encoder
+        self.document_index = str(document_index)
+        self.precision = precision
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.max_question_length = max_question_length
+        self.device = device
+        # optional resource_governor.ResourceGovernor: adapts token budget + threads per batch
+        self.governor = governor
+        # optional dictionary_linker.DictionaryLinker: exact hits pinned, dense retrieval per dense_policy
+        self.dictionary = dictionary
+        self.dense_policy = dense_policy
+        self.dense_windows = 0
+        self.dense_skipped = 0
+        # default entity-type partitions to search (None = whole index); windows may override
+        self.types = tuple(types) if types else None
+        # optional bm25_index.BM25Index: hybrid retrieval, dense + lexical fused by RRF
+        self.lexical = lexical
+        self.fusion_depth = fusion_depth
+        dtype = TORCH_DTYPES[precision]
+        self.autocast_dtype = getattr(torch, dtype) if dtype else None
+
+        self.cache = None
+        if cache_dir is not None:
+            from embedding_cache import EmbeddingCache
+
+            dim = self.encode(["warm-up"]).shape[1]
+            self.cache = EmbeddingCache(question_encoder, precision, dim, cache_dir=cache_dir)
+            print(f"embedding cache: {self.cache.path} ({len(self.cache)} rows)")
+
+        if self.governor is not None:
+            # RSS baseline only now: encoder, index and cache are resident
+            self.governor.rebase()
+
+    def question_lengths(self, texts: Sequence[str]) -> List[int]:
+        enc = self.tokenizer(list(texts), truncation=True, max_length=self.max_question_length)
+        return [len(ids) for ids in enc["input_ids"]]
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        """Question embeddings (float32) for one batch of texts."""
+        import torch
+
+        batch = self.tokenizer(list(texts), padding=True, truncation=True,
+                               max_length=self.max_question_length, return_tensors="pt").to(self.device)
+        device_type = self.device.split(":")[0]
+        with torch.inference_mode(), torch.autocast(device_type=device_type, dtype=self.autocast_dtype,
+                                                    enabled=self.autocast_dtype is not None):
+            emb = self.retriever.question_encoder(**batch).pooler_output
+        return emb.float().cpu().numpy()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embeddings for all texts: duplicates are encoded once, cached texts are
+        looked up, the rest is encoded in token-budget batches (and cached).
+        """
+        unique = list(dict.fromkeys(texts))
+        vectors: Dict[int, np.ndarray] = {}
+        missing = list(range(len(unique)))
+        if self.cache is not None:
+            vectors, missing = self.cache.lookup(unique)
+
+        if missing:
+            todo = [unique[i] for i in missing]
+            lengths = self.question_lengths(todo)
+            if self.governor is not None:
+                batches = dynamic_batches(lengths, self.governor.limit_for, self.governor.max_batch_size)
+            else:
+                batches = dynamic_batches(lengths, lambda _: self.max_tokens_per_batch, self.max_batch_size)
+            for batch in batches:
+                if self.governor is not None:
+                    self.governor.start_batch()
+                emb = self.encode([todo[j] for j in batch])
+                if self.governor is not None:
+                    self.governor.end_batch(len(batch) * max(lengths[j] for j in batch))
+                for j, vec in zip(batch, emb):
+                    vectors[missing[j]] = vec
+            if self.cache is not None:
+                self.cache.put(todo, np.stack([vectors[i] for i in missing]))
+
+        pos = {text: i for i, text in enumerate(unique)}
+        return np.stack([vectors[pos[t]] for t in texts]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+    def search(self, embeddings: np.ndarray, top_k: int = TOP_K,
+               types: Optional[Sequence[Optional[Tuple[str, ...]]]] = None) -> List[Tuple[List[str], List[float]]]:
+        """(candidate texts, scores) per query embedding; `types[i]` restricts query i to those partitions."""
+        if types is None or all(t is None for t in types):
+            results = []
+            for a in range(0, len(embeddings), SEARCH_BATCH_SIZE):
+                results.extend(self.index.search(embeddings[a:a + SEARCH_BATCH_SIZE], top_k))
+            return results
+
+        # one search per distinct type set
+        groups: Dict[Optional[Tuple[str, ...]], List[int]] = {}
+        for i, t in enumerate(types):
+            groups.setdefault(t, []).append(i)
+        grouped: List[Tuple[List[str], List[float]]] = [([], [])] * len(embeddings)
+        for t, rows in groups.items():
+            for a in range(0, len(rows), SEARCH_BATCH_SIZE):
+                batch = rows[a:a + SEARCH_BATCH_SIZE]
+                for i, hit in zip(batch, self.index.search(embeddings[batch], top_k, t)):
+                    grouped[i] = hit
+        return grouped
+
+    def retrieve(self, texts: Sequence[str], top_k: int = TOP_K,
+                 types: Optional[Sequence[Optional[Tuple[str, ...]]]] = None) -> List[Tuple[List[str], List[float]]]:
+        """(candidate texts, scores) per input text, in input order."""
+        if not texts:
+            return []
+        if types is None and self.types is not None:
+            types = [self.types] * len(texts)
+        if self.lexical is None:
+            return self.search(self.embed(texts), top_k=top_k, types=types)
+
+        from bm25_index import FUSION_DEPTH, reciprocal_rank_fusion
+
+        depth = max(top_k, self.fusion_depth or FUSION_DEPTH)
+        dense = self.search(self.embed(texts), top_k=depth, types=types)
+        fused = []
+        for i, text in enumerate(texts):
+            (lexical, _), = self.lexical.search([text], depth, types[i] if types else None)
+            fused.append(reciprocal_rank_fusion([dense[i][0], lexical], top_k, depth=depth))
+        return fused
+
+    def window_types(self, window: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+        """Partitions for one window: its `candidate_types` hint, else the generator default."""
+        hint = window.get("candidate_types")
+        return tuple(hint) if hint else self.types
+
+    def retrieve_windows(self, windows: Sequence[Dict[str, Any]],
+                         top_k: int = TOP_K) -> List[Tuple[List[str], List[float]]]:
+        """Candidates per window: dense only, or dictionary hits pinned + dense where still needed."""
+        texts = [w["text"] for w in windows]
+        types = [self.window_types(w) for w in windows]
+        if self.dictionary is None:
+            return self.retrieve(texts, top_k=top_k, types=types)
+
+        from dictionary_linker import needs_dense, pin_candidates, pinned_candidates
+
+        hits = [self.dictionary.scan(t) for t in texts]
+        dense_rows, lexical_rows = [], []
+        for i, h in enumerate(hits):
+            if self.dense_policy == "always" or needs_dense(h):
+                dense_rows.append(i)
+            elif self.lexical is not None and len(pinned_candidates(h)) < top_k:
+                # free slots after the pinned hits are filled with BM25 negatives (never the encoder)
+                lexical_rows.append(i)
+        self.dense_windows += len(dense_rows)
+        self.dense_skipped += len(windows) - len(dense_rows)
+        fill = dict(zip(dense_rows, self.retrieve([texts[i] for i in dense_rows], top_k=top_k,
+                                                  types=[types[i] for i in dense_rows])))
+        for i in lexical_rows:
+            (fill[i],) = self.lexical.search([texts[i]], top_k + len(pinned_candidates(hits[i])), types[i])
+        return [pin_candidates(h, *fill.get(i, ([], [])), top_k=top_k) for i, h in enumerate(hits)]
+
+    def annotate(self, windows: List[Dict[str, Any]], top_k: int = TOP_K) -> List[Dict[str, Any]]:
+        """Adds `span_candidates` / `span_candidates_scores` to the windows (in place)."""
+        hits = self.retrieve_windows(windows, top_k=top_k)
+        for window, (candidates, scores) in zip(windows, hits):
+            window["span_candidates"] = candidates
+            window["span_candidates_scores"] = scores
+        return windows
+
+    def _finish_run(self) -> None:
+        if self.cache is not None:
+            self.cache.flush()
+            print(f"embedding cache: {self.cache.hits} hits, {self.cache.misses} misses")
+        if self.dictionary is not None:
+            print(f"dictionary: dense retrieval for {self.dense_windows} windows, "
+                  f"{self.dense_skipped} resolved by exact hits")
+        if self.governor is not None:
+            self.governor.save()
+
+    def add_candidates(self, inp: Path, out: Path, top_k: int = TOP_K, shard_size: Optional[int] = None,
+                       keep_shards: bool = False, k_max: Optional[int] = None,
+                       min_score: Optional[float] = None) -> int:
+        """
+        Writes `inp` windows + candidates to `out`; returns the number of windows.
+        With `k_max` the ranking is stored up to k_max once and `out` is sliced from it (see `rank`),
+        with `shard_size` the work is committed in resumable shards (see `add_candidates_sharded`).
+        `k_max` wins over `shard_size`: the ranking store is itself resumable, shards would add nothing.
+        A packed window store next to `inp` is read instead of the jsonl (window_store.py).
+        """
+        inp = window_source(inp)
+        if k_max and shard_size:
+            print(f"  warning: k_max={k_max} and shard_size={shard_size} given; "
+                  f"using the resumable top-k_max store, shard_size is ignored")
+        if k_max:
+            from candidate_store import slice_candidates, store_dir_for
+
+            store = self.rank(inp, store_dir_for(out), max(k_max, top_k))
+            return slice_candidates(store, inp, out, top_k, min_score)
+        if shard_size:
+            return self.add_candidates_sharded(inp, out, top_k, shard_size, keep_shards)
+
+        out.parent.mkdir(parents=True, exist_ok=True)
+        n = 0
+        with out.open("w", encoding="utf-8") as fout:
+            for windows in iter_buffers(iter_windows(inp), SORT_BUFFER):
+                for window in self.annotate(windows, top_k):
+                    fout.write(json.dumps(window) + "\n")
+                n += len(windows)
+                print(f"  {n} windows")
+        self._finish_run()
+        return n
+
+    def ranking_fingerprint(self, inp: Path) -> Dict[str, Any]:
+        st = source_stat(inp)
+        return {
+            "input": str(inp),
+            "input_size": st.st_size,
+            "input_mtime_ns": st.st_mtime_ns,
+            "question_encoder": self.question_encoder,
+            "document_index": self.document_index,
+            "precision": self.precision,
+            **self.retrieval_fingerprint(),
+        }
+
+    def retrieval_fingerprint(self) -> Dict[str, Any]:
+        """Optional retrieval settings; empty for plain dense retrieval, so old stores/shards stay valid."""
+        out: Dict[str, Any] = {"types": list(self.types)} if self.types else {}
+        if self.dictionary is not None:
+            out.update(dictionary=self.dictionary.fingerprint, dense_policy=self.dense_policy,
+                       fill="bm25" if self.lexical is not None else "none")
+        if self.lexical is not None:
+            out.update(lexical=self.lexical.fingerprint, fusion_depth=self.fusion_depth)
+        return out
+
+    def rank(self, inp: Path, store_dir: Path, k_max: int):
+        """
+        Top-k_max candidates of every window in `inp` -> candidate_store.RankingStore.
+        A complete store with the same input/retriever and k_max >= the requested one
+        is reused as is; an interrupted one is continued after its last complete row.
+        """
+        from candidate_store import RankingStore, RankingWriter
+
+        fingerprint = self.ranking_fingerprint(inp)
+        store = RankingStore.open(store_dir)
+        if store is not None and store.covers(fingerprint, k_max):
+            print(f"  reusing top-{store.k_max} ranking in {store_dir}")
+            return store
+
+        writer = RankingWriter(store_dir, k_max, fingerprint, inp)
+        if writer.rows:
+            print(f"  resuming ranking after {writer.rows} windows")
+        n = writer.rows
+        for windows in iter_buffers(itertools.islice(iter_windows(inp), writer.rows, None), SORT_BUFFER):
+            writer.append(self.retrieve_windows(windows, top_k=k_max))
+            n += len(windows)
+            print(f"  {n} windows ranked")
+        writer.finish()
+        self._finish_run()
+        return RankingStore(store_dir)
+
+    def run_fingerprint(self, inp: Path, top_k: int, shard_size: int) -> Dict[str, Any]:
+        st = source_stat(inp)
+        return {
+            "input": str(inp),
+            "input_size": st.st_size,
+            "input_mtime_ns": st.st_mtime_ns,
+            "top_k": top_k,
+            "shard_size": shard_size,
+            "question_encoder": self.question_encoder,
+            "document_index": self.document_index,
+            "precision": self.precision,
+            **self.retrieval_fingerprint(),
+        }
+
+    def add_candidates_sharded(self, inp: Path, out: Path, top_k: int = TOP_K, shard_size: int = SHARD_SIZE,
+                               keep_shards: bool = False) -> int:
+        """
+        Crash-safe variant: windows are written to `<out>.shards/shard-NNNNN.jsonl`
+        (fsync after every buffer); a finished shard gets a `.done.json` manifest.
+        A restart (same input + settings) skips finished shards, keeps the committed
+        lines of the unfinished one and continues after them. At the end the shards
+        are concatenated into `out`.
+        """
+        shard_dir = shard_dir_for(out)
+        fingerprint = self.run_fingerprint(inp, top_k, shard_size)
+        run_file = shard_dir / "run.json"
+        if shard_dir.exists():
+            previous = json.loads(run_file.read_text(encoding="utf-8")) if run_file.exists() else None
+            if previous != fingerprint:
+                print(f"  input or settings changed -> discarding old shards in {shard_dir}")
+                shutil.rmtree(shard_dir)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        run_file.write_text(json.dumps(fingerprint, indent=2), encoding="utf-8")
+
+        n = 0
+        shards = []
+        for shard_id, lines in enumerate(iter_buffers(iter_window_lines(inp), shard_size)):
+            shard = shard_dir / f"shard-{shard_id:05d}.jsonl"
+            shards.append(shard)
+            if shard_complete(shard, len(lines)):
+                n += len(lines)
+                continue
+
+            committed = committed_lines(shard)
+            if committed:
+                print(f"  shard {shard_id}: resuming after {committed} committed windows")
+            with shard.open("a", encoding="utf-8") as fout:
+                todo = lines[committed:]
+                for a in range(0, len(todo), SORT_BUFFER):
+                    windows = self.annotate([json.loads(line) for line in todo[a:a + SORT_BUFFER]], top_k)
+                    fout.write("".join(json.dumps(w) + "\n" for w in windows))
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            write_json_atomic(manifest_for(shard), {
+                "shard": shard_id,
+                "first_window": shard_id * shard_size,
+                "windows": len(lines),
+                "bytes": shard.stat().st_size,
+            })
+            n += len(lines)
+            print(f"  shard {shard_id} done ({n} windows)")
+
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(out.name + ".tmp")
+        with tmp.open("wb") as fout:
+            for shard in shards:
+                with shard.open("rb") as fin:
+                    shutil.copyfileobj(fin, fout, 4 * 1024 * 1024)
+        os.replace(tmp, out)
+        if not keep_shards:
+            shutil.rmtree(shard_dir)
+
+        self._finish_run()
+        return n
+
+
+def shard_dir_for(out: Path) -> Path:
+    return out.with_name(out.name + ".shards")
+
+
+def manifest_for(shard: Path) -> Path:
+    return shard.with_suffix(".done.json")
+
+
+def shard_complete(shard: Path, expected_windows: int) -> bool:
+    manifest = manifest_for(shard)
+    if not manifest.exists() or not shard.exists():
+        return False
+    info = json.loads(manifest.read_text(encoding="utf-8"))
+    return info.get("windows") == expected_windows and info.get("bytes") == shard.stat().st_size
+
+
+def committed_lines(shard: Path) -> int:
+    """Number of complete lines in a shard; a torn last line (SIGKILL mid-write) is cut off."""
+    if not shard.exists():
+        return 0
+    data = shard.read_bytes()
+    end = data.rfind(b"\n") + 1
+    if end != len(data):
+        with shard.open("r+b") as f:
+            f.truncate(end)
+    return data.count(b"\n", 0, end)
+
+
+def write_json_atomic(path: Path, obj: Any) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
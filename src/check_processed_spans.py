@@ -1,20 +1,12 @@
-import json
-from pathlib import Path
+#!/usr/bin/env python3
+"""
+Prüft die Spans aller processed-Splits (jede Annotation, per-mention und gruppiert).
+Kurzform von `python src/validate.py --kinds processed`; Details siehe validate.py.
+"""
+import sys
 
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-p = PROJECT_ROOT / "data" /"processed"/"relik"/"train.jsonl"
-bad = 0
-n = 0
+from validate import main
 
-with p.open(encoding="utf-8") as f:
-    for line in f:
-        ex = json.loads(line)
-        s, e, _ = ex["doc_span_annotations"][0]
-        mention = ex["meta"]["mention"]
-        if ex["doc_text"][s:e] != mention:
-            bad += 1
-            if bad < 5:
-                print("BAD:", ex["doc_text"][s:e], "vs", mention)
-        n += 1
-
-print("checked:", n, "bad:", bad)
+if __name__ == "__main__":
+    sys.argv[1:1] = ["--kinds", "processed"]
+    main()
@@ -1,9 +1,22 @@
 # Haupt-Converter: liest AnnoCTR und schreibt ReLiK-konformes jsonl
 
 #!/usr/bin/env python3
-import json
+import argparse
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from jsonl_io import (
+    FAST_JSON,
+    WRITE_BUFFER,
+    align_ranges,
+    count_range_lines,
+    default_workers,
+    dumps_line,
+    iter_range_lines,
+    loads,
+    plan_byte_ranges,
+)
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -17,6 +30,19 @@ SPLITS = {
     "test": RAW_DIR / "test.jsonl",
 }
 
+# False: one ReLiK doc per raw mention row (old behaviour)
+# True:  one ReLiK doc per report (`document` field), all mentions as span annotations
+GROUP_BY_DOCUMENT = False
+
+# longest mention-free sentence that is filled in between two mention sentences (group mode)
+MAX_GAP_FILL_CHARS = 1000
+
+# worker processes for the conversion (0 = all cores)
+WORKERS = 0
+
+META_FIELDS = ["mention", "label", "label_id", "label_link", "entity_class", "entity_type"]
+
+
 def build_doc_text(ex: Dict[str, Any]) -> str:
     left = ex.get("context_left", "")
     mention = ex.get("mention", "")
@@ -29,69 +55,269 @@ def build_doc_text(ex: Dict[str, Any]) -> str:
 
     return left + mention + right
 
-def main():
-    for split, in_path in SPLITS.items():
-        if not in_path.exists():
-            print(f"[{split}] missing input: {in_path}")
+
+def build_meta(ex: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: ex.get(k) for k in META_FIELDS}
+
+
+def label_of(ex: Dict[str, Any]) -> str:
+    return ex.get("label_title") or ex.get("label") or "--NME--"
+
+
+def convert_example(i: int, ex: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Per-mention conversion of one raw row. Returns None if the row has to be dropped."""
+    mention = ex.get("mention", "")
+    context_left = ex.get("context_left", "")
+
+    if not mention:
+        return None
+
+    doc_text = build_doc_text(ex)
+    start = len(str(context_left))
+    end = start + len(str(mention))
+
+    # sanity check
+    if end > len(doc_text) or doc_text[start:end] != str(mention):
+        # fallback: try to find mention in doc_text (first occurrence)
+        idx = doc_text.find(str(mention))
+        if idx == -1:
+            return None
+        start = idx
+        end = idx + len(str(mention))
+
+    return {
+        "doc_id": i,
+        "doc_text": doc_text,
+        "doc_span_annotations": [
+            [start, end, label_of(ex)]
+        ],
+        # keep extra fields for traceability/debugging; `document` = report (grouped output: meta.document)
+        "meta": {**build_meta(ex), "document": ex.get("document")},
+    }
+
+
+def build_sentence(ex: Dict[str, Any]) -> Tuple[str, int, int]:
+    """
+    Sentence of a raw row with the original whitespace (`_context_*` fields),
+    plus the char span of the mention inside it. Falls back to the stripped
+    `context_*` fields for dumps without the underscore variants.
+    """
+    left = ex.get("_context_left", ex.get("context_left", ""))
+    mention = ex.get("mention", "")
+    right = ex.get("_context_right", ex.get("context_right", ""))
+
+    left = "" if left is None else str(left)
+    mention = "" if mention is None else str(mention)
+    right = "" if right is None else str(right)
+
+    sentence = left + mention + right
+    lead = len(sentence) - len(sentence.lstrip())
+    start = len(left) - lead
+    return sentence.strip(), start, start + len(mention)
+
+
+class ReportGroup:
+    """
+    Collects the sentences + mentions of one report into one ReLiK doc. Sentences
+    are joined in row order; a sentence with several mentions is emitted once.
+    A single mention-free sentence between two mention sentences (sentence_left
+    of the next row == sentence_right of the previous one) is filled in, if it
+    is at most MAX_GAP_FILL_CHARS long (raw dumps contain e.g. base64 blobs).
+    """
+
+    def __init__(self, document: str):
+        self.document = document
+        self.first_line: Optional[int] = None
+        self.text = ""
+        self.offsets: Dict[str, int] = {}
+        self.last_sentence = ""
+        self.last_right = ""
+        self.spans: List[List[Any]] = []
+        self.meta: List[Dict[str, Any]] = []
+
+    def _append_sentence(self, sentence: str) -> int:
+        if self.text:
+            self.text += " "
+        offset = len(self.text)
+        self.text += sentence
+        self.offsets.setdefault(sentence, offset)
+        self.last_sentence = sentence
+        return offset
+
+    def _locate(self, ex: Dict[str, Any], sentence: str) -> int:
+        """Offset of `sentence` in the report text, appending it (and a short gap sentence) if new."""
+        # same sentence already in this report (several mentions per sentence)
+        if sentence in self.offsets:
+            return self.offsets[sentence]
+
+        sent_left = str(ex.get("sentence_left") or "").strip()
+        if (self.text and sent_left and sent_left != self.last_sentence and sent_left == self.last_right
+                and len(sent_left) <= MAX_GAP_FILL_CHARS and sent_left not in self.offsets):
+            # one short sentence without mentions in between -> fill the gap
+            self._append_sentence(sent_left)
+        return self._append_sentence(sentence)
+
+    def add(self, i: int, ex: Dict[str, Any]) -> bool:
+        mention = ex.get("mention", "")
+        if not mention:
+            return False
+
+        sentence, start, end = build_sentence(ex)
+        if start < 0 or end > len(sentence) or sentence[start:end] != str(mention):
+            # fallback: try to find mention in sentence (first occurrence)
+            idx = sentence.find(str(mention))
+            if idx == -1:
+                return False
+            start = idx
+            end = idx + len(str(mention))
+
+        offset = self._locate(ex, sentence)
+        if self.first_line is None:
+            self.first_line = i
+        self.last_right = str(ex.get("sentence_right") or "").strip()
+        self.spans.append([offset + start, offset + end, label_of(ex)])
+        self.meta.append(build_meta(ex))
+        return True
+
+    def to_relik(self) -> List[Dict[str, Any]]:
+        # doc_id = raw line index of the first mention, stable no matter how the file is chunked
+        if self.first_line is None:
+            return []
+        order = sorted(range(len(self.spans)), key=lambda j: (self.spans[j][0], self.spans[j][1]))
+        return [{
+            "doc_id": self.first_line,
+            "doc_text": self.text,
+            "doc_span_annotations": [self.spans[j] for j in order],
+            "meta": {
+                "document": self.document,
+                "mentions": [self.meta[j] for j in order],
+            },
+        }]
+
+
+def group_examples(rows: Iterable[Tuple[int, Dict[str, Any]]], stats: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """
+    Groups consecutive raw rows with the same `document` into report docs.
+    Rows of one report are contiguous in AnnoCTR, so only one report is held in memory.
+    """
+    group: Optional[ReportGroup] = None
+
+    for i, ex in rows:
+        document = ex.get("document")
+        if group is None or document != group.document:
+            if group is not None:
+                yield from group.to_relik()
+            group = ReportGroup(document)
+
+        if group.add(i, ex):
+            stats["mentions"] += 1
+        else:
+            stats["dropped"] += 1
+
+    if group is not None:
+        yield from group.to_relik()
+
+
+def iter_rows(path: Path, start: int, end: int, first_line: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(line index, raw row) for the non-empty lines of a byte range."""
+    for i, line in enumerate(iter_range_lines(path, start, end), start=first_line):
+        line = line.strip()
+        if not line:
             continue
+        yield i, loads(line)
+
+
+def convert_range(task: Tuple[str, int, int, int, bool]) -> Tuple[bytes, Dict[str, int]]:
+    """Worker: converts one byte range and returns the serialized lines + counters."""
+    path, start, end, first_line, group_by_document = task
+    rows = iter_rows(Path(path), start, end, first_line)
+    stats = {"written": 0, "mentions": 0, "dropped": 0}
+    out = []
+
+    if group_by_document:
+        for relik_ex in group_examples(rows, stats):
+            out.append(dumps_line(relik_ex))
+            stats["written"] += 1
+    else:
+        for i, ex in rows:
+            relik_ex = convert_example(i, ex)
+            if relik_ex is None:
+                stats["dropped"] += 1
+                continue
+            out.append(dumps_line(relik_ex))
+            stats["written"] += 1
 
-        out_path = OUT_DIR / f"{split}.jsonl"
-        n = 0
-        dropped = 0
-
-        with in_path.open("r", encoding="utf-8") as fin, out_path.open("w", encoding="utf-8") as fout:
-            for i, line in enumerate(fin):
-                line = line.strip()
-                if not line:
-                    continue
-                ex = json.loads(line)
-
-                mention = ex.get("mention", "")
-                context_left = ex.get("context_left", "")
-                context_right = ex.get("context_right", "")
-
-                if not mention:
-                    dropped += 1
-                    continue
-
-                doc_text = build_doc_text(ex)
-                start = len(str(context_left))
-                end = start + len(str(mention))
-
-                # sanity check
-                if end > len(doc_text) or doc_text[start:end] != str(mention):
-                    # fallback: try to find mention in doc_text (first occurrence)
-                    idx = doc_text.find(str(mention))
-                    if idx == -1:
-                        dropped += 1
-                        continue
-                    start = idx
-                    end = idx + len(str(mention))
-
-                label_title = ex.get("label_title") or ex.get("label") or "--NME--"
-
-                relik_ex = {
-                    "doc_id": i,
-                    "doc_text": doc_text,
-                    "doc_span_annotations": [
-                        [start, end, label_title]
-                    ],
-                    # keep extra fields for traceability/debugging
-                    "meta": {
-                        "mention": ex.get("mention"),
-                        "label": ex.get("label"),
-                        "label_id": ex.get("label_id"),
-                        "label_link": ex.get("label_link"),
-                        "entity_class": ex.get("entity_class"),
-                        "entity_type": ex.get("entity_type"),
-                    }
-                }
-
-                fout.write(json.dumps(relik_ex, ensure_ascii=False) + "\n")
-                n += 1
+    return b"".join(out), stats
 
+
+def _count_lines(task: Tuple[str, int, int]) -> int:
+    path, start, end = task
+    return count_range_lines(Path(path), start, end)
+
+
+def _document_key(line: bytes) -> Any:
+    return loads(line).get("document")
+
+
+def convert_split(split: str, in_path: Path, out_path: Path, group_by_document: bool, pool=None,
+                  workers: int = 1) -> None:
+    ranges = plan_byte_ranges(in_path, n_chunks=None if workers == 1 else workers * 4)
+    if group_by_document:
+        # a report must not be split across two workers
+        ranges = align_ranges(in_path, ranges, _document_key)
+
+    imap = pool.imap if pool is not None else map
+
+    # global line index of every range start (doc_id = line number, like the sequential version)
+    counts = list(imap(_count_lines, [(str(in_path), a, b) for a, b in ranges]))
+    first_lines = [sum(counts[:k]) for k in range(len(counts))]
+    tasks = [(str(in_path), a, b, first, group_by_document) for (a, b), first in zip(ranges, first_lines)]
+
+    totals = {"written": 0, "mentions": 0, "dropped": 0}
+    with out_path.open("wb", buffering=WRITE_BUFFER) as fout:
+        for blob, stats in imap(convert_range, tasks):
+            fout.write(blob)
+            for k, v in stats.items():
+                totals[k] += v
+
+    n = totals["written"]
+    dropped = totals["dropped"]
+    if group_by_document:
+        print(f"[{split}] wrote {n} report docs with {totals['mentions']} mentions -> {out_path} (dropped={dropped})")
+    else:
         print(f"[{split}] wrote {n} examples -> {out_path} (dropped={dropped})")
 
+
+def main():
+    parser = argparse.ArgumentParser(description="AnnoCTR -> ReLiK jsonl")
+    parser.add_argument("--group-by-document", action="store_true", default=GROUP_BY_DOCUMENT,
+                        help="one doc per report instead of one doc per mention")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="worker processes (default: all cores, 1 = no pool)")
+    parser.add_argument("--split", action="append", choices=list(SPLITS),
+                        help="only convert this split (repeatable; default: all)")
+    args = parser.parse_args()
+    workers = args.workers or default_workers()
+
+    if not FAST_JSON:
+        print("orjson not installed -> parsing with stdlib json")
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for split, in_path in SPLITS.items():
+            if args.split and split not in args.split:
+                continue
+            if not in_path.exists():
+                print(f"[{split}] missing input: {in_path}")
+                continue
+
+            out_path = OUT_DIR / f"{split}.jsonl"
+            convert_split(split, in_path, out_path, args.group_by_document, pool=pool, workers=workers)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
     print("conversion done.")
 
 if __name__ == "__main__":
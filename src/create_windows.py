@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
+"""
+Erzeugt ReLiK-Windows (`*.window.jsonl`) direkt im Prozess statt über
+`python -m relik.cli.cli data create-windows`:
+  - spaCy-Tokenizer wird einmal geladen und für alle Splits benutzt
+  - Tokenisierung läuft gebatcht über `nlp.pipe(..., n_process=N)`
+  - Windows werden batchweise gestreamt geschrieben
+
+Das Ausgabeformat ist identisch zu `relik data create-windows`
+(tokens, token2char_*, char2token_*, window_labels, window_labels_tokens).
+"""
 from __future__ import annotations
 
-import subprocess
-import sys
+import argparse
+import json
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -14,25 +25,183 @@ SPLITS = [
     ("test",  ROOT / "data/processed/relik/test.jsonl",  ROOT / "data/windowed/relik/test.window.jsonl"),
 ]
 
+# same defaults as `relik data create-windows`
+WINDOW_SIZE = 32
+WINDOW_STRIDE = 16
+LANGUAGE = "en"
+WRITE_BATCH_SIZE = 10_000
+
+# spaCy pipe settings
+PIPE_BATCH_SIZE = 256
+N_PROCESS = 1
+
+
+def load_tokenizer(language: str = LANGUAGE):
+    """Tokenizer-only spaCy pipeline (same rules as relik's SpacyTokenizer, no model weights needed)."""
+    import spacy
+
+    return spacy.blank(language)
+
+
+def split_windows(n_tokens: int, window_size: int, stride: int) -> List[Tuple[int, int]]:
+    """
+    Token ranges of the windows of one document (relik WindowSentenceSplitter):
+    the last window is shifted back so it is always full, unless it would only
+    repeat tokens of the previous window.
+    """
+    ranges = []
+    for i in range(0, n_tokens, stride):
+        if i != 0 and i + window_size > n_tokens:
+            overflowing = i + window_size - n_tokens
+            if overflowing >= stride:
+                break
+            i -= overflowing
+        ranges.append((i, min(i + window_size, n_tokens)))
+    return ranges
+
+
+def label_token_span(
+    start_char: int, end_char: int, starts: Sequence[int], ends: Sequence[int]
+) -> Optional[Tuple[int, int]]:
+    """Window-local [start, end) token span of all tokens overlapping the char span, None if no token overlaps."""
+    first = next((i for i in range(len(starts)) if ends[i] > start_char), None)
+    last = next((i for i in range(len(starts) - 1, -1, -1) if starts[i] < end_char), None)
+    if first is None or last is None or last < first:
+        return None
+    return first, last + 1
+
+
+def build_windows(
+    doc: Dict[str, Any],
+    tokens: List[Tuple[str, int]],
+    doc_topic: Optional[str],
+    window_size: int = WINDOW_SIZE,
+    stride: int = WINDOW_STRIDE,
+) -> Iterator[Dict[str, Any]]:
+    """Windows of one processed doc; `tokens` = (text, char offset) per token."""
+    doc_text = doc["doc_text"]
+    annotations = doc.get("doc_span_annotations", [])
+
+    for window_id, (a, b) in enumerate(split_windows(len(tokens), window_size, stride)):
+        yield window_record(doc["doc_id"], window_id, doc_text, tokens[a:b], a, doc_topic, annotations)
 
-def run_relik_create_windows(inp: Path, out: Path) -> None:
+
+def window_record(
+    doc_id: Any,
+    window_id: int,
+    doc_text: str,
+    tokens: Sequence[Tuple[str, int]],
+    first_token: int,
+    doc_topic: Optional[str],
+    annotations: Sequence[Sequence[Any]] = (),
+    text_offset: int = 0,
+) -> Dict[str, Any]:
+    """
+    One window over `tokens` (doc-level char offsets, `first_token` = doc-level index of tokens[0]).
+    `doc_text` may be a slice of the document starting at char `text_offset`.
+    """
+    window_tokens = [t for t, _ in tokens]
+    starts = [idx for _, idx in tokens]
+    ends = [idx + len(t) for t, idx in tokens]
+    offset = starts[0]
+    text = doc_text[offset - text_offset:ends[-1] - text_offset]
+
+    window_labels = []
+    window_labels_tokens = []
+    for start_char, end_char, label in annotations:
+        if start_char >= offset and end_char <= offset + len(text):
+            span = label_token_span(start_char, end_char, starts, ends)
+            if span is None:
+                # Span liegt nur auf Whitespace: weder Char- noch Token-Label, damit beide Listen gleich lang bleiben
+                continue
+            window_labels.append([start_char, end_char, label])
+            window_labels_tokens.append([span[0], span[1], label])
+
+    return {
+        "doc_id": doc_id,
+        "window_id": window_id,
+        "text": text,
+        "tokens": window_tokens,
+        "words": window_tokens,
+        "doc_topic": doc_topic,
+        "offset": offset,
+        "spans": [],
+        "token2char_start": {str(i): s for i, s in enumerate(starts)},
+        "token2char_end": {str(i): e for i, e in enumerate(ends)},
+        "char2token_start": {str(s): first_token + i for i, s in enumerate(starts)},
+        "char2token_end": {str(e): first_token + i for i, e in enumerate(ends)},
+        "window_labels": window_labels,
+        "window_labels_tokens": window_labels_tokens,
+    }
+
+
+def iter_batches(path: Path, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def window_split(
+    nlp,
+    inp: Path,
+    out: Path,
+    window_size: int = WINDOW_SIZE,
+    stride: int = WINDOW_STRIDE,
+    n_process: int = N_PROCESS,
+) -> int:
     out.parent.mkdir(parents=True, exist_ok=True)
-    cmd = [
-        sys.executable, "-m", "relik.cli.cli",
-        "data", "create-windows",
-        str(inp), str(out),
-    ]
-    print("RUN:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
+    n_windows = 0
+    with out.open("w", encoding="utf-8") as fout:
+        for batch in iter_batches(inp, WRITE_BATCH_SIZE):
+            texts = [doc["doc_text"] for doc in batch]
+            docs_tokens = [
+                [(tok.text, tok.idx) for tok in spacy_doc]
+                for spacy_doc in nlp.pipe(texts, batch_size=PIPE_BATCH_SIZE, n_process=n_process)
+            ]
+            # relik sets doc_topic once per batch from the first token of the first doc
+            doc_topic = next((toks[0][0] for toks in docs_tokens[:1] if toks), None)
+
+            lines = []
+            for doc, tokens in zip(batch, docs_tokens):
+                for window in build_windows(doc, tokens, doc_topic, window_size, stride):
+                    lines.append(json.dumps(window) + "\n")
+            fout.writelines(lines)
+            n_windows += len(lines)
+    return n_windows
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="processed ReLiK jsonl -> window jsonl")
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE)
+    parser.add_argument("--window-stride", type=int, default=WINDOW_STRIDE)
+    parser.add_argument("--n-process", type=int, default=N_PROCESS, help="spaCy tokenizer processes")
+    parser.add_argument("--pack", action="store_true", help="additionally write the columnar window store")
+    parser.add_argument("--split", action="append", choices=[name for name, _, _ in SPLITS],
+                        help="only window this split (repeatable; default: all)")
+    args = parser.parse_args()
+
+    nlp = load_tokenizer()
     for name, inp, out in SPLITS:
+        if args.split and name not in args.split:
+            continue
         if not inp.exists():
             print(f"[{name}] missing input: {inp}")
             continue
         print(f"\n==> [{name}] {inp} -> {out}")
-        run_relik_create_windows(inp, out)
+        n = window_split(nlp, inp, out, args.window_size, args.window_stride, args.n_process)
+        print(f"[{name}] wrote {n} windows")
+        if args.pack:
+            from window_store import pack
+
+            print(f"[{name}] packed -> {pack(out)}")
 
     print("\n✅ windows created")
 
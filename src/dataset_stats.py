@@ -1 +1,287 @@
-# Erstellt die „kurze Datensatzanalyse“:
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Erstellt die „kurze Datensatzanalyse“: ein Streaming-Durchgang pro Split, Splits
+(und große Splits in Byte-Chunks) parallel in einem Worker-Pool.
+
+Pro Split (und "all"):
+  - Mentions/Dokumente, Zählungen nach entity_type, entity_class und beidem
+  - Längenverteilungen: Mention (Zeichen, Wörter), Kontext/Dokument (Zeichen), Mentions pro Dokument
+  - Label-Abdeckung: Anteil Mentions mit Label im KB (mitre_documents.jsonl), NIL-Labels,
+    Anteil der Mentions, deren Label auch im train-Split vorkommt
+  - eindeutige Mentions, Labels und Reports
+
+Feste Speichergröße auch bei Multi-GB-Korpora: Kardinalitäten per HyperLogLog,
+Längen per Quantil-Sketch (sketches.py). Nur die Label-Zählung für die
+train-Abdeckung ist exakt und wird ab MAX_EXACT_LABELS abgeschaltet.
+
+  python src/dataset_stats.py                     # processed-Splits (data/processed/relik)
+  python src/dataset_stats.py --source raw        # AnnoCTR-Rohdaten
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from jsonl_io import default_workers, iter_range_lines, loads, plan_byte_ranges
+from sketches import HyperLogLog, QuantileSketch
+
+ROOT = Path(__file__).resolve().parents[1]
+SOURCES = {
+    "processed": ROOT / "data/processed/relik",
+    "raw": ROOT / "data/raw/annoctr/linking_mitre_only",
+}
+KB_FILE = ROOT / "data/index/mitre_documents.jsonl"
+OUT_FILE = ROOT / "data/stats/dataset_stats.json"
+
+SPLITS = ["train", "val", "test"]
+NIL_LABEL = "--NME--"
+# exact per-label counts (needed for the train coverage) are dropped above this many labels
+MAX_EXACT_LABELS = 200_000
+
+
+class SplitStats:
+    """Mergeable statistics of one chunk / split."""
+
+    def __init__(self):
+        self.docs = 0
+        self.mentions = 0
+        self.bad_spans = 0
+        self.by_type: Counter = Counter()
+        self.by_class: Counter = Counter()
+        self.by_type_class: Counter = Counter()
+        self.in_kb = 0
+        self.nil = 0
+        self.mention_chars = QuantileSketch()
+        self.mention_words = QuantileSketch()
+        self.context_chars = QuantileSketch()
+        self.mentions_per_doc = QuantileSketch()
+        self.unique_mentions = HyperLogLog()
+        self.unique_labels = HyperLogLog()
+        self.unique_reports = HyperLogLog()
+        self.reports_known = False
+        self.labels: Optional[Counter] = Counter()
+
+    def add_doc(self, context: str, mentions: List[Dict[str, Any]], report: Optional[str],
+                kb_labels: Optional[set]) -> None:
+        self.docs += 1
+        self.context_chars.add(len(context))
+        self.mentions_per_doc.add(len(mentions))
+        if report is not None:
+            self.reports_known = True
+            self.unique_reports.add(report)
+        for m in mentions:
+            self.add_mention(m, kb_labels)
+
+    def add_mention(self, m: Dict[str, Any], kb_labels: Optional[set]) -> None:
+        self.mentions += 1
+        text, label = m["text"], m["label"]
+        etype, eclass = m.get("entity_type") or "UNKNOWN", m.get("entity_class") or "UNKNOWN"
+        self.by_type[etype] += 1
+        self.by_class[eclass] += 1
+        self.by_type_class[f"{etype}/{eclass}"] += 1
+        self.mention_chars.add(len(text))
+        self.mention_words.add(len(text.split()))
+        self.unique_mentions.add(text.casefold())
+        if label == NIL_LABEL:
+            self.nil += 1
+        else:
+            self.unique_labels.add(label)
+            if kb_labels is not None and label.casefold() in kb_labels:
+                self.in_kb += 1
+        if self.labels is not None:
+            self.labels[label] += 1
+            if len(self.labels) > MAX_EXACT_LABELS:
+                self.labels = None
+        if m.get("bad_span"):
+            self.bad_spans += 1
+
+    def merge(self, other: "SplitStats") -> "SplitStats":
+        self.docs += other.docs
+        self.mentions += other.mentions
+        self.bad_spans += other.bad_spans
+        self.in_kb += other.in_kb
+        self.nil += other.nil
+        for attr in ("by_type", "by_class", "by_type_class"):
+            getattr(self, attr).update(getattr(other, attr))
+        for attr in ("mention_chars", "mention_words", "context_chars", "mentions_per_doc",
+                     "unique_mentions", "unique_labels", "unique_reports"):
+            getattr(self, attr).merge(getattr(other, attr))
+        self.reports_known = self.reports_known or other.reports_known
+        if self.labels is None or other.labels is None:
+            self.labels = None
+        else:
+            self.labels.update(other.labels)
+            if len(self.labels) > MAX_EXACT_LABELS:
+                self.labels = None
+        return self
+
+    def to_json(self, train_labels: Optional[Counter] = None) -> Dict[str, Any]:
+        linked = self.mentions - self.nil
+        out: Dict[str, Any] = {
+            "docs": self.docs,
+            "mentions": self.mentions,
+            "bad_spans": self.bad_spans,
+            "entity_type": dict(self.by_type.most_common()),
+            "entity_class": dict(self.by_class.most_common()),
+            "entity_type_class": dict(self.by_type_class.most_common()),
+            "lengths": {
+                "mention_chars": self.mention_chars.summary(),
+                "mention_words": self.mention_words.summary(),
+                "context_chars": self.context_chars.summary(),
+                "mentions_per_doc": self.mentions_per_doc.summary(),
+            },
+            "unique": {
+                "mentions": self.unique_mentions.count(),
+                "labels": self.unique_labels.count(),
+                "reports": self.unique_reports.count() if self.reports_known else None,
+            },
+            "label_coverage": {
+                "nil_mentions": self.nil,
+                "in_kb": round(self.in_kb / linked, 4) if linked else None,
+                "label_seen_in_train": None,
+            },
+        }
+        if train_labels is not None and self.labels is not None and self.mentions:
+            seen = sum(c for label, c in self.labels.items() if label in train_labels)
+            out["label_coverage"]["label_seen_in_train"] = round(seen / self.mentions, 4)
+        return out
+
+
+# --- record formats ---
+
+def processed_doc(doc: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+    """(context, mentions, report) of a processed ReLiK doc (per-mention or grouped converter output)."""
+    text = doc.get("doc_text", "")
+    meta = doc.get("meta") or {}
+    metas = meta.get("mentions") if "mentions" in meta else [meta]
+    mentions = []
+    for (start, end, label), m in zip(doc.get("doc_span_annotations", []), metas):
+        span = text[start:end]
+        mentions.append({
+            "text": span,
+            "label": label,
+            "entity_type": m.get("entity_type"),
+            "entity_class": m.get("entity_class"),
+            "bad_span": m.get("mention") is not None and span != m.get("mention"),
+        })
+    return text, mentions, meta.get("document")
+
+
+def raw_doc(ex: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+    """One raw AnnoCTR row = one mention in its sentence context."""
+    mention = str(ex.get("mention") or "")
+    left = ex.get("_context_left", ex.get("context_left")) or ""
+    right = ex.get("_context_right", ex.get("context_right")) or ""
+    m = {
+        "text": mention,
+        "label": ex.get("label_title") or ex.get("label") or NIL_LABEL,
+        "entity_type": ex.get("entity_type"),
+        "entity_class": ex.get("entity_class"),
+    }
+    return f"{left}{mention}{right}", [m] if mention else [], ex.get("document")
+
+
+READERS = {"processed": processed_doc, "raw": raw_doc}
+
+
+def load_kb_labels(kb: Path) -> Optional[set]:
+    if not kb.exists():
+        return None
+    labels = set()
+    with kb.open("rb") as f:
+        for line in f:
+            if line.strip():
+                doc = loads(line)
+                title = (doc.get("metadata") or {}).get("title")
+                if title:
+                    labels.add(title.casefold())
+    return labels
+
+
+def stats_range(task: Tuple[str, str, str, int, int, Optional[List[str]]]) -> Tuple[str, SplitStats]:
+    split, source, path, start, end, kb = task
+    read = READERS[source]
+    kb_labels = set(kb) if kb is not None else None
+    stats = SplitStats()
+    for line in iter_range_lines(Path(path), start, end):
+        if not line.strip():
+            continue
+        context, mentions, report = read(loads(line))
+        stats.add_doc(context, mentions, report, kb_labels)
+    return split, stats
+
+
+def iter_tasks(source: str, in_dir: Path, splits: List[str], kb: Optional[set],
+               workers: int) -> Iterator[Tuple[str, str, str, int, int, Optional[List[str]]]]:
+    kb_list = sorted(kb) if kb is not None else None
+    for split in splits:
+        path = in_dir / f"{split}.jsonl"
+        if not path.exists():
+            print(f"[{split}] missing input: {path}")
+            continue
+        for start, end in plan_byte_ranges(path, n_chunks=None if workers == 1 else workers * 2):
+            yield split, source, str(path), start, end, kb_list
+
+
+def collect(source: str, in_dir: Path, splits: List[str], kb: Optional[set], workers: int) -> Dict[str, SplitStats]:
+    tasks = list(iter_tasks(source, in_dir, splits, kb, workers))
+    per_split: Dict[str, SplitStats] = {}
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            results = list(pool.imap_unordered(stats_range, tasks))
+    else:
+        results = [stats_range(t) for t in tasks]
+    for split, stats in results:
+        if split in per_split:
+            per_split[split].merge(stats)
+        else:
+            per_split[split] = stats
+    return {split: per_split[split] for split in splits if split in per_split}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="streaming dataset statistics -> JSON")
+    parser.add_argument("--source", choices=list(SOURCES), default="processed")
+    parser.add_argument("--input-dir", type=Path, default=None, help="default: directory of --source")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--kb", type=Path, default=KB_FILE)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: all cores)")
+    parser.add_argument("--out", type=Path, default=OUT_FILE)
+    args = parser.parse_args()
+
+    in_dir = args.input_dir or SOURCES[args.source]
+    workers = args.workers or default_workers()
+    kb = load_kb_labels(args.kb)
+
+    per_split = collect(args.source, in_dir, args.splits, kb, workers)
+    train_labels = per_split["train"].labels if "train" in per_split else None
+
+    result: Dict[str, Any] = {"source": args.source, "input_dir": str(in_dir), "splits": {}}
+    total = SplitStats()
+    for split, stats in per_split.items():
+        result["splits"][split] = stats.to_json(train_labels if split != "train" else None)
+        total.merge(stats)
+    result["all"] = total.to_json()
+
+    for name, s in list(result["splits"].items()) + [("all", result["all"])]:
+        lengths = s["lengths"]
+        print(f"[{name}] docs={s['docs']} mentions={s['mentions']} unique mentions~{s['unique']['mentions']} "
+              f"labels~{s['unique']['labels']} reports~{s['unique']['reports']}")
+        print(f"    types: {s['entity_type']}")
+        print(f"    classes: {s['entity_class']}")
+        print(f"    mention chars p50/p90/max: {lengths['mention_chars']['p50']}/{lengths['mention_chars']['p90']}/"
+              f"{lengths['mention_chars']['max']}, context chars p50/p90/max: {lengths['context_chars']['p50']}/"
+              f"{lengths['context_chars']['p90']}/{lengths['context_chars']['max']}")
+        print(f"    label coverage: {s['label_coverage']}")
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nstats -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Exakter Wörterbuch-Linker (Aho-Corasick) als Fast Path vor dem Dense-Retriever.
+
+Schlüssel aus `mitre_documents.jsonl`: ATT&CK-IDs (T1566, T1055.001, TA0006, G0129, S0039),
+Titel und `metadata.aliases`. Text und Schlüssel werden gleich normalisiert
+(casefold, jede Folge von Nicht-Alphanumerischem -> ein Leerzeichen, außer dem
+Punkt in Sub-Technik-IDs), Treffer
+nur an Wortgrenzen; überlappende Treffer: leftmost-longest. Ein Scan ist linear
+in der Textlänge, die Offsets zeigen auf den Originaltext.
+
+Exakte Treffer werden als Top-Candidates gepinnt (PINNED_SCORE vor allen
+Dense-Scores). Mit `dense_policy="unresolved"` läuft der Dense-Retriever nur
+noch für Windows ohne einen einzigen Treffer. Entschieden wird nur über die
+Treffer im Text, nie über Gold-Spans (`window_labels`), sonst sähe Val/Test die
+Gold-Spans. Windows mit Treffern gehen nie an den Encoder: die übrigen Slots bis
+top_k werden mit BM25 aufgefüllt (falls ein Index konfiguriert ist, damit der
+Reader auch dort Negative sieht), sonst bleiben sie leer (`warn_without_bm25`).
+
+  python src/dictionary_linker.py "Mustang Panda used T1566.001 and Zloader"
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+KB_FILE = ROOT / "data/index/mitre_documents.jsonl"
+
+# keys shorter than this (alphanumeric chars) are too ambiguous to pin
+MIN_KEY_CHARS = 3
+# score of pinned candidates: above every dense (dot product) score
+PINNED_SCORE = 10_000.0
+DENSE_POLICIES = ("always", "unresolved")
+
+ATTACK_ID = re.compile(r"^(?:T\d+(?:\.\d+)?|TA\d+|G\d+|S\d+|M\d+|C\d+)$")
+
+
+def normalize(text: str) -> Tuple[str, List[int]]:
+    """
+    (" normalized text ", original char index per normalized char); casefolded,
+    separators collapsed to one space, padded with a space on both sides. A dot
+    between digits is kept, so "T1566.001" never matches the key of T1566.
+    """
+    out = [" "]
+    offsets = [-1]
+    for i, c in enumerate(text):
+        if c.isalnum() or (c == "." and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()):
+            for f in c.casefold():
+                out.append(f)
+                offsets.append(i)
+        elif out[-1] != " ":
+            out.append(" ")
+            offsets.append(i)
+    if out[-1] != " ":
+        out.append(" ")
+        offsets.append(len(text))
+    return "".join(out), offsets
+
+
+def normalize_key(text: str) -> str:
+    return normalize(text)[0]
+
+
+class AhoCorasick:
+    """Dict-based Aho-Corasick automaton over str; values are reported at the end of each match."""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Any]] = [[]]
+        self._built = False
+
+    def add(self, key: str, value: Any) -> None:
+        state = 0
+        for c in key:
+            nxt = self.goto[state].get(c)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][c] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append(value)
+        self._built = False
+
+    def build(self) -> None:
+        queue = list(self.goto[0].values())
+        for s in queue:
+            self.fail[s] = 0
+        for s in queue:  # BFS: the queue grows while iterating
+            for c, nxt in self.goto[s].items():
+                queue.append(nxt)
+                f = self.fail[s]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+        self._built = True
+
+    def iter(self, text: str) -> Iterator[Tuple[int, Any]]:
+        """(index of the last char, value) for every match, in text order."""
+        if not self._built:
+            self.build()
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for value in out[state]:
+                yield i, value
+
+
+class Hit(NamedTuple):
+    start: int
+    end: int
+    candidates: Tuple[str, ...]
+
+
+class DictionaryLinker:
+    def __init__(self, entries: Dict[str, List[str]], fingerprint: str = ""):
+        """`entries`: normalized key -> candidate texts ("<ID> <title>") it resolves to."""
+        self.entries = entries
+        self.keys = list(entries)
+        self.automaton = AhoCorasick()
+        for i, key in enumerate(self.keys):
+            self.automaton.add(key, (len(key), i))
+        self.automaton.build()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_kb(cls, path: Path = KB_FILE, min_key_chars: int = MIN_KEY_CHARS) -> "DictionaryLinker":
+        entries: Dict[str, List[str]] = {}
+        data = Path(path).read_bytes()
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            meta = doc.get("metadata") or {}
+            names = [meta.get("title")] + list(meta.get("aliases") or [])
+            if ATTACK_ID.match(str(doc.get("id", ""))):
+                names.append(doc["id"])
+            for name in names:
+                if not name:
+                    continue
+                key = normalize_key(name)
+                if sum(c.isalnum() for c in key) < min_key_chars:
+                    continue
+                targets = entries.setdefault(key, [])
+                if doc["text"] not in targets:
+                    targets.append(doc["text"])
+        fingerprint = hashlib.sha1(data + f"|{min_key_chars}".encode()).hexdigest()
+        return cls(entries, fingerprint)
+
+    def scan(self, text: str) -> List[Hit]:
+        """Non-overlapping exact hits (leftmost-longest) with original char offsets."""
+        norm, offsets = normalize(text)
+        matches = []
+        for last, (length, i) in self.automaton.iter(norm):
+            # keys are " key ": the match spans norm[last - length + 1 : last + 1]
+            matches.append((last - length + 1, last + 1, i))
+        matches.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+
+        hits: List[Hit] = []
+        taken_until = 0
+        for a, b, i in matches:
+            # neighbouring hits share the separating space
+            if a + 1 < taken_until:
+                continue
+            hits.append(Hit(offsets[a + 1], offsets[b - 2] + 1, tuple(self.entries[self.keys[i]])))
+            taken_until = b
+        return hits
+
+
+def warn_without_bm25(dictionary: Any, dense_policy: str, bm25: Any) -> None:
+    """Resolved windows only get the pinned candidates if there is no BM25 index to fill the rest."""
+    if dictionary and dense_policy == "unresolved" and not bm25:
+        print("warning: --dictionary without --bm25: windows with exact hits get only the pinned candidates "
+              "(no negatives); add --bm25 to fill the remaining slots")
+
+
+def needs_dense(hits: Sequence[Hit]) -> bool:
+    """True if the dictionary resolved nothing in the window (decided on the text alone, see module docstring)."""
+    return not hits
+
+
+def pinned_candidates(hits: Sequence[Hit]) -> List[str]:
+    """Distinct dictionary candidates of the hits, in hit order."""
+    return list(dict.fromkeys(c for h in hits for c in h.candidates))
+
+
+def pin_candidates(hits: Sequence[Hit], texts: Sequence[str], scores: Sequence[float],
+                   top_k: int) -> Tuple[List[str], List[float]]:
+    """Dictionary candidates first (PINNED_SCORE), then the dense/BM25 ones not already pinned, cut to top_k."""
+    pinned = pinned_candidates(hits)
+    seen = set(pinned)
+    out_texts = pinned[:top_k]
+    out_scores = [PINNED_SCORE] * len(out_texts)
+    for text, score in zip(texts, scores):
+        if len(out_texts) >= top_k:
+            break
+        if text not in seen:
+            out_texts.append(text)
+            out_scores.append(float(score))
+            seen.add(text)
+    return out_texts, out_scores
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="exact dictionary hits (ATT&CK IDs, titles, aliases) in a text")
+    parser.add_argument("text")
+    parser.add_argument("--kb", type=Path, default=KB_FILE)
+    args = parser.parse_args()
+
+    linker = DictionaryLinker.from_kb(args.kb)
+    print(f"{len(linker.keys)} keys")
+    for hit in linker.scan(args.text):
+        print(f"  [{hit.start}, {hit.end}) {args.text[hit.start:hit.end]!r} -> {list(hit.candidates)}")
+
+
+if __name__ == "__main__":
+    main()
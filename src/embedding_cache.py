@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Persistenter, inhaltsadressierter Cache für Query-Embeddings der Windows.
+
+Key = sha1(encoder + precision + window text). Pro Encoder/Precision ein Verzeichnis:
+
+  <cache_dir>/<namespace-hash>/
+    meta.json       namespace, dim
+    CURRENT         Name der aktiven Generation (fehlt bei alten Caches: Dateien direkt im Verzeichnis)
+    gen-NNNNN/
+      keys.bin      20-Byte sha1 pro Zeile (append-only)
+      vectors.f32   float32-Matrix [rows, dim] (append-only, memory-mapped gelesen)
+      stamps.npy    letzte Benutzung pro Zeile (für LRU-Eviction bei `max_rows`)
+
+Die Eviction schreibt eine neue Generation und schaltet erst danach `CURRENT` per
+atomarem rename um, Keys und Vektoren wechseln also immer gemeinsam.
+
+Nur ein schreibender Prozess pro Cache-Verzeichnis: der erste Prozess hält einen
+flock auf `writer.lock`, weitere (z.B. parallele Split-Jobs) lesen nur mit.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks -> single process assumed
+    fcntl = None
+
+ROOT = Path(__file__).resolve().parents[1]
+CACHE_DIR = ROOT / "data/cache/query_embeddings"
+
+# default size cap (rows); on overflow the least recently used rows are dropped
+MAX_ROWS = 2_000_000
+# after eviction the cache is shrunk to this fraction of `max_rows`
+EVICT_TO = 0.8
+
+KEY_BYTES = 20
+
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+
+def namespace_of(encoder: str, precision: str) -> str:
+    return f"{encoder}|{precision}"
+
+
+class EmbeddingCache:
+    def __init__(self, encoder: str, precision: str, dim: int, cache_dir: Path = CACHE_DIR,
+                 max_rows: Optional[int] = MAX_ROWS):
+        self.namespace = namespace_of(encoder, precision)
+        self.dim = dim
+        self.max_rows = max_rows
+        self.path = Path(cache_dir) / hashlib.sha1(self.namespace.encode("utf-8")).hexdigest()[:16]
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta["dim"] != dim or meta["namespace"] != self.namespace:
+                raise ValueError(f"embedding cache {self.path} was built for {meta}, not {self.namespace} / dim={dim}")
+        else:
+            meta_path.write_text(json.dumps({"namespace": self.namespace, "dim": dim}), encoding="utf-8")
+
+        self.read_only = not self._acquire_writer_lock()
+        if self.read_only:
+            print(f"embedding cache {self.path} is written by another process -> read-only")
+
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.memmap] = None
+        self._load_index()
+
+    def _acquire_writer_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        self._lock_file = (self.path / "writer.lock").open("a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    # --- files ---
+
+    def _resolve_data_dir(self) -> Path:
+        current = self.path / CURRENT_FILE
+        return self.path / current.read_text(encoding="utf-8").strip() if current.exists() else self.path
+
+    @property
+    def _keys_file(self) -> Path:
+        return self._data_dir / "keys.bin"
+
+    @property
+    def _vectors_file(self) -> Path:
+        return self._data_dir / "vectors.f32"
+
+    @property
+    def _stamps_file(self) -> Path:
+        return self._data_dir / "stamps.npy"
+
+    def _generations(self) -> List[Path]:
+        return sorted(p for p in self.path.glob(f"{GENERATION_PREFIX}*") if p.is_dir())
+
+    def _load_index(self) -> None:
+        self._data_dir = self._resolve_data_dir()
+        keys = self._keys_file.read_bytes() if self._keys_file.exists() else b""
+        vec_bytes = self._vectors_file.stat().st_size if self._vectors_file.exists() else 0
+        # a killed writer may leave a partial row behind -> only trust complete rows in both files
+        rows = min(len(keys) // KEY_BYTES, vec_bytes // (4 * self.dim))
+        # (a read-only instance leaves the tail alone: the writer may be appending right now)
+        if not self.read_only and len(keys) != rows * KEY_BYTES:
+            with self._keys_file.open("r+b") as f:
+                f.truncate(rows * KEY_BYTES)
+        if not self.read_only and vec_bytes != rows * 4 * self.dim:
+            with self._vectors_file.open("r+b") as f:
+                f.truncate(rows * 4 * self.dim)
+
+        self.index: Dict[bytes, int] = {keys[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(rows)}
+        self.rows = rows
+
+        stamps = np.load(self._stamps_file) if self._stamps_file.exists() else np.zeros(0, dtype=np.int64)
+        self.stamps = np.zeros(rows, dtype=np.int64)
+        n = min(rows, len(stamps))
+        self.stamps[:n] = stamps[:n]
+        self.clock = int(self.stamps.max()) + 1 if rows else 1
+        self._vectors = None
+
+    def _matrix(self) -> np.ndarray:
+        if self.rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._vectors is None or self._vectors.shape[0] != self.rows:
+            self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._vectors
+
+    # --- API ---
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.namespace}\0{text}".encode("utf-8")).digest()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        """({input idx: vector} for cached texts, [input idx] of missing texts)."""
+        found: Dict[int, np.ndarray] = {}
+        missing: List[int] = []
+        rows = []
+        for i, text in enumerate(texts):
+            row = self.index.get(self.key(text))
+            if row is None:
+                missing.append(i)
+            else:
+                rows.append((i, row))
+
+        if rows:
+            matrix = self._matrix()
+            idx = np.fromiter((r for _, r in rows), dtype=np.int64, count=len(rows))
+            vectors = np.asarray(matrix[idx])
+            self.stamps[idx] = self.clock
+            for (i, _), vec in zip(rows, vectors):
+                found[i] = vec
+        self.clock += 1
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def put(self, texts: Sequence[str], vectors: np.ndarray) -> None:
+        if self.read_only:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        new_keys = []
+        new_rows = []
+        for text, vec in zip(texts, vectors):
+            k = self.key(text)
+            if k in self.index:
+                continue
+            self.index[k] = self.rows + len(new_keys)
+            new_keys.append(k)
+            new_rows.append(vec)
+        if not new_keys:
+            return
+
+        # vectors first: on a crash between the two writes the orphan row is dropped by _load_index
+        with self._vectors_file.open("ab") as f:
+            f.write(np.stack(new_rows).tobytes())
+        with self._keys_file.open("ab") as f:
+            f.write(b"".join(new_keys))
+
+        self.rows += len(new_keys)
+        self.stamps = np.concatenate([self.stamps, np.full(len(new_keys), self.clock, dtype=np.int64)])
+        self._vectors = None
+
+        if self.max_rows is not None and self.rows > self.max_rows:
+            self.evict(int(self.max_rows * EVICT_TO))
+
+    def evict(self, keep_rows: int) -> None:
+        """Keep only the `keep_rows` most recently used rows (rewrites the files)."""
+        if self.read_only or self.rows <= keep_rows:
+            return
+        keep = np.sort(np.argsort(-self.stamps, kind="stable")[:keep_rows])
+        keys = self._keys_file.read_bytes()
+        matrix = np.asarray(self._matrix()[keep])
+        old_dir = self._data_dir
+
+        # new generation next to the old one; it only becomes visible with the CURRENT rename below
+        generations = self._generations()
+        number = int(generations[-1].name[len(GENERATION_PREFIX):]) + 1 if generations else 0
+        new_dir = self.path / f"{GENERATION_PREFIX}{number:05d}"
+        new_dir.mkdir()
+        for name, data in (("vectors.f32", matrix.tobytes()),
+                           ("keys.bin", b"".join(keys[r * KEY_BYTES:(r + 1) * KEY_BYTES] for r in keep))):
+            with (new_dir / name).open("wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        np.save(new_dir / "stamps.npy", self.stamps[keep])
+
+        tmp = self.path / (CURRENT_FILE + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            f.write(new_dir.name)
+            f.flush()
+            os.fsync(f.fileno())
+        self._vectors = None
+        os.replace(tmp, self.path / CURRENT_FILE)
+
+        # the previous generation stays for readers that resolved CURRENT just before the switch
+        for stale in self._generations():
+            if stale not in (new_dir, old_dir):
+                shutil.rmtree(stale, ignore_errors=True)
+        if old_dir == self.path:
+            for name in ("keys.bin", "vectors.f32", "stamps.npy"):
+                (self.path / name).unlink(missing_ok=True)
+        print(f"embedding cache: evicted {self.rows - len(keep)} rows, kept {len(keep)}")
+        self._load_index()
+
+    def flush(self) -> None:
+        """Persist usage stamps (vectors/keys are written on `put`)."""
+        if self.read_only:
+            return
+        np.save(self._stamps_file, self.stamps)
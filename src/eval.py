@@ -1 +1,312 @@
-# Evaluation auf Dev/Test:
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Evaluation auf Dev/Test: Entity Linking P/R/F1 aus Reader-Predictions + `*.window.candidates.jsonl`.
+
+Ein Durchgang über beide Dateien (gleiche Window-Reihenfolge wird im Gleichschritt
+gelesen, sonst werden die Predictions nach (doc_id, window_id) nachgeschlagen).
+Gold = `window_labels` (Doc-Char-Offsets); da sich Windows überlappen, wird auf
+Dokument-Ebene dedupliziert. Gematcht wird vektorisiert über numpy-Zeilen
+(doc, start, end, label):
+  el    Span-Grenzen + Entity müssen stimmen
+  span  nur Span-Grenzen
+Aufschlüsselung nach entity_type (TECHNIQUE, MALWARE, TACTIC, GROUP, TOOL) und
+entity_class (aus `meta` der processed-Datei); micro = über alle Spans, macro =
+Mittel über die Typen/Klassen. Predictions ohne Gold-Span bekommen den Typ aus der
+KB und die häufigste Klasse ihres Labels in den Gold-Mentions.
+
+  python src/eval.py --split test
+  python src/eval.py --predictions preds.jsonl --candidates test.window.candidates.jsonl --min-f1 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from jsonl_io import loads
+
+ROOT = Path(__file__).resolve().parents[1]
+PROC_DIR = ROOT / "data/processed/relik"
+CAND_DIR = ROOT / "data/candidates/relik"
+PRED_DIR = ROOT / "data/predictions/relik"
+OUT_DIR = ROOT / "data/eval"
+
+ENTITY_TYPES = ["TECHNIQUE", "MALWARE", "TACTIC", "GROUP", "TOOL"]
+UNKNOWN = "UNKNOWN"
+
+# fields a reader prediction record may carry its spans in (first one present wins)
+PREDICTION_FIELDS = ("predicted_window_labels_chars", "predicted_spans", "predictions")
+
+# candidate texts are "<ATT&CK id> <title>", gold labels are the plain title
+KB_ID_PREFIX = re.compile(r"^(?:T\d+(?:\.\d+)?|TA\d+|G\d+|S\d+|M\d+|C\d+)\s+")
+
+
+def normalize_label(label: Any) -> str:
+    return KB_ID_PREFIX.sub("", str(label)).strip().casefold()
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    with path.open("rb") as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+def span_items(items: Sequence[Any]) -> Iterator[Tuple[int, int, Any]]:
+    """[start, end, label] lists or {"start", "end", "label"} dicts."""
+    for item in items or ():
+        if isinstance(item, dict):
+            yield int(item["start"]), int(item["end"]), item.get("label")
+        else:
+            yield int(item[0]), int(item[1]), item[2]
+
+
+def predicted_spans(record: Dict[str, Any]) -> List[Tuple[int, int, Any]]:
+    for field in PREDICTION_FIELDS:
+        if field in record:
+            return list(span_items(record[field]))
+    return []
+
+
+def load_span_types(processed: Optional[Path]) -> Dict[Tuple[Any, int, int], Tuple[str, str]]:
+    """(doc_id, start, end) -> (entity_type, entity_class) from the processed split (both converter modes)."""
+    types: Dict[Tuple[Any, int, int], Tuple[str, str]] = {}
+    if processed is None or not processed.exists():
+        return types
+    for doc in iter_jsonl(processed):
+        meta = doc.get("meta") or {}
+        mentions = meta.get("mentions") if "mentions" in meta else [meta]
+        for (start, end, _), m in zip(doc.get("doc_span_annotations", []), mentions):
+            types[(doc["doc_id"], start, end)] = (m.get("entity_type") or UNKNOWN, m.get("entity_class") or UNKNOWN)
+    return types
+
+
+def load_label_classes(processed: Optional[Path]) -> Dict[str, str]:
+    """normalized label -> most frequent gold entity_class (class of predictions without a gold span)."""
+    counts: Dict[str, Dict[str, int]] = {}
+    if processed is None or not processed.exists():
+        return {}
+    for doc in iter_jsonl(processed):
+        meta = doc.get("meta") or {}
+        mentions = meta.get("mentions") if "mentions" in meta else [meta]
+        for (_, _, label), m in zip(doc.get("doc_span_annotations", []), mentions):
+            if m.get("entity_class"):
+                per_label = counts.setdefault(normalize_label(label), {})
+                per_label[m["entity_class"]] = per_label.get(m["entity_class"], 0) + 1
+    return {label: max(c, key=c.get) for label, c in counts.items()}
+
+
+def load_kb_types(kb: Optional[Path]) -> Dict[str, str]:
+    """normalized title -> entity_type of the KB documents (type of predictions without a gold span)."""
+    out: Dict[str, str] = {}
+    if kb is None or not kb.exists():
+        return out
+    for doc in iter_jsonl(kb):
+        meta = doc.get("metadata") or {}
+        if meta.get("entity_type"):
+            out[normalize_label(meta.get("title") or doc.get("text", ""))] = meta["entity_type"]
+    return out
+
+
+def iter_joined(candidates: Path, predictions: Path) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """(window, prediction) pairs; lockstep while the order matches, dict lookup after the first mismatch."""
+    preds = iter_jsonl(predictions)
+    lookup: Optional[Dict[Tuple[Any, Any], Dict[str, Any]]] = None
+    for window in iter_jsonl(candidates):
+        key = (window["doc_id"], window["window_id"])
+        if lookup is None:
+            pred = next(preds, None)
+            if pred is not None and (pred.get("doc_id"), pred.get("window_id")) == key:
+                yield window, pred
+                continue
+            lookup = {}
+            if pred is not None:
+                lookup[(pred.get("doc_id"), pred.get("window_id"))] = pred
+            for p in preds:
+                lookup[(p.get("doc_id"), p.get("window_id"))] = p
+        yield window, lookup.get(key, {})
+
+
+class Vocab:
+    def __init__(self, items: Sequence[str] = ()):
+        self.index: Dict[Any, int] = {}
+        self.items: List[Any] = []
+        for item in items:
+            self(item)
+
+    def __call__(self, item: Any) -> int:
+        i = self.index.get(item)
+        if i is None:
+            i = self.index[item] = len(self.items)
+            self.items.append(item)
+        return i
+
+
+def row_keys(rows: np.ndarray) -> np.ndarray:
+    """One opaque (void) key per int64 row, for set operations on whole rows."""
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+def unique_rows(rows: np.ndarray) -> np.ndarray:
+    """Indices of the first occurrence of every distinct row."""
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, first = np.unique(row_keys(rows), return_index=True)
+    return np.sort(first)
+
+
+def prf(tp: np.ndarray, n_pred: np.ndarray, n_gold: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    tp, n_pred, n_gold = (np.asarray(x, dtype=np.float64) for x in (tp, n_pred, n_gold))
+    p = np.divide(tp, n_pred, out=np.zeros_like(tp), where=n_pred > 0)
+    r = np.divide(tp, n_gold, out=np.zeros_like(tp), where=n_gold > 0)
+    f = np.divide(2 * p * r, p + r, out=np.zeros_like(tp), where=(p + r) > 0)
+    return p, r, f
+
+
+def breakdown(names: List[str], tp: np.ndarray, n_pred: np.ndarray, n_gold: np.ndarray) -> Dict[str, Any]:
+    """Per-group P/R/F1 + micro (pooled counts) + macro (mean over groups with gold spans)."""
+    p, r, f = prf(tp, n_pred, n_gold)
+    groups = {
+        name: {"precision": round(float(p[i]), 4), "recall": round(float(r[i]), 4), "f1": round(float(f[i]), 4),
+               "tp": int(tp[i]), "pred": int(n_pred[i]), "gold": int(n_gold[i])}
+        for i, name in enumerate(names) if n_gold[i] or n_pred[i]
+    }
+    mp, mr, mf = prf(tp.sum(keepdims=True), n_pred.sum(keepdims=True), n_gold.sum(keepdims=True))
+    active = n_gold > 0
+    return {
+        "micro": {"precision": round(float(mp[0]), 4), "recall": round(float(mr[0]), 4), "f1": round(float(mf[0]), 4),
+                  "tp": int(tp.sum()), "pred": int(n_pred.sum()), "gold": int(n_gold.sum())},
+        "macro": {"precision": round(float(p[active].mean()), 4) if active.any() else 0.0,
+                  "recall": round(float(r[active].mean()), 4) if active.any() else 0.0,
+                  "f1": round(float(f[active].mean()), 4) if active.any() else 0.0},
+        "groups": groups,
+    }
+
+
+def evaluate(candidates: Path, predictions: Path, processed: Optional[Path] = None,
+             kb: Optional[Path] = None) -> Dict[str, Any]:
+    span_types = load_span_types(processed)
+    kb_types = load_kb_types(kb)
+    label_classes = load_label_classes(processed)
+    docs, labels = Vocab(), Vocab()
+    type_vocab, class_vocab = Vocab(ENTITY_TYPES + [UNKNOWN]), Vocab([UNKNOWN])
+
+    # int rows (doc, start, end, label, type, class), appended flat and reshaped once
+    gold: List[int] = []
+    pred: List[int] = []
+    n_windows = 0
+    for window, prediction in iter_joined(candidates, predictions):
+        n_windows += 1
+        doc_id = window["doc_id"]
+        d = docs(doc_id)
+        for start, end, label in span_items(window.get("window_labels", [])):
+            etype, eclass = span_types.get((doc_id, start, end), (UNKNOWN, UNKNOWN))
+            gold.extend((d, start, end, labels(normalize_label(label)), type_vocab(etype), class_vocab(eclass)))
+        for start, end, label in predicted_spans(prediction):
+            key = normalize_label(label)
+            pred.extend((d, start, end, labels(key), type_vocab(kb_types.get(key, UNKNOWN)),
+                         class_vocab(label_classes.get(key, UNKNOWN))))
+
+    gold_rows = np.asarray(gold, dtype=np.int64).reshape(-1, 6)
+    pred_rows = np.asarray(pred, dtype=np.int64).reshape(-1, 6)
+    # overlapping windows repeat the same doc-level span -> count every (doc, span, label) once
+    gold_rows = gold_rows[unique_rows(gold_rows[:, :4])]
+    pred_rows = pred_rows[unique_rows(pred_rows[:, :4])]
+
+    # predictions on a gold span take its type/class (otherwise KB type, gold class of the label)
+    if len(gold_rows) and len(pred_rows):
+        gold_keys = row_keys(gold_rows[:, :3])
+        pred_keys = row_keys(pred_rows[:, :3])
+        order = np.argsort(gold_keys, kind="stable")
+        src = order[np.minimum(np.searchsorted(gold_keys[order], pred_keys), len(order) - 1)]
+        on_gold = gold_keys[src] == pred_keys
+        pred_rows[on_gold, 4:] = gold_rows[src[on_gold], 4:]
+
+    result: Dict[str, Any] = {
+        "candidates": str(candidates),
+        "predictions": str(predictions),
+        "windows": n_windows,
+        "documents": len(docs.items),
+    }
+    for mode, cols in (("el", 4), ("span", 3)):
+        g_keys = row_keys(gold_rows[:, :cols])
+        p_keys = row_keys(pred_rows[:, :cols])
+        if mode == "span":
+            # several labels on one span count as one span
+            g_first, p_first = unique_rows(gold_rows[:, :3]), unique_rows(pred_rows[:, :3])
+            g_rows, p_rows = gold_rows[g_first], pred_rows[p_first]
+            g_keys, p_keys = g_keys[g_first], p_keys[p_first]
+        else:
+            g_rows, p_rows = gold_rows, pred_rows
+        gold_hit = np.isin(g_keys, p_keys)
+
+        mode_result = {}
+        for by, col, vocab in (("entity_type", 4, type_vocab), ("entity_class", 5, class_vocab)):
+            n = len(vocab.items)
+            tp = np.bincount(g_rows[gold_hit, col], minlength=n)
+            n_gold = np.bincount(g_rows[:, col], minlength=n)
+            n_pred = np.bincount(p_rows[:, col], minlength=n)
+            mode_result[by] = breakdown(vocab.items, tp, n_pred, n_gold)
+        result[mode] = mode_result
+    return result
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{result['windows']} windows, {result['documents']} documents")
+    for mode in ("el", "span"):
+        for by in ("entity_type", "entity_class"):
+            block = result[mode][by]
+            print(f"\n[{mode}] by {by}")
+            print(f"  {'':<12} {'P':>7} {'R':>7} {'F1':>7} {'tp':>7} {'pred':>7} {'gold':>7}")
+            for name, m in block["groups"].items():
+                print(f"  {name:<12} {m['precision']:>7.4f} {m['recall']:>7.4f} {m['f1']:>7.4f} "
+                      f"{m['tp']:>7} {m['pred']:>7} {m['gold']:>7}")
+            mi, ma = block["micro"], block["macro"]
+            print(f"  {'micro':<12} {mi['precision']:>7.4f} {mi['recall']:>7.4f} {mi['f1']:>7.4f} "
+                  f"{mi['tp']:>7} {mi['pred']:>7} {mi['gold']:>7}")
+            print(f"  {'macro':<12} {ma['precision']:>7.4f} {ma['recall']:>7.4f} {ma['f1']:>7.4f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="entity linking evaluation (reader predictions vs window labels)")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--predictions", type=Path, default=None,
+                        help="default: data/predictions/relik/<split>.window.predictions.jsonl")
+    parser.add_argument("--candidates", type=Path, default=None,
+                        help="default: data/candidates/relik/<split>.window.candidates.jsonl")
+    parser.add_argument("--processed", type=Path, default=None,
+                        help="processed split for entity_type/entity_class (default: data/processed/relik/<split>.jsonl)")
+    parser.add_argument("--kb", type=Path, default=ROOT / "data/index/mitre_documents.jsonl")
+    parser.add_argument("--out", type=Path, default=None, help="default: data/eval/<split>.metrics.json")
+    parser.add_argument("--min-f1", type=float, default=None, help="exit 1 if the micro EL F1 is below this value")
+    args = parser.parse_args()
+
+    predictions = args.predictions or PRED_DIR / f"{args.split}.window.predictions.jsonl"
+    candidates = args.candidates or CAND_DIR / f"{args.split}.window.candidates.jsonl"
+    processed = args.processed or PROC_DIR / f"{args.split}.jsonl"
+    for p in (predictions, candidates):
+        if not p.exists():
+            raise FileNotFoundError(f"Missing file: {p}")
+
+    result = evaluate(candidates, predictions, processed, args.kb)
+    print_report(result)
+
+    out = args.out or OUT_DIR / f"{args.split}.metrics.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nmetrics -> {out}")
+
+    f1 = result["el"]["entity_type"]["micro"]["f1"]
+    if args.min_f1 is not None and f1 < args.min_f1:
+        print(f"micro EL F1 {f1:.4f} < {args.min_f1}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
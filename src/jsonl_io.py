@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Gemeinsame JSONL-Helfer für die Pipeline-Skripte:
+  - schnelles Parsen (orjson, falls installiert, sonst stdlib json); geschrieben wird
+    immer mit stdlib json, damit die Ausgabe unabhängig von orjson byte-identisch bleibt
+  - Aufteilung einer JSONL-Datei in zeilenbündige Byte-Bereiche für Worker-Prozesse
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+FAST_JSON = orjson is not None
+
+# chunk size for byte-range splitting; small files end up in fewer chunks
+CHUNK_BYTES = 8 * 1024 * 1024
+WRITE_BUFFER = 4 * 1024 * 1024
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_line(obj: Any) -> bytes:
+    """One JSONL line in the json.dumps layout (utf-8, non-ASCII unescaped, trailing newline)."""
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def default_workers() -> int:
+    from resource_governor import core_count
+
+    return core_count()
+
+
+def _next_line_start(f, pos: int, size: int) -> int:
+    """First byte offset >= pos that starts a line."""
+    if pos <= 0:
+        return 0
+    if pos >= size:
+        return size
+    f.seek(pos - 1)
+    if f.read(1) == b"\n":
+        return pos
+    f.readline()
+    return min(f.tell(), size)
+
+
+def plan_byte_ranges(path: Path, n_chunks: Optional[int] = None, chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """Split `path` into line-aligned (start, end) byte ranges."""
+    size = path.stat().st_size
+    if size == 0:
+        return []
+    if n_chunks is None:
+        n_chunks = max(1, -(-size // chunk_bytes))
+    step = max(1, -(-size // n_chunks))
+
+    bounds = [0]
+    with path.open("rb") as f:
+        pos = step
+        while pos < size:
+            b = _next_line_start(f, pos, size)
+            if b > bounds[-1] and b < size:
+                bounds.append(b)
+            pos = max(b, bounds[-1]) + step
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def read_last_line_before(f, pos: int, block: int = 64 * 1024) -> bytes:
+    """Raw bytes of the line that ends right before byte offset `pos` (pos must be line-aligned)."""
+    end = pos - 1 if pos > 0 else 0  # skip the newline terminating that line
+    start = end
+    buf = b""
+    while start > 0:
+        start = max(0, start - block)
+        f.seek(start)
+        buf = f.read(end - start)
+        nl = buf.rfind(b"\n")
+        if nl != -1:
+            return buf[nl + 1:]
+    return buf
+
+
+def align_ranges(path: Path, ranges: List[Tuple[int, int]], key: Callable[[bytes], Any]) -> List[Tuple[int, int]]:
+    """
+    Shift range boundaries forward so that consecutive lines with the same
+    `key(line)` (e.g. the AnnoCTR `document`) never get split across two ranges.
+    """
+    if len(ranges) < 2:
+        return ranges
+
+    size = ranges[-1][1]
+    bounds = [0]
+    with path.open("rb") as f:
+        for _, b in ranges[:-1]:
+            b = max(b, bounds[-1])
+            if b >= size:
+                break
+            prev = read_last_line_before(f, b).strip()
+            prev_key = key(prev) if prev else None
+            f.seek(b)
+            while b < size:
+                line = f.readline()
+                stripped = line.strip()
+                if stripped and key(stripped) != prev_key:
+                    break
+                b += len(line)
+            if bounds[-1] < b < size:
+                bounds.append(b)
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def iter_range_lines(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """Raw lines (incl. empty ones, without newline) of the byte range [start, end)."""
+    with path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if not data:
+        return
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    yield from lines
+
+
+def count_range_lines(path: Path, start: int, end: int) -> int:
+    with path.open("rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    n = data.count(b"\n")
+    if data and not data.endswith(b"\n"):
+        n += 1
+    return n
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Bulk-Linking ganzer CTI-Reports (Offline-CLI).
+
+Eingabe: ein Verzeichnis mit Report-Dateien (*.txt) oder eine JSONL-Datei mit
+einem Report pro Zeile ({"document": ..., "text": ...}). Jeder Report wird
+gestreamt verarbeitet:
+
+  Text in Segmente (SEGMENT_CHARS, nur an einzelnen Leerzeichen zwischen
+  Nicht-Whitespace geschnitten, damit spaCy wie auf dem ganzen Text tokenisiert) -> spaCy-Tokens
+  -> überlappende Windows (WINDOW_SIZE/WINDOW_STRIDE, gleiche Regeln wie
+  create_windows.py) -> Candidates + Reader in Batches von READ_BATCH Windows
+  -> Stitching zu Dokument-Spans
+
+Im Speicher liegen pro Report nur der Token-/Text-Puffer der aktuellen Windows,
+ein Batch und die bereits fertigen Spans, unabhängig von der Report-Länge.
+
+Stitching: dieselbe Stelle wird von bis zu WINDOW_SIZE/WINDOW_STRIDE Windows
+gesehen. Von überlappenden Vorhersagen gewinnt die, die im Window am weitesten
+vom Rand entfernt liegt (mehr Kontext auf beiden Seiten); Spans, die vor dem
+Anfang des nächsten Windows enden, können sich nicht mehr ändern und werden
+festgeschrieben.
+
+Reports werden auf Worker-Prozesse verteilt (jeder lädt die Modelle einmal,
+Threads = Cores / Worker); jedes Ergebnis wird sofort als Zeile geschrieben,
+`--resume` überspringt bereits geschriebene Reports.
+
+  python src/link_reports.py reports/ data/predictions/reports.linked.jsonl --workers 2
+  python src/link_reports.py reports.jsonl out.jsonl --id-field document --text-field text --resume
+  python src/link_reports.py reports/ - --check-segments --segment-chars 300   # Segmentierung prüfen
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import time
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from create_windows import WINDOW_SIZE, WINDOW_STRIDE, window_record
+from resource_governor import core_count, limit_thread_env
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# report text is tokenized in segments of about this many chars (cut at a single space, see safe_cut)
+SEGMENT_CHARS = 100_000
+SAFE_SPACE = re.compile(r"(?<=\S) (?=\S)")
+# windows per retriever + reader call
+READ_BATCH = 64
+FILE_PATTERN = "*.txt"
+ID_FIELD = "document"
+TEXT_FIELD = "text"
+NIL_LABEL = "--NME--"
+
+Token = Tuple[str, int]
+Task = Tuple[str, str, Any]
+
+
+# --- input ---
+
+def iter_tasks(source: Path, pattern: str) -> Iterator[Task]:
+    """("file", path, report id) per file or ("jsonl", path, byte offset) per line; nothing is read yet."""
+    if source.is_dir():
+        for path in sorted(source.rglob(pattern)):
+            if path.is_file():
+                yield "file", str(path), str(path.relative_to(source))
+        return
+    with source.open("rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                yield "jsonl", str(source), offset
+            offset += len(line)
+
+
+def safe_cut(text: str, start: int, end: int) -> Optional[int]:
+    """
+    Last cut in (start, end] that lies right after a single space with non-whitespace on both
+    sides, None if there is none. spaCy tokenizes both halves exactly like the whole text there;
+    cutting inside a whitespace run ("\\n ", "\\n\\n") would change the whitespace tokens.
+    """
+    hi = end
+    while True:
+        p = text.rfind(" ", start + 1, hi)
+        if p < 0:
+            return None
+        if p + 1 < len(text) and not text[p - 1].isspace() and not text[p + 1].isspace():
+            return p + 1
+        hi = p
+
+
+def iter_file_segments(path: Path, segment_chars: int) -> Iterator[Tuple[int, str]]:
+    """(char offset, text) pieces of a file, cut only where `safe_cut` allows."""
+    offset, carry = 0, ""
+    with path.open(encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(segment_chars)
+            if not block:
+                break
+            text = carry + block
+            cut = safe_cut(text, 0, len(text))
+            if cut is None:
+                # no safe cut yet -> read on
+                carry = text
+                continue
+            yield offset, text[:cut]
+            offset += cut
+            carry = text[cut:]
+    if carry:
+        yield offset, carry
+
+
+def iter_text_segments(text: str, segment_chars: int) -> Iterator[Tuple[int, str]]:
+    pos = 0
+    while pos < len(text):
+        end = min(pos + segment_chars, len(text))
+        if end < len(text):
+            cut = safe_cut(text, pos, end)
+            if cut is None:
+                # first safe cut after the segment, else the rest of the text
+                m = SAFE_SPACE.search(text, end)
+                cut = m.end() if m else len(text)
+            end = cut
+        yield pos, text[pos:end]
+        pos = end
+
+
+def check_segments(nlp, text: str, segment_chars: int, window_size: int = WINDOW_SIZE,
+                   stride: int = WINDOW_STRIDE) -> Optional[int]:
+    """window_id of the first streamed window that differs from create_windows.build_windows, None if all match."""
+    from create_windows import build_windows
+
+    tokens = [(tok.text, tok.idx) for tok in nlp(text)]
+    doc_topic = tokens[0][0] if tokens else None
+    expected = list(build_windows({"doc_id": 0, "doc_text": text}, tokens, doc_topic, window_size, stride))
+    streamed = list(stream_windows(nlp, 0, iter_text_segments(text, segment_chars), window_size, stride))
+    for i, (a, b) in enumerate(zip(expected, streamed)):
+        if a != b:
+            return i
+    return None if len(expected) == len(streamed) else min(len(expected), len(streamed))
+
+
+def load_report(task: Task, opts: Dict[str, Any]) -> Tuple[Any, Iterator[Tuple[int, str]]]:
+    kind, path, ref = task
+    if kind == "file":
+        return ref, iter_file_segments(Path(path), opts["segment_chars"])
+    with open(path, "rb") as f:
+        f.seek(ref)
+        record = json.loads(f.readline())
+    text = record.get(opts["text_field"]) or ""
+    return record.get(opts["id_field"], f"{path}@{ref}"), iter_text_segments(text, opts["segment_chars"])
+
+
+# --- streaming windows ---
+
+def stream_windows(nlp, doc_id: Any, segments: Iterator[Tuple[int, str]], window_size: int = WINDOW_SIZE,
+                   stride: int = WINDOW_STRIDE) -> Iterator[Dict[str, Any]]:
+    """
+    Same windows as create_windows.build_windows over the whole text, but only the
+    tokens/text of the current window (plus one stride) are kept in memory.
+    """
+    tokens: List[Token] = []
+    base = 0            # doc-level index of tokens[0]
+    text, text_start = "", 0
+    exhausted = False
+    doc_topic: Optional[str] = None
+
+    def fill(n: int) -> None:
+        nonlocal text, exhausted, doc_topic
+        while len(tokens) < n and not exhausted:
+            segment = next(segments, None)
+            if segment is None:
+                exhausted = True
+                break
+            offset, piece = segment
+            text += piece
+            tokens.extend((tok.text, offset + tok.idx) for tok in nlp(piece))
+            if doc_topic is None and tokens:
+                doc_topic = tokens[0][0]
+
+    i = 0
+    window_id = 0
+    while True:
+        # one token beyond the window tells whether this is the last one
+        fill(i - base + window_size + 1)
+        known = base + len(tokens)
+        if i >= known:
+            break
+        if exhausted and i != 0 and i + window_size > known:
+            overflowing = i + window_size - known
+            if overflowing >= stride:
+                break
+            i -= overflowing
+        window = tokens[i - base:i - base + window_size]
+        yield window_record(doc_id, window_id, text, window, i, doc_topic, text_offset=text_start)
+        window_id += 1
+        if exhausted and i + window_size >= known:
+            break
+        i += stride
+        # keep one stride before i: the last window may be shifted back by < stride tokens
+        keep = max(base, i - stride)
+        del tokens[:keep - base]
+        base = keep
+        if tokens:
+            text = text[tokens[0][1] - text_start:]
+            text_start = tokens[0][1]
+
+
+# --- stitching ---
+
+class SpanStitcher:
+    """Merges window predictions into non-overlapping document spans; finished spans are released early."""
+
+    def __init__(self):
+        # (start, end) -> (label, margin)
+        self.pending: Dict[Tuple[int, int], Tuple[str, int]] = {}
+
+    def add(self, window: Dict[str, Any], spans: Sequence[Tuple[int, int, str]]) -> None:
+        w_start = window["offset"]
+        w_end = w_start + len(window["text"])
+        for start, end, label in spans:
+            if label == NIL_LABEL:
+                continue
+            # chars of context on the weaker side: predictions near a window edge are less reliable
+            margin = min(start - w_start, w_end - end)
+            rivals = [(s, e) for (s, e) in self.pending if s < end and start < e]
+            if all(self._beats((margin, end - start, -start), self.pending[r][1], r) for r in rivals):
+                for r in rivals:
+                    del self.pending[r]
+                self.pending[(start, end)] = (label, margin)
+
+    @staticmethod
+    def _beats(key: Tuple[int, int, int], margin: int, span: Tuple[int, int]) -> bool:
+        return key > (margin, span[1] - span[0], -span[0])
+
+    def release(self, before: Optional[int] = None) -> List[Tuple[int, int, str]]:
+        """Spans ending at or before char `before` (all if None), sorted; no later window can overlap them."""
+        done = sorted(span for span in self.pending if before is None or span[1] <= before)
+        out = [(s, e, self.pending.pop((s, e))[0]) for s, e in done]
+        return out
+
+
+# --- workers ---
+
+_linker = None
+_opts: Dict[str, Any] = {}
+
+
+def init_worker(opts: Dict[str, Any]) -> None:
+    global _linker, _opts
+    limit_thread_env(opts["threads"])
+    from linker import Linker
+
+    _opts = opts
+    _linker = Linker(question_encoder=opts["question_encoder"], document_index=opts["document_index"],
+                     reader_model=opts["reader_model"], top_k=opts["top_k"],
+                     dictionary=opts["dictionary"], dense_policy=opts["dense_policy"], bm25=opts["bm25"])
+
+
+def link_report(task: Task) -> Dict[str, Any]:
+    from linker import split_label
+
+    t0 = time.perf_counter()
+    doc_id, segments = load_report(task, _opts)
+    if doc_id in _opts["skip"]:
+        return {"document": doc_id, "skipped": True}
+    stitcher = SpanStitcher()
+    spans: List[Dict[str, Any]] = []
+    n_windows = 0
+    batch: List[Dict[str, Any]] = []
+
+    def flush(next_offset: Optional[int]) -> None:
+        for w, predicted in zip(batch, _linker.read(batch)):
+            stitcher.add(w, predicted)
+        for start, end, label in stitcher.release(next_offset):
+            kb_id, title = split_label(label)
+            spans.append({"start": start, "end": end, "kb_id": kb_id, "title": title})
+        batch.clear()
+
+    for window in stream_windows(_linker.nlp, doc_id, segments, _linker.window_size, _linker.window_stride):
+        if len(batch) >= _opts["read_batch"]:
+            flush(window["offset"])
+        batch.append(window)
+        n_windows += 1
+    flush(None)
+    return {"document": doc_id, "spans": spans, "windows": n_windows,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def done_ids(out: Path) -> set:
+    """Report ids already in `out`; a torn last line (killed run) is cut off."""
+    if not out.exists():
+        return set()
+    data = out.read_bytes()
+    end = data.rfind(b"\n") + 1
+    if end != len(data):
+        with out.open("r+b") as f:
+            f.truncate(end)
+    return {json.loads(line)["document"] for line in data[:end].splitlines() if line.strip()}
+
+
+def check_reports(source: Path, pattern: str, id_field: str, text_field: str, segment_chars: int) -> int:
+    """check_segments for every report of `source`; returns the number of mismatching reports."""
+    from create_windows import load_tokenizer
+
+    nlp = load_tokenizer()
+    n = failed = 0
+    for kind, path, ref in iter_tasks(source, pattern):
+        if kind == "file":
+            doc_id, text = ref, Path(path).read_text(encoding="utf-8", errors="replace")
+        else:
+            with open(path, "rb") as f:
+                f.seek(ref)
+                record = json.loads(f.readline())
+            doc_id, text = record.get(id_field, f"{path}@{ref}"), record.get(text_field) or ""
+        n += 1
+        bad = check_segments(nlp, text, segment_chars)
+        if bad is not None:
+            failed += 1
+            print(f"  {doc_id}: window {bad} differs from create_windows.build_windows")
+    print(f"{'✅' if not failed else '❌'} {n - failed}/{n} reports segment-invariant (segment_chars={segment_chars})")
+    return 1 if failed else 0
+
+
+def main() -> None:
+    from candidates import DOCUMENT_INDEX, QUESTION_ENCODER
+    from linker import READER_MODEL, TOP_K
+
+    parser = argparse.ArgumentParser(description="link whole CTI reports (directory or jsonl) -> linked spans jsonl")
+    parser.add_argument("source", type=Path, help="directory of report files or jsonl with one report per line")
+    parser.add_argument("out", type=Path)
+    parser.add_argument("--pattern", default=FILE_PATTERN, help="report files in a source directory")
+    parser.add_argument("--id-field", default=ID_FIELD)
+    parser.add_argument("--text-field", default=TEXT_FIELD)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, each with its own models")
+    parser.add_argument("--read-batch", type=int, default=READ_BATCH, help="windows per retriever/reader call")
+    parser.add_argument("--segment-chars", type=int, default=SEGMENT_CHARS)
+    parser.add_argument("--question-encoder", default=QUESTION_ENCODER)
+    parser.add_argument("--document-index", default=DOCUMENT_INDEX)
+    parser.add_argument("--reader-model", default=READER_MODEL)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--dictionary", type=Path, default=None, help="KB jsonl for the exact-match fast path")
+    parser.add_argument("--dense-policy", choices=["always", "unresolved"], default="unresolved")
+    parser.add_argument("--bm25", type=Path, default=None, help="BM25 index dir: hybrid dense + lexical retrieval")
+    parser.add_argument("--resume", action="store_true", help="append to `out`, skipping reports already in it")
+    parser.add_argument("--check-segments", action="store_true",
+                        help="no linking: check that the segmented windows equal create_windows.build_windows")
+    args = parser.parse_args()
+
+    if args.check_segments:
+        sys.exit(check_reports(args.source, args.pattern, args.id_field, args.text_field, args.segment_chars))
+
+    from dictionary_linker import warn_without_bm25
+
+    warn_without_bm25(args.dictionary, args.dense_policy, args.bm25)
+    workers = max(1, args.workers)
+    opts = {
+        "id_field": args.id_field, "text_field": args.text_field, "read_batch": args.read_batch,
+        "segment_chars": args.segment_chars, "question_encoder": args.question_encoder,
+        "document_index": args.document_index, "reader_model": args.reader_model, "top_k": args.top_k,
+        "dictionary": args.dictionary, "dense_policy": args.dense_policy, "bm25": args.bm25,
+        "threads": max(1, core_count() // workers),
+        "skip": done_ids(args.out) if args.resume else set(),
+    }
+    skip = opts["skip"]
+    if skip:
+        print(f"resuming: {len(skip)} reports already linked")
+    # file ids are known up front; jsonl ids only once the worker has read the line
+    tasks = (t for t in iter_tasks(args.source, args.pattern) if t[0] != "file" or t[2] not in skip)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    n = n_spans = 0
+    t0 = time.perf_counter()
+    with args.out.open("a" if args.resume else "w", encoding="utf-8") as fout:
+        if workers == 1:
+            init_worker(opts)
+            results = map(link_report, tasks)
+            pool = None
+        else:
+            pool = get_context("spawn").Pool(workers, initializer=init_worker, initargs=(opts,))
+            results = pool.imap_unordered(link_report, tasks)
+        try:
+            for result in results:
+                if result.get("skipped"):
+                    continue
+                fout.write(json.dumps(result, ensure_ascii=False) + "\n")
+                fout.flush()
+                n += 1
+                n_spans += len(result["spans"])
+                print(f"  {result['document']}: {len(result['spans'])} spans, {result['windows']} windows, "
+                      f"{result['seconds']}s")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    print(f"✅ {n} reports, {n_spans} spans in {time.perf_counter() - t0:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Inferenz-Kern für freien Text: Tokenizer, Retriever (Encoder + Index) und Reader
+werden einmal geladen; Texte -> Windows (wie create_windows.py) -> Candidates
+(candidates.CandidateGenerator) -> Reader -> verlinkte Spans mit ATT&CK-ID.
+
+Benutzt von serve.py (HTTP-Service mit Micro-Batching) und link_reports.py (Bulk).
+Optional mit Wörterbuch-Fast-Path (dictionary_linker.py): exakte Treffer werden
+gepinnt, der Encoder läuft nur für Windows ohne Treffer. Mit BM25-Index
+(bm25_index.py) hybrides Retrieval: Dense + BM25 per RRF. Pro Text können
+Entity-Typen übergeben werden; dann wird nur in deren Index-Partitionen gesucht.
+
+Ein Candidate-/Label-Text ist "<ATT&CK-ID> <Titel>", z.B. "T1505 Server Software Component";
+`split_label` trennt beides.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from candidates import DOCUMENT_INDEX, QUESTION_ENCODER, CandidateGenerator
+from create_windows import WINDOW_SIZE, WINDOW_STRIDE, build_windows, load_tokenizer
+from eval import KB_ID_PREFIX, PREDICTION_FIELDS, span_items
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# trained reader: relik `save_pretrained` directory or hub name
+READER_MODEL = "sapienzanlp/relik-reader-deberta-v3-base-aida"
+TOP_K = 10
+READER_BATCH_SIZE = 32
+NIL_LABEL = "--NME--"
+
+
+def split_label(label: str) -> Tuple[Optional[str], str]:
+    """("T1505", "Server Software Component") for "T1505 Server Software Component"; (None, label) without ID."""
+    m = KB_ID_PREFIX.match(label)
+    if m is None:
+        return None, label.strip()
+    return m.group(0).strip(), label[m.end():].strip()
+
+
+class Linker:
+    """Keeps tokenizer, retriever and reader in memory; links batches of windows."""
+
+    def __init__(
+        self,
+        question_encoder: str = QUESTION_ENCODER,
+        document_index: str = DOCUMENT_INDEX,
+        reader_model: str = READER_MODEL,
+        top_k: int = TOP_K,
+        window_size: int = WINDOW_SIZE,
+        window_stride: int = WINDOW_STRIDE,
+        reader_batch_size: int = READER_BATCH_SIZE,
+        device: str = "cpu",
+        dictionary: Optional[Path] = None,
+        dense_policy: str = "unresolved",
+        bm25: Optional[Path] = None,
+    ):
+        from relik.reader.pytorch_modules.span import RelikReaderForSpanExtraction
+
+        from bm25_index import BM25Index
+        from dictionary_linker import DictionaryLinker
+
+        self.nlp = load_tokenizer()
+        self.generator = CandidateGenerator(
+            question_encoder=question_encoder, document_index=document_index, device=device,
+            dictionary=DictionaryLinker.from_kb(dictionary) if dictionary else None, dense_policy=dense_policy,
+            lexical=BM25Index.load(bm25) if bm25 else None)
+        print(f"loading reader: {reader_model}")
+        self.reader = RelikReaderForSpanExtraction(reader_model, device=device)
+        self.top_k = top_k
+        self.window_size = window_size
+        self.window_stride = window_stride
+        self.reader_batch_size = reader_batch_size
+
+    def windows(self, texts: Sequence[str], doc_ids: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        """Windows of all texts (doc-level char offsets); `doc_id` defaults to the position in `texts`."""
+        doc_ids = list(doc_ids) if doc_ids is not None else list(range(len(texts)))
+        out: List[Dict[str, Any]] = []
+        for doc_id, spacy_doc in zip(doc_ids, self.nlp.pipe(texts)):
+            tokens = [(tok.text, tok.idx) for tok in spacy_doc]
+            if not tokens:
+                continue
+            doc = {"doc_id": doc_id, "doc_text": spacy_doc.text, "doc_span_annotations": []}
+            out.extend(build_windows(doc, tokens, tokens[0][0], self.window_size, self.window_stride))
+        return out
+
+    def read(self, windows: List[Dict[str, Any]]) -> List[List[Tuple[int, int, str]]]:
+        """Candidates + reader for a batch of windows; predicted (start, end, label) per window (doc chars)."""
+        from relik.reader.data.relik_reader_sample import RelikReaderSample
+
+        if not windows:
+            return []
+        self.generator.annotate(windows, top_k=self.top_k)
+        samples = self.reader.read(samples=[RelikReaderSample(**w) for w in windows],
+                                   max_batch_size=self.reader_batch_size, progress_bar=False)
+        # relik may return the samples in batch order -> map back by (doc_id, window_id)
+        by_key = {(s.doc_id, s.window_id): s for s in samples}
+        out = []
+        for w in windows:
+            sample = by_key[(w["doc_id"], w["window_id"])]
+            predicted = next((v for v in (getattr(sample, f, None) for f in PREDICTION_FIELDS) if v is not None), ())
+            out.append([(s, e, str(label)) for s, e, label in span_items(sorted(predicted))])
+        return out
+
+    def link(self, texts: Sequence[str],
+             types: Optional[Sequence[Optional[Sequence[str]]]] = None) -> List[List[Dict[str, Any]]]:
+        """Linked spans per text, deduplicated over overlapping windows, NIL dropped; `types[i]` narrows text i."""
+        windows = self.windows(texts)
+        if types is not None:
+            for w in windows:
+                if types[w["doc_id"]]:
+                    w["candidate_types"] = list(types[w["doc_id"]])
+        found: List[Dict[Tuple[int, int], str]] = [{} for _ in texts]
+        for w, spans in zip(windows, self.read(windows)):
+            for start, end, label in spans:
+                if label != NIL_LABEL:
+                    found[w["doc_id"]].setdefault((start, end), label)
+        return [[linked_span(text, start, end, label) for (start, end), label in sorted(spans.items())]
+                for text, spans in zip(texts, found)]
+
+    def warm_up(self, text: str = "The actor used PowerShell to download Cobalt Strike.") -> None:
+        """One full pass (lazy weight init, first allocations) before serving."""
+        self.link([text])
+
+
+def linked_span(text: str, start: int, end: int, label: str) -> Dict[str, Any]:
+    kb_id, title = split_label(label)
+    return {"start": start, "end": end, "mention": text[start:end], "kb_id": kb_id, "title": title}
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped Document-Index (Alternative zu relik InMemoryDocumentIndex / `embeddings.pt`).
+
+  <index_dir>/mmap/
+    mmap_index.json      dtype, dim, rows, Quelle
+    vectors.f16.npy      float16 [rows, dim]          (dtype=fp16, oder Rerank-Kopie bei rerank=f16)
+    vectors.i8.npy       int8    [rows, dim]          (dtype=int8)
+    scales.f32.npy       float32 [rows]  Zeilen-Skala (dtype=int8)
+    vectors.f32.npy      float32 [rows, dim]  nur bei rerank=f32
+    documents.jsonl      relik-Dokumente in Index-Reihenfolge
+    doc_offsets.npy      int64 [rows+1] Byte-Offsets in documents.jsonl
+    part.<TYPE>.npy      int64 Zeilen pro metadata.entity_type (TECHNIQUE, TACTIC, GROUP, MALWARE, TOOL, …)
+
+Suche: Scores mit der komprimierten Matrix blockweise berechnen, Shortlist
+(k * RERANK_FACTOR) bilden und mit den Rerank-Vektoren neu ranken. Alles wird per
+mmap gelesen, d.h. Start ohne torch.load und nur die benutzten Seiten liegen im RAM.
+
+Rerank-Vektoren (`--rerank`), Plattenbedarf pro Dimension und Zeile (embeddings.pt: 4 Byte):
+  f32   exakte float32-Kopie (Default)                 int8: 1 + 4 Byte, fp16: 2 + 4 Byte
+        Top-k identisch zur float32-Suche, dafür größer als embeddings.pt
+  f16   float16-Kopie (bei dtype=fp16 dieselbe Datei)  int8: 1 + 2 Byte, fp16: 2 Byte
+        verlustbehaftet, nur auf Wunsch: auf mitre_index (int8, 500 verrauschte
+        Queries) haben ~95% der Queries dieselben Top-10 wie float32
+  none  dequantisierte int8-Zeilen (q * scale)         int8: 1 Byte
+        kleinster Index, Reihenfolge nur so genau wie die int8-Quantisierung
+Indizes ohne `rerank` in mmap_index.json stammen von vorher und ranken mit f32.
+
+Partitionen: `search(..., types=["GROUP"])` bewertet nur die Zeilen der
+angegebenen Entity-Typen (Kosten proportional zur Partition, kleineres k reicht).
+
+Bauen:
+  python src/mmap_index.py data/index/mitre_index --dtype int8
+  python src/mmap_index.py data/index/mitre_index --partitions-only   # Partitionen zu bestehendem mmap/
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MMAP_DIR = "mmap"
+META_FILE = "mmap_index.json"
+DTYPES = ("fp16", "int8")
+# f32 = exact rerank (default); f16 / none trade top-k fidelity for index size
+RERANK = "f32"
+RERANKS = ("f32", "f16", "none")
+VECTOR_FILES = ("vectors.f16.npy", "vectors.i8.npy", "scales.f32.npy", "vectors.f32.npy")
+
+# shortlist size = max(k * RERANK_FACTOR, k + RERANK_MIN_EXTRA)
+RERANK_FACTOR = 4
+RERANK_MIN_EXTRA = 64
+# rows scored per block (bounds the temporary float32 copy)
+BLOCK_ROWS = 65_536
+
+UNKNOWN_TYPE = "UNKNOWN"
+
+
+def mmap_dir_for(index_path: Path) -> Path:
+    return Path(index_path) / MMAP_DIR
+
+
+def has_mmap_index(index_path: str | Path) -> bool:
+    return (mmap_dir_for(Path(index_path)) / META_FILE).exists()
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: row ~= q * scale."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def load_relik_index(index_name_or_path: str) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    """Embeddings + documents of a relik document index (local dir or hub name)."""
+    from relik.retriever.indexers.base import BaseDocumentIndex
+
+    index = BaseDocumentIndex.from_pretrained(index_name_or_path, device="cpu")
+    embeddings = index.embeddings.float().cpu().numpy()
+    documents = [doc.to_dict() if hasattr(doc, "to_dict") else dict(doc) for doc in index.documents]
+    return embeddings, documents
+
+
+def build(index_name_or_path: str, out_dir: Path, dtype: str = "int8", rerank: str = RERANK) -> Path:
+    embeddings, documents = load_relik_index(index_name_or_path)
+    return write(embeddings, documents, out_dir, dtype=dtype, source=index_name_or_path, rerank=rerank)
+
+
+def write(embeddings: np.ndarray, documents: List[Dict[str, Any]], out_dir: Path, dtype: str = "int8",
+          source: str = "", rerank: str = RERANK) -> Path:
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}, got {dtype!r}")
+    if rerank not in RERANKS or (rerank == "none" and dtype != "int8"):
+        raise ValueError(f"rerank must be one of {RERANKS} ('none' only with int8), got {rerank!r}")
+    if len(embeddings) != len(documents):
+        raise ValueError(f"{len(embeddings)} embeddings vs {len(documents)} documents")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    written = []
+    if dtype == "fp16" or rerank == "f16":
+        np.save(out_dir / "vectors.f16.npy", embeddings.astype(np.float16))
+        written.append("vectors.f16.npy")
+    if dtype == "int8":
+        q, scales = quantize_int8(embeddings)
+        np.save(out_dir / "vectors.i8.npy", q)
+        np.save(out_dir / "scales.f32.npy", scales)
+        written += ["vectors.i8.npy", "scales.f32.npy"]
+    if rerank == "f32":
+        np.save(out_dir / "vectors.f32.npy", embeddings)
+        written.append("vectors.f32.npy")
+    # a rebuild with other settings must not leave the old (large) vector files behind
+    for name in VECTOR_FILES:
+        if name not in written:
+            (out_dir / name).unlink(missing_ok=True)
+
+    offsets = [0]
+    with (out_dir / "documents.jsonl").open("wb") as f:
+        for doc in documents:
+            data = (json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(out_dir / "doc_offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+    meta = {"dtype": dtype, "rerank": rerank, "rows": int(embeddings.shape[0]), "dim": int(embeddings.shape[1]), "source": source,
+            "partitions": write_partitions(documents, out_dir)}
+    (out_dir / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return out_dir
+
+
+def entity_type_of(doc: Dict[str, Any]) -> str:
+    return (doc.get("metadata") or {}).get("entity_type") or UNKNOWN_TYPE
+
+
+def partition_rows(documents: Sequence[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """entity_type -> ascending row ids."""
+    rows: Dict[str, List[int]] = {}
+    for row, doc in enumerate(documents):
+        rows.setdefault(entity_type_of(doc), []).append(row)
+    return {t: np.asarray(r, dtype=np.int64) for t, r in sorted(rows.items())}
+
+
+def write_partitions(documents: Sequence[Dict[str, Any]], out_dir: Path) -> Dict[str, int]:
+    for old in out_dir.glob("part.*.npy"):
+        old.unlink()
+    sizes = {}
+    for etype, rows in partition_rows(documents).items():
+        np.save(out_dir / f"part.{etype}.npy", rows)
+        sizes[etype] = int(len(rows))
+    return sizes
+
+
+def add_partitions(index_path: Path) -> Dict[str, int]:
+    """Partitions for an mmap index built before they existed (reads documents.jsonl only)."""
+    path = Path(index_path)
+    if not (path / META_FILE).exists():
+        path = mmap_dir_for(path)
+    with (path / "documents.jsonl").open(encoding="utf-8") as f:
+        documents = [json.loads(line) for line in f if line.strip()]
+    meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+    meta["partitions"] = write_partitions(documents, path)
+    (path / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta["partitions"]
+
+
+class MmapDocumentIndex:
+    """Read-only document index over memory-mapped quantized embeddings with a float rerank of the shortlist."""
+
+    def __init__(self, index_path: str | Path):
+        path = Path(index_path)
+        if not (path / META_FILE).exists():
+            path = mmap_dir_for(path)
+        self.path = path
+        self.meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+        self.dtype = self.meta["dtype"]
+        self.rerank = self.meta.get("rerank", "f32")
+
+        # None: rerank from the dequantized int8 rows
+        self.exact = None
+        if self.rerank != "none":
+            self.exact = np.load(path / f"vectors.{self.rerank}.npy", mmap_mode="r")
+        if self.dtype == "fp16":
+            self.vectors = np.load(path / "vectors.f16.npy", mmap_mode="r")
+            self.scales = None
+        else:
+            self.vectors = np.load(path / "vectors.i8.npy", mmap_mode="r")
+            self.scales = np.load(path / "scales.f32.npy", mmap_mode="r")
+        self.doc_offsets = np.load(path / "doc_offsets.npy", mmap_mode="r")
+        self._documents = (path / "documents.jsonl").open("rb")
+        self.partitions: Dict[str, np.ndarray] = {
+            etype: np.load(path / f"part.{etype}.npy") for etype in self.meta.get("partitions", {})
+        }
+
+    def __len__(self) -> int:
+        return int(self.meta["rows"])
+
+    def document(self, row: int) -> Dict[str, Any]:
+        a, b = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+        self._documents.seek(a)
+        return json.loads(self._documents.read(b - a))
+
+    def rows_for(self, types: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        """Ascending row ids of the given entity types (None = all rows)."""
+        if types is None:
+            return None
+        if not self.partitions:
+            raise ValueError(f"{self.path} has no entity-type partitions; run mmap_index.py --partitions-only")
+        parts = [self.partitions[t] for t in types if t in self.partitions]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def shortlist(self, query: np.ndarray, n: int, subset: Optional[np.ndarray] = None) -> np.ndarray:
+        """[q, n] rows with the highest approximate scores (unordered), merged block by block."""
+        best_rows = np.zeros((query.shape[0], 0), dtype=np.int64)
+        best_scores = np.zeros((query.shape[0], 0), dtype=np.float32)
+        total = len(self) if subset is None else len(subset)
+        for a in range(0, total, BLOCK_ROWS):
+            if subset is None:
+                ids = np.arange(a, min(a + BLOCK_ROWS, total))
+                block = np.asarray(self.vectors[a:a + BLOCK_ROWS], dtype=np.float32)
+            else:
+                ids = subset[a:a + BLOCK_ROWS]
+                block = np.asarray(self.vectors[ids], dtype=np.float32)
+            scores = query @ block.T
+            if self.scales is not None:
+                scores *= self.scales[ids]
+            rows = np.broadcast_to(ids, scores.shape)
+
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > n:
+                top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+        return best_rows
+
+    def search_rows(self, query: np.ndarray, k: int,
+                    types: Optional[Sequence[str]] = None) -> List[List[Tuple[int, float]]]:
+        """(row, exact score) of the top-k documents per query, best first; `types` restricts to partitions."""
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        subset = self.rows_for(types)
+        size = len(self) if subset is None else len(subset)
+        k = min(k, size)
+        if k <= 0:
+            return [[] for _ in range(len(query))]
+        cand = self.shortlist(query, min(size, max(k * RERANK_FACTOR, k + RERANK_MIN_EXTRA)), subset)
+
+        results = []
+        for q, rows in zip(query, cand):
+            rows = np.sort(rows)
+            if self.exact is not None:
+                exact = np.asarray(self.exact[rows], dtype=np.float32) @ q
+            else:
+                exact = (np.asarray(self.vectors[rows], dtype=np.float32) @ q) * self.scales[rows]
+            # stable: equal scores keep index order, like torch.topk on the full matrix
+            order = np.argsort(-exact, kind="stable")[:k]
+            results.append([(int(rows[j]), float(exact[j])) for j in order])
+        return results
+
+    def search(self, query: np.ndarray, k: int,
+               types: Optional[Sequence[str]] = None) -> List[Tuple[List[str], List[float]]]:
+        """(document texts, scores) per query, same shape as CandidateGenerator.search."""
+        out = []
+        for hits in self.search_rows(query, k, types):
+            out.append(([self.document(r)["text"] for r, _ in hits], [s for _, s in hits]))
+        return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="relik document index -> memory-mapped index")
+    parser.add_argument("index", help="relik index dir or hub name")
+    parser.add_argument("--out", type=Path, default=None, help="default: <index>/mmap")
+    parser.add_argument("--dtype", choices=DTYPES, default="int8")
+    parser.add_argument("--rerank", choices=RERANKS, default=RERANK,
+                        help="vectors for the shortlist rerank; f16/none are smaller but lossy (see module docstring)")
+    parser.add_argument("--partitions-only", action="store_true",
+                        help="only (re)write the entity-type partitions of an existing mmap index")
+    args = parser.parse_args()
+
+    if args.partitions_only:
+        sizes = add_partitions(args.out or Path(args.index))
+        print(f"✅ partitions: {sizes}")
+        return
+
+    out = args.out or mmap_dir_for(Path(args.index))
+    build(args.index, out, dtype=args.dtype, rerank=args.rerank)
+    print(f"✅ mmap index ({args.dtype}, rerank {args.rerank}) -> {out}")
+
+
+if __name__ == "__main__":
+    main()
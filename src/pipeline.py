@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Kleiner DAG-Executor mit inhaltsbasiertem Stage-Cache für run_all.py.
+
+Jede Stage hat Eingabedateien, Ausgabedateien, Parameter und Code-Dateien.
+Fingerprint = sha1(Parameter + Inhalt der Eingaben + Inhalt der Code-Dateien).
+Ist der Fingerprint gleich dem des letzten erfolgreichen Laufs und existieren
+alle Ausgaben, wird die Stage übersprungen. Da Ausgaben einer Stage Eingaben
+der nächsten sind, laufen nach einer Änderung nur die betroffenen Stages
+(und nur für die betroffenen Splits) neu.
+
+Mit `jobs > 1` laufen unabhängige Stages (z.B. die Splits) gleichzeitig als
+Subprozesse: jeder Job bekommt einen eigenen Core-Slice (Thread-Env-Variablen +
+CPU-Affinität), schreibt nach logs/<stage>.stdout/.stderr, und ein Fehler in
+einem Split blockiert nur die davon abhängigen Stages.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from resource_governor import available_cores, core_count, thread_env
+
+ROOT = Path(__file__).resolve().parents[1]
+STATE_FILE = ROOT / "data/cache/stages.json"
+LOG_DIR = ROOT / "logs"
+POLL_SECONDS = 0.2
+# stderr tail printed when a job fails
+STDERR_TAIL = 2000
+
+HASH_BLOCK = 4 * 1024 * 1024
+
+
+def core_slices(jobs: int, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """Split the usable cores into `jobs` disjoint, contiguous slices (at least one core each)."""
+    cores = cores or available_cores()
+    jobs = max(1, min(jobs, len(cores)))
+    size, extra = divmod(len(cores), jobs)
+    slices, a = [], 0
+    for i in range(jobs):
+        b = a + size + (1 if i < extra else 0)
+        slices.append(cores[a:b])
+        a = b
+    return slices
+
+
+class Stage:
+    """
+    `run`: in-process callable (sequential mode); `cmd`: the same work as a
+    subprocess command (used for parallel jobs, or if `run` is None).
+    `deps`: names of stages that must have finished first.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Optional[Callable[[], Any]] = None,
+        inputs: Sequence[Path] = (),
+        outputs: Sequence[Path] = (),
+        params: Optional[Dict[str, Any]] = None,
+        code: Sequence[Path] = (),
+        cmd: Optional[Callable[[int], List[str]]] = None,
+        deps: Sequence[str] = (),
+    ):
+        self.name = name
+        self.run = run
+        self.cmd = cmd
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.params = params or {}
+        self.code = [Path(p) for p in code]
+        self.deps = list(deps)
+
+
+class StageCache:
+    """Last successful fingerprint per stage + file hash cache keyed by (size, mtime)."""
+
+    def __init__(self, state_file: Path = STATE_FILE):
+        self.state_file = state_file
+        self.state = {"stages": {}, "files": {}}
+        if state_file.exists():
+            try:
+                self.state = json.loads(state_file.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                pass
+
+    def save(self) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, indent=2), encoding="utf-8")
+        os.replace(tmp, self.state_file)
+
+    def file_hash(self, path: Path) -> Optional[str]:
+        if not path.exists():
+            return None
+        st = path.stat()
+        key = str(path.resolve())
+        cached = self.state["files"].get(key)
+        if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+            return cached["sha1"]
+        h = hashlib.sha1()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self.state["files"][key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest}
+        return digest
+
+    def fingerprint(self, stage: Stage) -> str:
+        payload = {
+            "params": stage.params,
+            "inputs": {str(p): self.file_hash(p) for p in stage.inputs},
+            "code": {p.name: self.file_hash(p) for p in stage.code},
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_fresh(self, stage: Stage, fp: str) -> bool:
+        return self.state["stages"].get(stage.name, {}).get("fingerprint") == fp and all(
+            p.exists() for p in stage.outputs
+        )
+
+    def record(self, stage: Stage, fp: str, seconds: float) -> None:
+        self.state["stages"][stage.name] = {
+            "fingerprint": fp,
+            "seconds": round(seconds, 2),
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        # output hashes are needed by the next stage anyway -> compute them while the files are hot
+        for p in stage.outputs:
+            self.file_hash(p)
+        self.save()
+
+
+class Job:
+    """A stage running as subprocess on its own core slice."""
+
+    def __init__(self, stage: Stage, fp: str, slot: int, cores: List[int], log_dir: Path):
+        self.stage = stage
+        self.fp = fp
+        self.slot = slot
+        self.t0 = time.perf_counter()
+
+        log_dir.mkdir(parents=True, exist_ok=True)
+        stem = stage.name.replace(":", "_")
+        self.stdout_path = log_dir / f"{stem}.stdout"
+        self.stderr_path = log_dir / f"{stem}.stderr"
+        self._stdout = self.stdout_path.open("wb")
+        self._stderr = self.stderr_path.open("wb")
+
+        env = dict(os.environ)
+        env.update(thread_env(len(cores)))
+
+        preexec = None
+        if hasattr(os, "sched_setaffinity"):
+            def preexec():
+                os.sched_setaffinity(0, cores)
+
+        cmd = stage.cmd(len(cores))
+        print(f"[start] {stage.name} on cores {cores[0]}-{cores[-1]}: {' '.join(map(str, cmd))}")
+        self.proc = subprocess.Popen(cmd, stdout=self._stdout, stderr=self._stderr, env=env,
+                                     preexec_fn=preexec, cwd=str(ROOT))
+
+    def poll(self) -> Optional[int]:
+        code = self.proc.poll()
+        if code is not None:
+            self._stdout.close()
+            self._stderr.close()
+        return code
+
+    def stderr_tail(self) -> str:
+        try:
+            return self.stderr_path.read_text(encoding="utf-8", errors="ignore")[-STDERR_TAIL:]
+        except OSError:
+            return ""
+
+
+def _run_inline(stage: Stage) -> None:
+    if stage.run is not None:
+        stage.run()
+    else:
+        subprocess.run(stage.cmd(core_count()), check=True, cwd=str(ROOT))
+
+
+def run_stages(
+    stages: List[Stage],
+    force: bool = False,
+    cache: Optional[StageCache] = None,
+    jobs: int = 1,
+    log_dir: Path = LOG_DIR,
+) -> Dict[str, str]:
+    """
+    Runs the stages respecting `deps`; returns {stage: 'ran' | 'skipped' | 'failed' | 'blocked'}.
+    jobs == 1: one after another, in-process where possible.
+    jobs > 1:  ready stages with a `cmd` run concurrently, one core slice each.
+    """
+    cache = cache or StageCache()
+    names = {stage.name for stage in stages}
+    slices = core_slices(jobs)
+    free_slots = list(range(len(slices)))
+    status: Dict[str, str] = {}
+    pending = list(stages)
+    running: List[Job] = []
+
+    def finish(stage: Stage, fp: str, seconds: float, ok: bool, err: str = "") -> None:
+        if ok:
+            cache.record(stage, fp, seconds)
+            status[stage.name] = "ran"
+            print(f"[done]  {stage.name} ({seconds:.1f}s)")
+        else:
+            status[stage.name] = "failed"
+            print(f"[FAIL]  {stage.name}: {err}")
+
+    while pending or running:
+        progressed = False
+
+        for job in list(running):
+            code = job.poll()
+            if code is None:
+                continue
+            running.remove(job)
+            free_slots.append(job.slot)
+            finish(job.stage, job.fp, time.perf_counter() - job.t0, code == 0,
+                   f"exit code {code}, see {job.stdout_path} / {job.stderr_path}")
+            if code != 0:
+                print("---- tail of stderr ----")
+                print(job.stderr_tail())
+            progressed = True
+
+        for stage in list(pending):
+            deps = [status.get(d) for d in stage.deps if d in names]
+            if any(st in ("failed", "blocked") for st in deps):
+                pending.remove(stage)
+                status[stage.name] = "blocked"
+                print(f"[block] {stage.name} (upstream failed)")
+                progressed = True
+                continue
+            if not all(st in ("ran", "skipped") for st in deps):
+                continue
+
+            fp = cache.fingerprint(stage)
+            if not force and cache.is_fresh(stage, fp):
+                pending.remove(stage)
+                status[stage.name] = "skipped"
+                print(f"[skip]  {stage.name} (unchanged)")
+                progressed = True
+                continue
+
+            if jobs > 1 and stage.cmd is not None:
+                if not free_slots:
+                    continue
+                pending.remove(stage)
+                slot = free_slots.pop(0)
+                running.append(Job(stage, fp, slot, slices[slot], log_dir))
+                progressed = True
+                continue
+
+            if running:
+                # in-process stages wait until no subprocess competes for the cores
+                continue
+            pending.remove(stage)
+            print(f"\n[run]   {stage.name}")
+            t0 = time.perf_counter()
+            try:
+                _run_inline(stage)
+                finish(stage, fp, time.perf_counter() - t0, True)
+            except Exception as e:  # noqa: BLE001 - one failing stage must not stop independent ones
+                finish(stage, fp, time.perf_counter() - t0, False, repr(e))
+            progressed = True
+
+        if not progressed:
+            time.sleep(POLL_SECONDS)
+
+    return status
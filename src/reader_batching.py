@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Batching für das Reader-Training auf den vor-tokenisierten Shards (reader_cache.py).
+
+  - TokenBudgetBatchSampler: Indizes werden gemischt, in Buckets (BUCKET_SIZE)
+    nach Länge sortiert und zu Batches unter einem Token-Budget geschnitten
+    (#Windows * längste Sequenz <= max_tokens, wie candidates.dynamic_batches);
+    die Batch-Reihenfolge wird danach wieder gemischt
+  - Packing (`pack_length`): mehrere kurze Windows werden zu einer Sequenz
+    verkettet; Attention-Maske block-diagonal [B, L, L], Positionen und
+    `segment_ids` pro Window, Labels auf die Segment-Offsets verschoben.
+    Budget ist dann die Summe der echten Tokens. Das Modell muss 3D-Masken
+    annehmen (DeBERTa-v2 tut das) und Symbole nur innerhalb des eigenen Segments
+    bewerten (`segment_ids`). Der relik-Reader kann das nicht (er würde Spans
+    gegen Candidates fremder Windows bewerten), Packing ist daher nur für `bench`
+    gedacht; train_reader.py lehnt `--pack-length` ab.
+  - ThroughputMeter / throughput_callback: Tokens/s (inkl. Padding) und
+    nützliche Tokens/s pro Trainingsschritt
+
+Vergleich mit fester Batchgröße (Padding-Anteil, Collate-Zeit; mit --model auch Forward-Tokens/s):
+
+  python src/reader_batching.py bench --split val --batch-size 16 --max-tokens 8192
+  python src/reader_batching.py bench --split val --pack-length 512 --model microsoft/deberta-v3-base
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from candidates import dynamic_batches
+from reader_cache import CACHE_DIR, IGNORE_INDEX, MANIFEST, PretokenizedReaderDataset, collate_arrays
+
+MAX_TOKENS = 8192
+MAX_BATCH_SIZE = 64
+# indices sorted by length per bucket: larger = less padding, less randomness
+BUCKET_SIZE = 1024
+PACK_LENGTH = 512
+SEED = 42
+
+
+class TokenBudgetBatchSampler:
+    """Batch sampler (list of dataset indices per batch) under a token budget; see module docstring."""
+
+    def __init__(self, lengths: Sequence[int], max_tokens: int = MAX_TOKENS, max_batch_size: int = MAX_BATCH_SIZE,
+                 shuffle: bool = True, bucket_size: int = BUCKET_SIZE, pack_length: Optional[int] = None,
+                 seed: int = SEED):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if pack_length is not None and len(self.lengths) and self.lengths.max() > pack_length:
+            raise ValueError(f"sequence of {self.lengths.max()} tokens does not fit pack_length={pack_length}")
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.pack_length = pack_length
+        self.seed = seed
+        self.epoch = 0
+        # (epoch, batches): __len__ and __iter__ of one epoch share one computation
+        self._cached: Optional[Tuple[int, List[List[int]]]] = None
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def batches(self) -> List[List[int]]:
+        if self._cached is None or self._cached[0] != self.epoch:
+            self._cached = (self.epoch, self._build_batches())
+        return self._cached[1]
+
+    def _build_batches(self) -> List[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        out: List[List[int]] = []
+        for a in range(0, len(order), self.bucket_size):
+            bucket = order[a:a + self.bucket_size]
+            lengths = self.lengths[bucket].tolist()
+            if self.pack_length is None:
+                groups = dynamic_batches(lengths, lambda _: self.max_tokens, self.max_batch_size)
+            else:
+                groups = self._pack_groups(lengths)
+            out.extend([int(bucket[j]) for j in group] for group in groups)
+        if self.shuffle:
+            out = [out[i] for i in rng.permutation(len(out))]
+        return out
+
+    def _pack_groups(self, lengths: List[int]) -> Iterator[List[int]]:
+        """Sorted runs whose real tokens fill at most max_tokens (rounded to whole packed rows)."""
+        budget = max(self.pack_length, self.max_tokens // self.pack_length * self.pack_length)
+        group: List[int] = []
+        used = 0
+        for j in sorted(range(len(lengths)), key=lambda j: lengths[j]):
+            if group and (used + lengths[j] > budget or len(group) >= self.max_batch_size):
+                yield group
+                group, used = [], 0
+            group.append(j)
+            used += lengths[j]
+        if group:
+            yield group
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self.batches())
+
+    def __len__(self) -> int:
+        return len(self.batches())
+
+
+def pack_rows(lengths: Sequence[int], pack_length: int) -> List[List[int]]:
+    """First-fit decreasing: item positions per packed row, each row <= pack_length tokens."""
+    rows: List[List[int]] = []
+    free: List[int] = []
+    for j in sorted(range(len(lengths)), key=lambda j: -lengths[j]):
+        row = next((r for r, space in enumerate(free) if space >= lengths[j]), None)
+        if row is None:
+            rows.append([])
+            free.append(pack_length)
+            row = len(rows) - 1
+        rows[row].append(j)
+        free[row] -= lengths[j]
+    return rows
+
+
+def collate_packed_arrays(items: Sequence[Dict[str, Any]], pack_length: int, pad_id: int = 0) -> Dict[str, np.ndarray]:
+    """Like reader_cache.collate_arrays, but several windows per row with a block-diagonal [B, L, L] mask."""
+    rows = pack_rows([len(it["input_ids"]) for it in items], pack_length)
+    width = max(sum(len(items[j]["input_ids"]) for j in row) for row in rows)
+    n = len(rows)
+    input_ids = np.full((n, width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((n, width, width), dtype=np.int64)
+    position_ids = np.zeros((n, width), dtype=np.int64)
+    segment_ids = np.zeros((n, width), dtype=np.int64)
+    token_type_ids = np.zeros((n, width), dtype=np.int64)
+    prediction_mask = np.ones((n, width), dtype=np.int64)
+    special_symbols_mask = np.zeros((n, width), dtype=bool)
+    start_labels = np.full((n, width), IGNORE_INDEX, dtype=np.int64)
+    end_labels = np.full((n, width), IGNORE_INDEX, dtype=np.int64)
+    keys = np.full((n, max(len(row) for row in rows), 2), -1, dtype=np.int64)
+    for r, row in enumerate(rows):
+        off = 0
+        for seg, j in enumerate(row, start=1):
+            it = items[j]
+            length, text_len = len(it["input_ids"]), it["text_len"]
+            end = off + length
+            input_ids[r, off:end] = it["input_ids"]
+            attention_mask[r, off:end, off:end] = 1
+            position_ids[r, off:end] = np.arange(length)
+            segment_ids[r, off:end] = seg
+            token_type_ids[r, off + text_len:end] = 1
+            prediction_mask[r, off + 1:off + text_len - 1] = 0
+            special_symbols_mask[r, off + np.asarray(it["symbol_pos"], dtype=np.int64)] = True
+            start_labels[r, off + 1:off + text_len - 1] = 0
+            end_labels[r, off + 1:off + text_len - 1] = 0
+            for start, stop, symbol in it["labels"]:
+                start_labels[r, off + start] = 1
+                end_labels[r, off + stop] = symbol + 1
+            keys[r, seg - 1] = it["key"]
+            off = end
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids,
+            "segment_ids": segment_ids, "token_type_ids": token_type_ids, "prediction_mask": prediction_mask,
+            "special_symbols_mask": special_symbols_mask, "start_labels": start_labels, "end_labels": end_labels,
+            "keys": keys}
+
+
+def collate_packed(items: Sequence[Dict[str, Any]], pack_length: int = PACK_LENGTH, pad_id: int = 0):
+    import torch
+
+    return {k: torch.from_numpy(v) for k, v in collate_packed_arrays(items, pack_length, pad_id).items()}
+
+
+def useful_tokens(batch: Dict[str, Any]) -> int:
+    """Non-padding tokens of a padded or packed batch."""
+    if "segment_ids" in batch:
+        return int((batch["segment_ids"] > 0).sum())
+    return int(batch["attention_mask"].sum())
+
+
+def make_train_dataloader(split_dir: Path, max_tokens: int = MAX_TOKENS, max_batch_size: int = MAX_BATCH_SIZE,
+                          pack_length: Optional[int] = None, shuffle: bool = True, num_workers: int = 0,
+                          pad_id: int = 0):
+    """
+    DataLoader over reader shards with TokenBudgetBatchSampler (+ packing collate with `pack_length`,
+    only for models that score within `segment_ids`, not the stock relik Reader).
+    """
+    from functools import partial
+
+    from torch.utils.data import DataLoader
+
+    from reader_cache import collate
+
+    dataset = PretokenizedReaderDataset(split_dir)
+    sampler = TokenBudgetBatchSampler(dataset.lengths(), max_tokens, max_batch_size, shuffle=shuffle,
+                                      pack_length=pack_length)
+    fn = partial(collate_packed, pack_length=pack_length, pad_id=pad_id) if pack_length else partial(
+        collate, pad_id=pad_id)
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=fn, num_workers=num_workers,
+                      persistent_workers=num_workers > 0)
+
+
+class ThroughputMeter:
+    """Running tokens/s (padded positions included) and useful tokens/s."""
+
+    def __init__(self):
+        self.steps = 0
+        self.tokens = 0
+        self.useful = 0
+        self.seconds = 0.0
+
+    def update(self, tokens: int, useful: int, seconds: float) -> None:
+        self.steps += 1
+        self.tokens += tokens
+        self.useful += useful
+        self.seconds += seconds
+
+    def summary(self) -> Dict[str, float]:
+        s = self.seconds or float("nan")
+        return {
+            "steps": self.steps,
+            "tokens_per_s": round(self.tokens / s, 1),
+            "useful_tokens_per_s": round(self.useful / s, 1),
+            "padding_fraction": round(1 - self.useful / self.tokens, 4) if self.tokens else 0.0,
+        }
+
+
+def throughput_callback():
+    """Lightning callback: logs tokens/s and useful tokens/s per training step."""
+    from lightning.pytorch.callbacks import Callback
+
+    class ThroughputCallback(Callback):
+        def __init__(self):
+            self.meter = ThroughputMeter()
+            self._t0 = 0.0
+
+        def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+            self._t0 = time.perf_counter()
+
+        def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+            seconds = time.perf_counter() - self._t0
+            tokens, useful = int(batch["input_ids"].numel()), useful_tokens(batch)
+            self.meter.update(tokens, useful, seconds)
+            pl_module.log_dict({"train/tokens_per_s": tokens / seconds, "train/useful_tokens_per_s": useful / seconds},
+                               on_step=True, on_epoch=False)
+
+        def on_train_end(self, trainer, pl_module):
+            print(f"throughput: {self.meter.summary()}")
+
+    return ThroughputCallback()
+
+
+def fixed_batches(n: int, batch_size: int, seed: int = SEED) -> List[List[int]]:
+    """Current collation: shuffled fixed-size batches."""
+    order = np.random.default_rng(seed).permutation(n).tolist()
+    return [order[a:a + batch_size] for a in range(0, n, batch_size)]
+
+
+def bench(dataset: PretokenizedReaderDataset, modes: Dict[str, List[List[int]]], pack_length: Optional[int],
+          model=None) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, batches in modes.items():
+        meter = ThroughputMeter()
+        collate_s = 0.0
+        for batch in batches:
+            items = [dataset[i] for i in batch]
+            t0 = time.perf_counter()
+            arrays = (collate_packed_arrays(items, pack_length) if name == "packed" else collate_arrays(items))
+            collate_s += time.perf_counter() - t0
+            seconds = forward_seconds(model, arrays) if model is not None else time.perf_counter() - t0
+            meter.update(int(arrays["input_ids"].size), useful_tokens(arrays), seconds)
+        results[name] = {"batches": len(batches), "collate_s": round(collate_s, 3), **meter.summary()}
+    return results
+
+
+def forward_seconds(model, arrays: Dict[str, np.ndarray]) -> float:
+    import torch
+
+    inputs = {"input_ids": torch.from_numpy(arrays["input_ids"]),
+              "attention_mask": torch.from_numpy(arrays["attention_mask"])}
+    if "position_ids" in arrays:
+        inputs["position_ids"] = torch.from_numpy(arrays["position_ids"])
+    t0 = time.perf_counter()
+    with torch.inference_mode():
+        model(**inputs)
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="padding / throughput of fixed vs token-budget vs packed batches")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("bench")
+    p.add_argument("--split", default="val")
+    p.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    p.add_argument("--batch-size", type=int, default=16, help="fixed batch size of the current collation")
+    p.add_argument("--max-tokens", type=int, default=MAX_TOKENS)
+    p.add_argument("--pack-length", type=int, default=PACK_LENGTH)
+    p.add_argument("--model", default=None, help="transformers model for forward tokens/s (default: collate only)")
+    p.add_argument("--limit", type=int, default=None, help="first N batches per mode")
+    args = parser.parse_args()
+
+    manifests = sorted(args.cache_dir.glob(f"*/{args.split}/{MANIFEST}"))
+    if not manifests:
+        raise SystemExit(f"no reader cache for {args.split} in {args.cache_dir}; run reader_cache.py build")
+    dataset = PretokenizedReaderDataset(manifests[-1].parent)
+    lengths = dataset.lengths()
+    pack_length = max(args.pack_length, int(lengths.max()))
+    modes = {
+        "fixed": fixed_batches(len(dataset), args.batch_size),
+        "bucketed": TokenBudgetBatchSampler(lengths, args.max_tokens).batches(),
+        "packed": TokenBudgetBatchSampler(lengths, args.max_tokens, pack_length=pack_length).batches(),
+    }
+    if args.limit:
+        modes = {k: v[:args.limit] for k, v in modes.items()}
+
+    model = None
+    if args.model:
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(args.model).eval()
+        # the candidate symbols were added to the tokenizer
+        model.resize_token_embeddings(dataset.manifest["config"]["vocab_size"])
+
+    print(f"[{args.split}] {len(dataset)} windows, mean length {lengths.mean():.1f}, max {lengths.max()}")
+    for name, r in bench(dataset, modes, pack_length, model).items():
+        print(f"  {name:<9} {r}")
+
+
+if __name__ == "__main__":
+    main()
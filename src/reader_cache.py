@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Vor-tokenisierter Reader-Datensatz: `*.window.candidates.jsonl` wird einmal mit dem
+Reader-Tokenizer (DeBERTa) tokenisiert und als memory-mapped Shards gespeichert.
+Training (train_reader.py --pretokenized) liest danach nur noch Array-Slices,
+ohne JSON-Parsing und ohne Tokenizer.
+
+Sequenz pro Window (Layout wie relik): [CLS] Window-Wörter [SEP] --NME-- [E-0] Cand0 [E-1] Cand1 … [SEP]
+Candidates, die nicht mehr in MAX_LENGTH passen, fallen weg (in der Statistik gezählt).
+
+  data/cache/reader/<key>/<split>/
+    manifest.json        Config, Input-Fingerprint (Größe/mtime), Shards, Statistik
+    shard-NNNNN/
+      input_ids.npy      int32 [Tokens]      alle Sequenzen hintereinander
+      row_ptr.npy        int64 [rows + 1]    Sequenz i = input_ids[row_ptr[i]:row_ptr[i+1]]
+      text_len.npy       int32 [rows]        Länge von [CLS] Text [SEP] (token_type 0, Span-Positionen)
+      symbol_ptr.npy     int64 [rows + 1]    Candidate-Offsets: Positionen der Symbole (--NME--, [E-i])
+      symbol_pos.npy     int32 [Symbole]
+      label_ptr.npy      int64 [rows + 1]
+      labels.npy         int32 [Labels, 3]   (Start-Token, End-Token inkl., Symbol-Index; 0 = NME)
+      keys.npy           int64 [rows, 2]     (doc_id, window_id)
+
+`<key>` ist der Hash aus Tokenizer (Name + Vokabulargröße) und Config (MAX_LENGTH,
+Symbole, Format); passt der Input-Fingerprint nicht mehr, wird der Split neu gebaut.
+Die Datasets öffnen die Shards lazy pro DataLoader-Worker (mmap, Slices ohne Kopie);
+kopiert wird erst beim Padding im Collate.
+
+  python src/reader_cache.py build --splits train val
+  python src/reader_cache.py stats --splits val
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from eval import iter_jsonl, normalize_label
+
+ROOT = Path(__file__).resolve().parents[1]
+CAND_DIR = ROOT / "data/candidates/relik"
+CACHE_DIR = ROOT / "data/cache/reader"
+
+SPLITS = ["train", "val", "test"]
+
+READER_TOKENIZER = "microsoft/deberta-v3-base"
+MAX_LENGTH = 1024
+# special symbols: --NME-- + [E-0] .. [E-(MAX_CANDIDATES-1)]
+MAX_CANDIDATES = 100
+NME_SYMBOL = "--NME--"
+CANDIDATE_SYMBOL = "[E-{}]"
+FORMAT_VERSION = 1
+
+# windows tokenized per tokenizer call / rows per shard
+ENCODE_BATCH = 1024
+SHARD_ROWS = 50_000
+
+MANIFEST = "manifest.json"
+ARRAYS = ("input_ids", "row_ptr", "text_len", "symbol_ptr", "symbol_pos", "label_ptr", "labels", "keys")
+IGNORE_INDEX = -100
+
+
+def special_symbols(max_candidates: int = MAX_CANDIDATES) -> List[str]:
+    return [NME_SYMBOL] + [CANDIDATE_SYMBOL.format(i) for i in range(max_candidates)]
+
+
+def load_reader_tokenizer(name: str = READER_TOKENIZER, max_candidates: int = MAX_CANDIDATES):
+    """Fast tokenizer (word_ids needed) with the candidate symbols as special tokens."""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(name, use_fast=True)
+    tokenizer.add_special_tokens({"additional_special_tokens": special_symbols(max_candidates)})
+    return tokenizer
+
+
+def cache_config(tokenizer, max_length: int = MAX_LENGTH, max_candidates: int = MAX_CANDIDATES) -> Dict[str, Any]:
+    return {
+        "tokenizer": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "max_length": max_length,
+        "max_candidates": max_candidates,
+        "symbols": [NME_SYMBOL, CANDIDATE_SYMBOL],
+        "format": FORMAT_VERSION,
+    }
+
+
+def cache_key(config: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def input_fingerprint(path: Path) -> Dict[str, Any]:
+    st = path.stat()
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class WindowEncoder:
+    """Window + candidates -> one sequence with symbol positions and span labels (subword positions)."""
+
+    def __init__(self, tokenizer, max_length: int = MAX_LENGTH, max_candidates: int = MAX_CANDIDATES):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.max_candidates = max_candidates
+        self.symbol_ids = tokenizer.convert_tokens_to_ids(special_symbols(max_candidates))
+        self.cls, self.sep = tokenizer.cls_token_id, tokenizer.sep_token_id
+        # candidate strings repeat across windows: tokenized once
+        self.candidate_ids: Dict[str, List[int]] = {}
+        self.stats = {"windows": 0, "tokens": 0, "truncated_text": 0, "dropped_candidates": 0,
+                      "labels": 0, "nme_labels": 0, "dropped_labels": 0}
+
+    def _candidates(self, windows: Sequence[Dict[str, Any]]) -> None:
+        new = list(dict.fromkeys(c for w in windows for c in (w.get("span_candidates") or [])
+                                 if c not in self.candidate_ids))
+        if new:
+            enc = self.tokenizer(new, add_special_tokens=False)
+            self.candidate_ids.update(zip(new, enc["input_ids"]))
+
+    def encode(self, windows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self._candidates(windows)
+        words = [w.get("words") or w["tokens"] for w in windows]
+        enc = self.tokenizer(words, is_split_into_words=True, add_special_tokens=False)
+        return [self._encode_one(w, enc["input_ids"][j], enc.word_ids(j)) for j, w in enumerate(windows)]
+
+    def _encode_one(self, window: Dict[str, Any], ids: List[int], word_ids: List[Optional[int]]) -> Dict[str, Any]:
+        # the text keeps at most half of the sequence; the rest is for candidates
+        max_text = self.max_length // 2 - 2
+        if len(ids) > max_text:
+            ids, word_ids = ids[:max_text], word_ids[:max_text]
+            self.stats["truncated_text"] += 1
+        first: Dict[int, int] = {}
+        last: Dict[int, int] = {}
+        for pos, word in enumerate(word_ids, start=1):  # +1: [CLS]
+            if word is not None:
+                first.setdefault(word, pos)
+                last[word] = pos
+
+        seq = [self.cls] + list(ids) + [self.sep]
+        text_len = len(seq)
+        symbol_pos = [len(seq)]
+        seq.append(self.symbol_ids[0])
+        candidates = (window.get("span_candidates") or [])[:self.max_candidates]
+        kept: Dict[str, int] = {}
+        for i, cand in enumerate(candidates):
+            cand_ids = self.candidate_ids[cand]
+            if len(seq) + 1 + len(cand_ids) + 1 > self.max_length:
+                self.stats["dropped_candidates"] += len(candidates) - i
+                break
+            symbol_pos.append(len(seq))
+            seq.append(self.symbol_ids[i + 1])
+            seq.extend(cand_ids)
+            kept.setdefault(normalize_label(cand), i + 1)
+        seq.append(self.sep)
+
+        labels = []
+        for start, end, label in window.get("window_labels_tokens") or []:
+            start, end = int(start), int(end) - 1
+            if start not in first or end not in last:
+                self.stats["dropped_labels"] += 1
+                continue
+            symbol = kept.get(normalize_label(label), 0)
+            self.stats["nme_labels"] += symbol == 0
+            labels.append((first[start], last[end], symbol))
+        self.stats["labels"] += len(labels)
+        self.stats["windows"] += 1
+        self.stats["tokens"] += len(seq)
+        return {"input_ids": seq, "text_len": text_len, "symbol_pos": symbol_pos, "labels": labels,
+                "key": (int(window["doc_id"]), int(window["window_id"]))}
+
+
+class ShardWriter:
+    """Collects encoded rows and writes them as shard directories (tmp dir + rename)."""
+
+    def __init__(self, out_dir: Path, shard_rows: int = SHARD_ROWS):
+        self.out_dir = out_dir
+        self.shard_rows = shard_rows
+        self.rows: List[Dict[str, Any]] = []
+        self.shards: List[Dict[str, Any]] = []
+
+    def add(self, rows: Sequence[Dict[str, Any]]) -> None:
+        self.rows.extend(rows)
+        while len(self.rows) >= self.shard_rows:
+            self._write(self.rows[:self.shard_rows])
+            self.rows = self.rows[self.shard_rows:]
+
+    def finish(self) -> List[Dict[str, Any]]:
+        if self.rows or not self.shards:
+            self._write(self.rows)
+            self.rows = []
+        return self.shards
+
+    def _write(self, rows: Sequence[Dict[str, Any]]) -> None:
+        name = f"shard-{len(self.shards):05d}"
+        tmp = self.out_dir / (name + ".tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+
+        def ptr(lengths: Iterator[int]) -> np.ndarray:
+            return np.concatenate([[0], np.cumsum(np.fromiter(lengths, dtype=np.int64, count=len(rows)))])
+
+        arrays = {
+            "input_ids": np.fromiter((t for r in rows for t in r["input_ids"]), dtype=np.int32),
+            "row_ptr": ptr(len(r["input_ids"]) for r in rows),
+            "text_len": np.fromiter((r["text_len"] for r in rows), dtype=np.int32, count=len(rows)),
+            "symbol_ptr": ptr(len(r["symbol_pos"]) for r in rows),
+            "symbol_pos": np.fromiter((p for r in rows for p in r["symbol_pos"]), dtype=np.int32),
+            "label_ptr": ptr(len(r["labels"]) for r in rows),
+            "labels": np.asarray([lab for r in rows for lab in r["labels"]], dtype=np.int32).reshape(-1, 3),
+            "keys": np.asarray([r["key"] for r in rows], dtype=np.int64).reshape(-1, 2),
+        }
+        for field, array in arrays.items():
+            np.save(tmp / f"{field}.npy", array)
+        os.replace(tmp, self.out_dir / name)
+        self.shards.append({"name": name, "rows": len(rows), "tokens": int(len(arrays["input_ids"]))})
+
+
+def split_dir_for(cache_dir: Path, config: Dict[str, Any], split: str) -> Path:
+    return cache_dir / cache_key(config) / split
+
+
+def is_current(split_dir: Path, inp: Path) -> bool:
+    manifest = split_dir / MANIFEST
+    if not manifest.exists():
+        return False
+    return json.loads(manifest.read_text(encoding="utf-8")).get("input") == input_fingerprint(inp)
+
+
+def build_split(inp: Path, split_dir: Path, encoder: WindowEncoder, config: Dict[str, Any],
+                shard_rows: int = SHARD_ROWS) -> Dict[str, Any]:
+    """Tokenizes one candidates file into shards; the manifest is written last."""
+    if split_dir.exists():
+        shutil.rmtree(split_dir)
+    split_dir.mkdir(parents=True)
+    writer = ShardWriter(split_dir, shard_rows)
+    batch: List[Dict[str, Any]] = []
+    for window in iter_jsonl(inp):
+        batch.append(window)
+        if len(batch) >= ENCODE_BATCH:
+            writer.add(encoder.encode(batch))
+            batch = []
+    if batch:
+        writer.add(encoder.encode(batch))
+    shards = writer.finish()
+    manifest = {"key": cache_key(config), "config": config, "input": input_fingerprint(inp),
+                "rows": sum(s["rows"] for s in shards), "shards": shards, "stats": dict(encoder.stats)}
+    (split_dir / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def prepare(inputs: Dict[str, Path], tokenizer=None, tokenizer_name: str = READER_TOKENIZER,
+            cache_dir: Path = CACHE_DIR, max_length: int = MAX_LENGTH, max_candidates: int = MAX_CANDIDATES,
+            force: bool = False) -> Dict[str, Path]:
+    """split -> shard dir; builds the splits whose cache is missing or stale."""
+    tokenizer = tokenizer or load_reader_tokenizer(tokenizer_name, max_candidates)
+    config = cache_config(tokenizer, max_length, max_candidates)
+    encoder = None
+    out = {}
+    for split, inp in inputs.items():
+        split_dir = split_dir_for(cache_dir, config, split)
+        out[split] = split_dir
+        if not force and is_current(split_dir, inp):
+            print(f"[{split}] reader cache up to date: {split_dir}")
+            continue
+        encoder = encoder or WindowEncoder(tokenizer, max_length, max_candidates)
+        t0 = time.perf_counter()
+        manifest = build_split(inp, split_dir, encoder, config)
+        print(f"[{split}] {manifest['rows']} windows tokenized in {time.perf_counter() - t0:.1f}s -> {split_dir}")
+    return out
+
+
+class PretokenizedReaderDataset:
+    """
+    Map-style dataset over the shards of one split (usable by torch DataLoader as is).
+    Items are numpy views into the memory-mapped arrays; shards are opened lazily,
+    so every DataLoader worker maps them itself instead of receiving pickled copies.
+    """
+
+    def __init__(self, split_dir: Path):
+        self.split_dir = Path(split_dir)
+        self.manifest = json.loads((self.split_dir / MANIFEST).read_text(encoding="utf-8"))
+        rows = [s["rows"] for s in self.manifest["shards"]]
+        self.starts = np.concatenate([[0], np.cumsum(rows)]).astype(np.int64)
+        self._shards: Optional[List[Dict[str, np.ndarray]]] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state["_shards"] = None
+        return state
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    @property
+    def shards(self) -> List[Dict[str, np.ndarray]]:
+        if self._shards is None:
+            # copy-on-write maps: writable views (torch.from_numpy) without copying the file
+            self._shards = [{field: np.load(self.split_dir / s["name"] / f"{field}.npy", mmap_mode="c")
+                             for field in ARRAYS} for s in self.manifest["shards"]]
+        return self._shards
+
+    def _locate(self, index: int) -> Tuple[Dict[str, np.ndarray], int]:
+        if index < 0:
+            index += len(self)
+        shard = int(np.searchsorted(self.starts, index, side="right")) - 1
+        return self.shards[shard], index - int(self.starts[shard])
+
+    def lengths(self) -> np.ndarray:
+        """Sequence length of every row (from the row pointers, no token data read)."""
+        return np.concatenate([np.diff(s["row_ptr"]) for s in self.shards]) if len(self) else np.zeros(0, np.int64)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        s, i = self._locate(index)
+        return {
+            "input_ids": s["input_ids"][s["row_ptr"][i]:s["row_ptr"][i + 1]],
+            "text_len": int(s["text_len"][i]),
+            "symbol_pos": s["symbol_pos"][s["symbol_ptr"][i]:s["symbol_ptr"][i + 1]],
+            "labels": s["labels"][s["label_ptr"][i]:s["label_ptr"][i + 1]],
+            "key": s["keys"][i],
+        }
+
+
+def collate_arrays(items: Sequence[Dict[str, Any]], pad_id: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Padded batch in the relik span-reader layout: input_ids, attention_mask,
+    token_type_ids (1 = candidate part), prediction_mask (1 = no span position),
+    special_symbols_mask, start_labels (1 = span start) and end_labels (symbol
+    index + 1 at the span end); label positions outside the text are IGNORE_INDEX.
+    """
+    width = max(len(it["input_ids"]) for it in items)
+    n = len(items)
+    input_ids = np.full((n, width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((n, width), dtype=np.int64)
+    token_type_ids = np.zeros((n, width), dtype=np.int64)
+    prediction_mask = np.ones((n, width), dtype=np.int64)
+    special_symbols_mask = np.zeros((n, width), dtype=bool)
+    start_labels = np.full((n, width), IGNORE_INDEX, dtype=np.int64)
+    end_labels = np.full((n, width), IGNORE_INDEX, dtype=np.int64)
+    for row, it in enumerate(items):
+        length, text_len = len(it["input_ids"]), it["text_len"]
+        input_ids[row, :length] = it["input_ids"]
+        attention_mask[row, :length] = 1
+        token_type_ids[row, text_len:length] = 1
+        # spans can only start/end on text tokens between [CLS] and [SEP]
+        prediction_mask[row, 1:text_len - 1] = 0
+        special_symbols_mask[row, it["symbol_pos"]] = True
+        start_labels[row, 1:text_len - 1] = 0
+        end_labels[row, 1:text_len - 1] = 0
+        for start, end, symbol in it["labels"]:
+            start_labels[row, start] = 1
+            end_labels[row, end] = symbol + 1
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids,
+            "prediction_mask": prediction_mask, "special_symbols_mask": special_symbols_mask,
+            "start_labels": start_labels, "end_labels": end_labels,
+            "keys": np.stack([it["key"] for it in items])}
+
+
+def collate(items: Sequence[Dict[str, Any]], pad_id: int = 0):
+    import torch
+
+    return {k: torch.from_numpy(v) for k, v in collate_arrays(items, pad_id).items()}
+
+
+def make_dataloader(split_dir: Path, batch_size: int, shuffle: bool = False, num_workers: int = 0,
+                    pad_id: int = 0, batch_sampler=None):
+    """torch DataLoader over a shard dir; workers open their own memory maps."""
+    from functools import partial
+
+    from torch.utils.data import DataLoader
+
+    dataset = PretokenizedReaderDataset(split_dir)
+    kwargs: Dict[str, Any] = {"batch_sampler": batch_sampler} if batch_sampler is not None else {
+        "batch_size": batch_size, "shuffle": shuffle}
+    return DataLoader(dataset, collate_fn=partial(collate, pad_id=pad_id), num_workers=num_workers,
+                      persistent_workers=num_workers > 0, **kwargs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="candidates jsonl -> pre-tokenized memory-mapped reader shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="tokenize the splits (only missing/stale ones)")
+    p.add_argument("--splits", nargs="+", default=SPLITS)
+    p.add_argument("--candidates-dir", type=Path, default=CAND_DIR)
+    p.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    p.add_argument("--tokenizer", default=READER_TOKENIZER)
+    p.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    p.add_argument("--max-candidates", type=int, default=MAX_CANDIDATES)
+    p.add_argument("--force", action="store_true")
+
+    p = sub.add_parser("stats", help="manifest statistics + one pass over the rows")
+    p.add_argument("--splits", nargs="+", default=SPLITS)
+    p.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        inputs = {s: args.candidates_dir / f"{s}.window.candidates.jsonl" for s in args.splits}
+        missing = [s for s, p in inputs.items() if not p.exists()]
+        for s in missing:
+            print(f"[{s}] missing input: {inputs[s]}")
+        prepare({s: p for s, p in inputs.items() if s not in missing}, tokenizer_name=args.tokenizer,
+                cache_dir=args.cache_dir, max_length=args.max_length, max_candidates=args.max_candidates,
+                force=args.force)
+        return
+
+    for split in args.splits:
+        for manifest in sorted(args.cache_dir.glob(f"*/{split}/{MANIFEST}")):
+            dataset = PretokenizedReaderDataset(manifest.parent)
+            t0 = time.perf_counter()
+            tokens = sum(len(dataset[i]["input_ids"]) for i in range(len(dataset)))
+            lengths = dataset.lengths()
+            print(f"[{split}] {manifest.parent}: {len(dataset)} rows, {tokens} tokens "
+                  f"(mean {lengths.mean() if len(lengths) else 0:.1f}, max {lengths.max(initial=0)}), "
+                  f"read in {time.perf_counter() - t0:.2f}s; {dataset.manifest['stats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Ressourcen-Governor für die Retriever-Inferenz (statt fest BATCH_SIZE=1 / OMP_NUM_THREADS=1).
+
+Bekommt ein RSS-Budget (MB) und ein Core-Budget und passt nach jedem Batch an:
+  - Token-Budget pro Batch: wächst, solange der Speicher unter LOW_WATER bleibt,
+    halbiert sich über HIGH_WATER; vor jedem Batch wird der Peak aus dem
+    gemessenen Speicher pro Token geschätzt und ggf. vorher verkleinert
+  - Threads: werden schrittweise erhöht, solange der Durchsatz steigt
+
+Die gewählten Werte landen in STATE_FILE und sind der Startpunkt des nächsten Laufs.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+STATE_FILE = ROOT / "data/cache/governor.json"
+
+# fractions of the RSS budget
+LOW_WATER = 0.60
+HIGH_WATER = 0.85
+
+GROW_FACTOR = 1.5
+MIN_TOKENS_PER_BATCH = 256
+MAX_TOKENS_PER_BATCH = 65_536
+# relative throughput gain needed to keep an extra thread
+THREAD_GAIN = 1.05
+# batches measured per thread setting before deciding
+THREAD_PROBE_BATCHES = 3
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+# set by the pipeline driver (pipeline.py) for jobs running on a core slice
+CORES_ENV = "PIPELINE_CORES"
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (psutil, /proc or getrusage peak as fallback)."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def available_cores() -> List[int]:
+    """CPU ids this process may run on (respects an affinity set by the parent)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_count() -> int:
+    """Core budget of this process: the slice given by the pipeline driver, else all usable cores."""
+    if os.environ.get(CORES_ENV):
+        return max(1, int(os.environ[CORES_ENV]))
+    return len(available_cores())
+
+
+def thread_env(cores: int) -> Dict[str, str]:
+    env = {var: str(cores) for var in THREAD_ENV_VARS}
+    env[CORES_ENV] = str(cores)
+    env["TOKENIZERS_PARALLELISM"] = "false"
+    return env
+
+
+def limit_thread_env(cores: int) -> None:
+    """Upper bound for BLAS/OpenMP pools; must run before torch/numpy are imported."""
+    os.environ.update(thread_env(cores))
+
+
+def load_state(key: str, state_file: Path = STATE_FILE) -> Dict[str, Any]:
+    if not state_file.exists():
+        return {}
+    try:
+        return json.loads(state_file.read_text(encoding="utf-8")).get(key, {})
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(key: str, settings: Dict[str, Any], state_file: Path = STATE_FILE) -> None:
+    state = {}
+    if state_file.exists():
+        try:
+            state = json.loads(state_file.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            state = {}
+    state[key] = settings
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = state_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, state_file)
+
+
+class ResourceGovernor:
+    def __init__(
+        self,
+        rss_budget_mb: float,
+        cores: int,
+        key: str,
+        start_tokens: int = 2048,
+        max_batch_size: int = 256,
+        state_file: Path = STATE_FILE,
+    ):
+        self.rss_budget_mb = rss_budget_mb
+        self.cores = max(1, cores)
+        self.key = key
+        self.state_file = state_file
+        self.max_batch_size = max_batch_size
+
+        state = load_state(key, state_file)
+        self.max_tokens = int(state.get("max_tokens_per_batch", start_tokens))
+        self.threads = min(self.cores, int(state.get("threads", 1)))
+        recorded_budget = state.get("rss_budget_mb")
+        if recorded_budget and recorded_budget > rss_budget_mb:
+            # recorded on a bigger budget -> scale the start value down
+            self.max_tokens = max(MIN_TOKENS_PER_BATCH, int(self.max_tokens * rss_budget_mb / recorded_budget))
+        if state:
+            print(f"governor: starting from recorded settings {state}")
+
+        self.base_rss_mb = current_rss_mb()
+        self.peak_rss_mb = self.base_rss_mb
+        self.mb_per_token = 0.0
+        self.backoffs = 0
+
+        # thread probing
+        self._probe_tokens = 0
+        self._probe_seconds = 0.0
+        self._probe_batches = 0
+        self._best_rate: Optional[float] = None
+        self._threads_settled = self.threads >= self.cores
+        self._t0 = 0.0
+        self._rss0 = 0.0
+        self.apply_threads()
+
+    def rebase(self) -> None:
+        """Re-sample the RSS baseline, e.g. after the model and index were loaded."""
+        self.base_rss_mb = current_rss_mb()
+        self.peak_rss_mb = max(self.peak_rss_mb, self.base_rss_mb)
+
+    def apply_threads(self) -> None:
+        try:
+            import torch
+
+            torch.set_num_threads(self.threads)
+        except ImportError:
+            pass
+
+    # --- per batch ---
+
+    def limit_for(self, longest: int) -> int:
+        """Token budget for the next batch, reduced if the predicted peak would exceed HIGH_WATER."""
+        headroom = self.rss_budget_mb * HIGH_WATER - self.base_rss_mb
+        if self.mb_per_token > 0 and headroom > 0:
+            safe = int(headroom / self.mb_per_token)
+            if safe < self.max_tokens:
+                self.max_tokens = max(MIN_TOKENS_PER_BATCH, safe)
+        return max(self.max_tokens, longest)
+
+    def start_batch(self) -> None:
+        self._rss0 = current_rss_mb()
+        self._t0 = time.perf_counter()
+
+    def end_batch(self, padded_tokens: int) -> None:
+        seconds = time.perf_counter() - self._t0
+        rss = current_rss_mb()
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        if padded_tokens > 0 and rss > self._rss0:
+            # growth of this batch only; keep the most pessimistic per-token value seen so far
+            self.mb_per_token = max(self.mb_per_token, (rss - self._rss0) / padded_tokens)
+
+        if rss > self.rss_budget_mb * HIGH_WATER:
+            self.max_tokens = max(MIN_TOKENS_PER_BATCH, self.max_tokens // 2)
+            self.backoffs += 1
+            import gc
+
+            gc.collect()
+        elif rss < self.rss_budget_mb * LOW_WATER:
+            self.max_tokens = min(MAX_TOKENS_PER_BATCH, int(self.max_tokens * GROW_FACTOR))
+
+        self._tune_threads(padded_tokens, seconds)
+
+    def _tune_threads(self, tokens: int, seconds: float) -> None:
+        if self._threads_settled:
+            return
+        self._probe_tokens += tokens
+        self._probe_seconds += seconds
+        self._probe_batches += 1
+        if self._probe_batches < THREAD_PROBE_BATCHES or self._probe_seconds <= 0:
+            return
+
+        rate = self._probe_tokens / self._probe_seconds
+        self._probe_tokens, self._probe_seconds, self._probe_batches = 0, 0.0, 0
+        if self._best_rate is None or rate > self._best_rate * THREAD_GAIN:
+            self._best_rate = rate
+            if self.threads < self.cores:
+                self.threads += 1
+                self.apply_threads()
+            else:
+                self._threads_settled = True
+        else:
+            # no gain from the last extra thread -> go back and stop probing
+            self.threads = max(1, self.threads - 1)
+            self.apply_threads()
+            self._threads_settled = True
+
+    # --- bookkeeping ---
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "max_tokens_per_batch": self.max_tokens,
+            "threads": self.threads,
+            "rss_budget_mb": self.rss_budget_mb,
+            "cores": self.cores,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "tokens_per_s": round(self._best_rate, 1) if self._best_rate else None,
+            "backoffs": self.backoffs,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def save(self) -> None:
+        save_state(self.key, self.settings(), self.state_file)
+        print(f"governor: {self.settings()}")
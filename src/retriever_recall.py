@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Retriever-Analyse: Rang des Gold-Eintrags in `span_candidates` für jedes `window_labels`-Element.
+
+Ein Durchgang pro Split-Datei; daraus die komplette recall@k-Kurve (k = 1..Länge
+der Candidate-Listen) pro Split und pro entity_type, sowie das kleinste k, das
+eine Ziel-Recall erreicht. Damit lässt sich TOP_K (add_candidates.py / run_all.py)
+aus den Daten wählen statt raten.
+
+"unreachable": Gold-Label steht gar nicht im KB (z.B. MALWARE/TOOL mit Bosch-Links
+bei einem reinen MITRE-Index) -> kann bei keinem k gefunden werden; die Kurve
+wird zusätzlich relativ zu den erreichbaren Labels ausgegeben.
+
+  python src/retriever_recall.py --target 0.95
+  python src/retriever_recall.py --splits val --target 0.9 --out data/eval/recall_val.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from eval import ENTITY_TYPES, UNKNOWN, Vocab, iter_jsonl, load_span_types, normalize_label, span_items
+
+ROOT = Path(__file__).resolve().parents[1]
+CAND_DIR = ROOT / "data/candidates/relik"
+PROC_DIR = ROOT / "data/processed/relik"
+KB_FILE = ROOT / "data/index/mitre_documents.jsonl"
+OUT_FILE = ROOT / "data/eval/retriever_recall.json"
+
+SPLITS = ["train", "val", "test"]
+TARGET_RECALL = 0.95
+# k values shown in the printed table (the JSON has the full curve)
+REPORT_KS = [1, 5, 10, 20, 50, 100]
+
+MISS = -1
+
+
+def load_kb_labels(kb: Optional[Path]) -> Optional[set]:
+    if kb is None or not kb.exists():
+        return None
+    labels = set()
+    for doc in iter_jsonl(kb):
+        title = (doc.get("metadata") or {}).get("title")
+        labels.add(normalize_label(title or doc.get("text", "")))
+    return labels
+
+
+def gold_ranks(candidates: Path, processed: Optional[Path], types: Vocab, kb_labels: Optional[set]):
+    """(ranks, type ids, reachable flags, max list length); rank is 0-based, MISS if not retrieved."""
+    span_types = load_span_types(processed)
+    ranks: List[int] = []
+    type_ids: List[int] = []
+    reachable: List[bool] = []
+    max_len = 0
+    for window in iter_jsonl(candidates):
+        cands = window.get("span_candidates") or []
+        max_len = max(max_len, len(cands))
+        # first position of every normalized candidate
+        pos: Dict[str, int] = {}
+        for i, c in enumerate(cands):
+            pos.setdefault(normalize_label(c), i)
+        for start, end, label in span_items(window.get("window_labels", [])):
+            key = normalize_label(label)
+            ranks.append(pos.get(key, MISS))
+            type_ids.append(types(span_types.get((window["doc_id"], start, end), (UNKNOWN, UNKNOWN))[0]))
+            reachable.append(kb_labels is None or key in kb_labels)
+    return (np.asarray(ranks, dtype=np.int64), np.asarray(type_ids, dtype=np.int64),
+            np.asarray(reachable, dtype=bool), max_len)
+
+
+def recall_curve(ranks: np.ndarray, max_k: int) -> np.ndarray:
+    """recall@k for k = 1..max_k (index k-1)."""
+    if len(ranks) == 0 or max_k == 0:
+        return np.zeros(max_k, dtype=np.float64)
+    hits = np.bincount(ranks[ranks >= 0], minlength=max_k)[:max_k]
+    return np.cumsum(hits) / len(ranks)
+
+
+def smallest_k(curve: np.ndarray, target: float) -> Optional[int]:
+    idx = np.flatnonzero(curve >= target)
+    return int(idx[0]) + 1 if len(idx) else None
+
+
+def summarize(ranks: np.ndarray, reachable: np.ndarray, max_k: int, target: float) -> Dict[str, Any]:
+    curve = recall_curve(ranks, max_k)
+    reach_curve = recall_curve(ranks[reachable], max_k)
+    found = ranks[ranks >= 0]
+    return {
+        "labels": int(len(ranks)),
+        "unreachable": int((~reachable).sum()),
+        "missed": int((ranks < 0).sum()),
+        "mean_rank": round(float(found.mean()) + 1, 2) if len(found) else None,
+        "recall_at_max_k": round(float(curve[-1]), 4) if max_k else 0.0,
+        "recommended_k": smallest_k(curve, target),
+        "recommended_k_reachable": smallest_k(reach_curve, target),
+        "recall_at_k": [round(float(x), 4) for x in curve],
+        "reachable_recall_at_k": [round(float(x), 4) for x in reach_curve],
+    }
+
+
+def analyze(splits: Sequence[str], cand_dir: Path, proc_dir: Path, kb: Optional[Path],
+            target: float) -> Dict[str, Any]:
+    kb_labels = load_kb_labels(kb)
+    types = Vocab(ENTITY_TYPES + [UNKNOWN])
+    result: Dict[str, Any] = {"target_recall": target, "splits": {}}
+    all_ranks, all_types, all_reach, all_max = [], [], [], 0
+
+    for split in splits:
+        path = cand_dir / f"{split}.window.candidates.jsonl"
+        if not path.exists():
+            print(f"[{split}] missing candidates: {path}")
+            continue
+        ranks, type_ids, reachable, max_k = gold_ranks(path, proc_dir / f"{split}.jsonl", types, kb_labels)
+        entry = summarize(ranks, reachable, max_k, target)
+        entry["by_entity_type"] = {
+            name: summarize(ranks[type_ids == t], reachable[type_ids == t], max_k, target)
+            for t, name in enumerate(types.items) if (type_ids == t).any()
+        }
+        result["splits"][split] = entry
+        all_ranks.append(ranks)
+        all_types.append(type_ids)
+        all_reach.append(reachable)
+        all_max = max(all_max, max_k)
+
+    if all_ranks:
+        ranks, type_ids, reachable = np.concatenate(all_ranks), np.concatenate(all_types), np.concatenate(all_reach)
+        entry = summarize(ranks, reachable, all_max, target)
+        entry["by_entity_type"] = {
+            name: summarize(ranks[type_ids == t], reachable[type_ids == t], all_max, target)
+            for t, name in enumerate(types.items) if (type_ids == t).any()
+        }
+        result["all"] = entry
+    return result
+
+
+def print_report(result: Dict[str, Any], ks: Sequence[int]) -> None:
+    target = result["target_recall"]
+    blocks = [(split, entry) for split, entry in result["splits"].items()]
+    if "all" in result:
+        blocks.append(("all", result["all"]))
+    for name, entry in blocks:
+        max_k = len(entry["recall_at_k"])
+        shown = [k for k in ks if k <= max_k] or [max_k]
+        print(f"\n[{name}] {entry['labels']} gold labels, {entry['unreachable']} not in KB, "
+              f"{entry['missed']} not retrieved, mean rank {entry['mean_rank']}")
+        header = "".join(f"{'R@' + str(k):>8}" for k in shown)
+        print(f"  {'':<12}{header}  k@{target:g}  (reachable)")
+        rows = [("all", entry)] + list(entry["by_entity_type"].items())
+        for label, e in rows:
+            cells = "".join(f"{e['recall_at_k'][k - 1]:>8.4f}" for k in shown)
+            k_all = e["recommended_k"] if e["recommended_k"] is not None else "-"
+            k_reach = e["recommended_k_reachable"] if e["recommended_k_reachable"] is not None else "-"
+            print(f"  {label:<12}{cells}  {k_all!s:>6}  ({k_reach})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="recall@k of the retriever candidates + recommended TOP_K")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--target", type=float, default=TARGET_RECALL, help="target recall for the recommended k")
+    parser.add_argument("--candidates-dir", type=Path, default=CAND_DIR)
+    parser.add_argument("--processed-dir", type=Path, default=PROC_DIR)
+    parser.add_argument("--kb", type=Path, default=KB_FILE)
+    parser.add_argument("--ks", nargs="+", type=int, default=REPORT_KS, help="k values in the printed table")
+    parser.add_argument("--out", type=Path, default=OUT_FILE)
+    args = parser.parse_args()
+
+    result = analyze(args.splits, args.candidates_dir, args.processed_dir, args.kb, args.target)
+    print_report(result, args.ks)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"\nrecall curves -> {args.out}")
+    if "all" in result:
+        k = result["all"]["recommended_k"]
+        if k is None:
+            print(f"target recall {args.target} not reached with the stored candidates "
+                  f"(max {result['all']['recall_at_max_k']}) -> regenerate with a larger TOP_K")
+        else:
+            print(f"recommended TOP_K for recall >= {args.target}: {k}")
+
+
+if __name__ == "__main__":
+    main()
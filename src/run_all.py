@@ -1,8 +1,21 @@
 #!/usr/bin/env python3
+"""
+Pipeline-Treiber: baut die Stages als DAG (pipeline.py) und führt nur die aus,
+deren Eingaben, Parameter oder Code sich seit dem letzten Lauf geändert haben.
+Convert/Windows/Candidates laufen pro Split, d.h. ändert sich nur val, läuft nur val neu.
+
+  python src/run_all.py            # inkrementell
+  python src/run_all.py --force    # alles neu
+  python src/run_all.py --jobs 3   # Splits parallel, je ein eigener Core-Slice,
+                                   # Logs in logs/<stage>_<split>.stdout/.stderr
+"""
+import argparse
 import subprocess
 import sys
 from pathlib import Path
 
+from pipeline import Stage, run_stages
+
 ROOT = Path(__file__).resolve().parents[1]
 
 # --- paths ---
@@ -10,26 +23,59 @@ RAW_DIR = ROOT / "data" / "raw" / "annoctr" / "linking_mitre_only"
 PROC_DIR = ROOT / "data" / "processed" / "relik"
 WIN_DIR = ROOT / "data" / "windowed" / "relik"
 CAND_DIR = ROOT / "data" / "candidates" / "relik"
+PRED_DIR = ROOT / "data" / "predictions" / "relik"
+EVAL_DIR = ROOT / "data" / "eval"
 
 # You can switch these on/off
 DO_CONVERT = True
-DO_CHECK_SPANS = True
+DO_VALIDATE = True     # validate.py after convert/windows/candidates; a failed check blocks the next stage
 DO_STATS = True
 DO_WINDOWS = True
+DO_KB = False           # KB documents (STIX + AnnoCTR labels) + incremental index update before candidates
 DO_CANDIDATES = False   # turn on after relik is installed + you set encoder/index
 DO_TRAIN_READER = False # turn on after candidates exist
-DO_EVAL = False         # turn on after training / prediction is implemented
+DO_EVAL = False         # turn on once reader predictions are written to PRED_DIR
 
 # --- retriever/index for candidates (EL baseline) ---
 # Fill these once relik is installed and you decided which encoder/index to use
 QUESTION_ENCODER = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-encoder"
 DOCUMENT_INDEX = "sapienzanlp/relik-retriever-e5-base-v2-aida-blink-wikipedia-index"
-TOP_K = "100"
+TOP_K = 100
+# ranking stored once up to this depth; changing TOP_K (<= K_MAX) only re-slices it
+K_MAX = 100
+# exact-match fast path (dictionary_linker.py): pin KB hits, encode only windows without a hit,
+# fill the remaining slots from BM25 (BM25_INDEX, else they stay empty) (None = off)
+DICTIONARY_KB = None    # e.g. ROOT / "data" / "index" / "mitre_documents.jsonl"
+DENSE_POLICY = "unresolved"
+# search only these entity-type partitions of the index (None = all)
+CANDIDATE_TYPES = None  # e.g. ["TECHNIQUE", "TACTIC"]
+# hybrid retrieval: BM25 index built from the KB, fused with the dense ranking by RRF (None = dense only)
+BM25_INDEX = None       # e.g. ROOT / "data" / "index" / "bm25"
+FUSION_DEPTH = 50
+
+SPLITS = ["train", "val", "test"]
+
+# converter / windowing parameters (part of the stage fingerprints)
+GROUP_BY_DOCUMENT = False
+WINDOW_SIZE = 32
+WINDOW_STRIDE = 16
+READER_CFG = "relik/reader/conf/large.yaml"
+
+# eval gate: the run fails if the micro EL F1 on EVAL_SPLIT drops below this (None = report only)
+EVAL_SPLIT = "test"
+EVAL_MIN_F1 = None
+
+# RSS budget of the candidate generation, shared by all parallel candidate jobs
+CANDIDATES_RSS_BUDGET_MB = 6000
+
 
+def py(script: str, *args) -> list:
+    return [sys.executable, str(ROOT / "src" / script)] + [str(a) for a in args]
 
-def run_py(script: str):
-    print(f"\n==> python {script}")
-    subprocess.run([sys.executable, str(ROOT / "src" / script)], check=True)
+
+def run_py(script: str, *args):
+    print(f"\n==> python {script} {' '.join(map(str, args))}".rstrip())
+    subprocess.run(py(script, *args), check=True)
 
 
 def run_relik(args):
@@ -39,70 +85,228 @@ def run_relik(args):
     subprocess.run(cmd, check=True)
 
 
-def main():
-    # sanity checks
-    for name in ["train.jsonl", "val.jsonl", "test.jsonl"]:
-        p = RAW_DIR / name
-        if not p.exists():
-            raise FileNotFoundError(f"Missing raw file: {p}")
+def src(*names: str):
+    return [ROOT / "src" / n for n in names]
+
+
+def index_files(index: str):
+    """Files of a local document index (hub names are covered by the DOCUMENT_INDEX param)."""
+    p = Path(index)
+    return sorted(f for f in p.rglob("*") if f.is_file()) if p.is_dir() else []
+
+
+class Lazy:
+    """Loads expensive objects (tokenizer, retriever) only if a stage that needs them actually runs."""
+
+    def __init__(self):
+        self._nlp = None
+        self._generator = None
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            from create_windows import load_tokenizer
+
+            self._nlp = load_tokenizer()
+        return self._nlp
+
+    @property
+    def generator(self):
+        if self._generator is None:
+            # one retriever (encoder + index) for all splits, in-process; same setup (governor,
+            # embedding cache) as the add_candidates.py subprocesses of --jobs N
+            from add_candidates import build_generator
+
+            self._generator = build_generator(
+                question_encoder=QUESTION_ENCODER, document_index=DOCUMENT_INDEX,
+                rss_budget_mb=CANDIDATES_RSS_BUDGET_MB, dictionary=DICTIONARY_KB, dense_policy=DENSE_POLICY,
+                types=CANDIDATE_TYPES, bm25=BM25_INDEX, fusion_depth=FUSION_DEPTH)
+        return self._generator
 
-    PROC_DIR.mkdir(parents=True, exist_ok=True)
-    WIN_DIR.mkdir(parents=True, exist_ok=True)
-    CAND_DIR.mkdir(parents=True, exist_ok=True)
+
+def convert(split: str):
+    from multiprocessing import Pool
+
+    from convert_annoctr_to_relik import convert_split
+    from jsonl_io import default_workers
+
+    workers = default_workers()
+    with Pool(workers) as pool:
+        convert_split(split, RAW_DIR / f"{split}.jsonl", PROC_DIR / f"{split}.jsonl", GROUP_BY_DOCUMENT,
+                      pool=pool, workers=workers)
+
+
+def build_stages(jobs: int = 1):
+    lazy = Lazy()
+    stages = []
+    proc = [PROC_DIR / f"{split}.jsonl" for split in SPLITS]
+    cands = [CAND_DIR / f"{split}.window.candidates.jsonl" for split in SPLITS]
 
     if DO_CONVERT:
-        run_py("convert_annoctr_to_relik.py")
+        for split in SPLITS:
+            stages.append(Stage(
+                f"convert:{split}", lambda split=split: convert(split),
+                inputs=[RAW_DIR / f"{split}.jsonl"], outputs=[PROC_DIR / f"{split}.jsonl"],
+                params={"group_by_document": GROUP_BY_DOCUMENT},
+                code=src("convert_annoctr_to_relik.py", "jsonl_io.py"),
+                cmd=lambda cores, split=split: py(
+                    "convert_annoctr_to_relik.py", "--split", split, "--workers", cores,
+                    *(["--group-by-document"] if GROUP_BY_DOCUMENT else [])),
+            ))
+    converted = [f"convert:{split}" for split in SPLITS]
+
+    def validated(kind: str, split: str, path: Path, produced_by: str, enabled: bool) -> list:
+        """Adds a validate:<kind>:<split> stage after `produced_by`; returns the deps for the next stage."""
+        if not (DO_VALIDATE and enabled):
+            return [produced_by]
+        name = f"validate:{kind}:{split}"
+        stages.append(Stage(
+            name, lambda: run_py("validate.py", path),
+            inputs=[path], code=src("validate.py", "eval.py", "jsonl_io.py", "window_store.py"),
+            cmd=lambda cores: py("validate.py", path, "--workers", cores),
+            deps=[produced_by],
+        ))
+        return [name]
 
-    if DO_CHECK_SPANS:
-        run_py("check_processed_spans.py")
+    proc_ok = {split: validated("processed", split, PROC_DIR / f"{split}.jsonl", f"convert:{split}", DO_CONVERT)
+               for split in SPLITS}
 
     if DO_STATS:
-        # only if you implemented it; otherwise set DO_STATS=False
-        run_py("dataset_stats.py")
+        stages.append(Stage("stats", lambda: run_py("dataset_stats.py"),
+                            inputs=proc, outputs=[ROOT / "data" / "stats" / "dataset_stats.json"],
+                            code=src("dataset_stats.py", "sketches.py"),
+                            cmd=lambda cores: py("dataset_stats.py"), deps=converted))
 
     if DO_WINDOWS:
-        # EL windows (doc_text), no --is-split-into-words needed
-        run_relik(["data", "create-windows",
-                   str(PROC_DIR / "train.jsonl"),
-                   str(WIN_DIR / "train.window.jsonl")])
-        run_relik(["data", "create-windows",
-                   str(PROC_DIR / "val.jsonl"),
-                   str(WIN_DIR / "val.window.jsonl")])
-        run_relik(["data", "create-windows",
-                   str(PROC_DIR / "test.jsonl"),
-                   str(WIN_DIR / "test.window.jsonl")])
+        # EL windows (doc_text): in-process windowing, tokenizer loaded once for all splits
+        from create_windows import window_split
+
+        for split in SPLITS:
+            inp, out = PROC_DIR / f"{split}.jsonl", WIN_DIR / f"{split}.window.jsonl"
+            stages.append(Stage(
+                f"windows:{split}",
+                lambda inp=inp, out=out: window_split(lazy.nlp, inp, out, WINDOW_SIZE, WINDOW_STRIDE),
+                inputs=[inp], outputs=[out],
+                params={"window_size": WINDOW_SIZE, "window_stride": WINDOW_STRIDE},
+                code=src("create_windows.py"),
+                cmd=lambda cores, split=split: py(
+                    "create_windows.py", "--split", split, "--window-size", WINDOW_SIZE,
+                    "--window-stride", WINDOW_STRIDE, "--n-process", cores),
+                deps=proc_ok[split],
+            ))
+    win_ok = {split: validated("windows", split, WIN_DIR / f"{split}.window.jsonl", f"windows:{split}", DO_WINDOWS)
+              for split in SPLITS}
+
+    kb_deps = []
+    if DO_KB:
+        from build_mitre_documents import OUT_FILE as KB_FILE, STIX_FILE
+
+        stages.append(Stage(
+            "kb", lambda: run_py("build_mitre_documents.py"),
+            inputs=[RAW_DIR / f"{split}.jsonl" for split in SPLITS] + ([STIX_FILE] if STIX_FILE.exists() else []),
+            outputs=[KB_FILE], code=src("build_mitre_documents.py"),
+            cmd=lambda cores: py("build_mitre_documents.py"),
+        ))
+        stages.append(Stage(
+            "index", lambda: run_py("build_index.py", "--index", DOCUMENT_INDEX),
+            inputs=[KB_FILE], params={"document_index": DOCUMENT_INDEX},
+            code=src("build_index.py", "mmap_index.py"),
+            cmd=lambda cores: py("build_index.py", "--index", DOCUMENT_INDEX), deps=["kb"],
+        ))
+        kb_deps = ["index"]
+
+    if BM25_INDEX:
+        from bm25_index import KB_FILE as BM25_KB
+
+        stages.append(Stage(
+            "bm25", lambda: run_py("bm25_index.py", "build", "--out", BM25_INDEX),
+            inputs=[BM25_KB] + [RAW_DIR / f"{split}.jsonl" for split in SPLITS],
+            outputs=[Path(BM25_INDEX) / "bm25_index.json"],
+            code=src("bm25_index.py", "build_mitre_documents.py"),
+            cmd=lambda cores: py("bm25_index.py", "build", "--out", BM25_INDEX),
+            deps=["kb"] if DO_KB else [],
+        ))
+        kb_deps = kb_deps + ["bm25"]
 
     if DO_CANDIDATES:
-        run_relik(["retriever", "add-candidates",
-                   QUESTION_ENCODER,
-                   DOCUMENT_INDEX,
-                   str(WIN_DIR / "train.window.jsonl"),
-                   str(CAND_DIR / "train.window.candidates.jsonl"),
-                   "--top-k", TOP_K])
-        run_relik(["retriever", "add-candidates",
-                   QUESTION_ENCODER,
-                   DOCUMENT_INDEX,
-                   str(WIN_DIR / "val.window.jsonl"),
-                   str(CAND_DIR / "val.window.candidates.jsonl"),
-                   "--top-k", TOP_K])
-        run_relik(["retriever", "add-candidates",
-                   QUESTION_ENCODER,
-                   DOCUMENT_INDEX,
-                   str(WIN_DIR / "test.window.jsonl"),
-                   str(CAND_DIR / "test.window.candidates.jsonl"),
-                   "--top-k", TOP_K])
+        for split in SPLITS:
+            inp, out = WIN_DIR / f"{split}.window.jsonl", CAND_DIR / f"{split}.window.candidates.jsonl"
+            stages.append(Stage(
+                f"candidates:{split}",
+                lambda inp=inp, out=out: lazy.generator.add_candidates(inp, out, top_k=TOP_K, k_max=K_MAX),
+                inputs=[inp] + index_files(DOCUMENT_INDEX) + ([DICTIONARY_KB] if DICTIONARY_KB else [])
+                + ([Path(BM25_INDEX) / "bm25_index.json"] if BM25_INDEX else []),
+                outputs=[out],
+                params={"question_encoder": QUESTION_ENCODER, "document_index": DOCUMENT_INDEX, "top_k": TOP_K,
+                        "k_max": K_MAX, "dictionary": str(DICTIONARY_KB), "dense_policy": DENSE_POLICY,
+                        "types": CANDIDATE_TYPES, "bm25": str(BM25_INDEX), "fusion_depth": FUSION_DEPTH},
+                code=src("add_candidates.py", "candidates.py", "candidate_store.py", "mmap_index.py",
+                         "embedding_cache.py", "resource_governor.py", "dictionary_linker.py", "bm25_index.py",
+                         "window_store.py"),
+                cmd=lambda cores, split=split: py(
+                    "add_candidates.py", "--split", split, "--question-encoder", QUESTION_ENCODER,
+                    "--document-index", DOCUMENT_INDEX, "--top-k", TOP_K, "--k-max", K_MAX,
+                    "--rss-budget-mb", CANDIDATES_RSS_BUDGET_MB // max(1, min(jobs, len(SPLITS))),
+                    *(["--dictionary", DICTIONARY_KB, "--dense-policy", DENSE_POLICY] if DICTIONARY_KB else []),
+                    *(["--types", *CANDIDATE_TYPES] if CANDIDATE_TYPES else []),
+                    *(["--bm25", BM25_INDEX, "--fusion-depth", FUSION_DEPTH] if BM25_INDEX else [])),
+                deps=win_ok[split] + kb_deps,
+            ))
+    cand_ok = [dep for split in SPLITS for dep in validated(
+        "candidates", split, CAND_DIR / f"{split}.window.candidates.jsonl", f"candidates:{split}", DO_CANDIDATES)]
 
     if DO_TRAIN_READER:
         # choose EL reader config (adjust if you use a different one)
-        reader_cfg = "relik/reader/conf/large.yaml"
-        run_relik(["reader", "train", reader_cfg,
-                   f"train_dataset_path={CAND_DIR / 'train.window.candidates.jsonl'}",
-                   f"val_dataset_path={CAND_DIR / 'val.window.candidates.jsonl'}",
-                   f"test_dataset_path={CAND_DIR / 'test.window.candidates.jsonl'}"])
+        stages.append(Stage(
+            "train_reader",
+            lambda: run_relik(["reader", "train", READER_CFG,
+                               f"train_dataset_path={cands[0]}",
+                               f"val_dataset_path={cands[1]}",
+                               f"test_dataset_path={cands[2]}"]),
+            inputs=cands, params={"reader_cfg": READER_CFG},
+            deps=cand_ok,
+        ))
 
     if DO_EVAL:
-        run_py("eval.py")
+        preds = PRED_DIR / f"{EVAL_SPLIT}.window.predictions.jsonl"
+        eval_args = ["--split", EVAL_SPLIT] + (["--min-f1", EVAL_MIN_F1] if EVAL_MIN_F1 is not None else [])
+        stages.append(Stage(
+            "eval", lambda: subprocess.run(py("eval.py", *eval_args), check=True),
+            inputs=[preds, CAND_DIR / f"{EVAL_SPLIT}.window.candidates.jsonl", PROC_DIR / f"{EVAL_SPLIT}.jsonl"],
+            outputs=[EVAL_DIR / f"{EVAL_SPLIT}.metrics.json"],
+            params={"split": EVAL_SPLIT, "min_f1": EVAL_MIN_F1},
+            code=src("eval.py"),
+            cmd=lambda cores: py("eval.py", *eval_args),
+            deps=["train_reader"] + cand_ok,
+        ))
+
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AnnoCTR -> ReLiK pipeline")
+    parser.add_argument("--force", action="store_true", help="ignore the stage cache and rerun everything")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="run independent stages (e.g. the splits) concurrently, each on its own core slice")
+    args = parser.parse_args()
+
+    # sanity checks
+    for name in ["train.jsonl", "val.jsonl", "test.jsonl"]:
+        p = RAW_DIR / name
+        if not p.exists():
+            raise FileNotFoundError(f"Missing raw file: {p}")
+
+    PROC_DIR.mkdir(parents=True, exist_ok=True)
+    WIN_DIR.mkdir(parents=True, exist_ok=True)
+    CAND_DIR.mkdir(parents=True, exist_ok=True)
 
+    status = run_stages(build_stages(args.jobs), force=args.force, jobs=args.jobs)
+    ran = [name for name, st in status.items() if st == "ran"]
+    print(f"\nran {len(ran)} / {len(status)} stages: {', '.join(ran) or '-'}")
+    failed = [name for name, st in status.items() if st in ("failed", "blocked")]
+    if failed:
+        print(f"failed/blocked: {', '.join(failed)}")
+        sys.exit(1)
     print("run_all finished.")
 
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+HTTP-Inferenz-Service (FastAPI) für Entity Linking auf CTI-Text.
+
+Retriever-Encoder, Index (data/index/mitre_index) und Reader werden beim Start
+einmal geladen (linker.Linker) und mit einem Dummy-Text aufgewärmt; erst danach
+meldet /ready ok.
+
+Micro-Batching: Requests landen in einer begrenzten Queue; ein Batcher sammelt
+sie, bis MAX_BATCH_TEXTS / MAX_BATCH_CHARS erreicht sind oder MAX_WAIT_MS seit
+dem ersten Request verstrichen sind, und schickt alle Texte zusammen durch
+Retrieval + Reader (ein Modell-Thread, die Event-Loop blockiert nicht).
+Backpressure: volle Queue -> 503 mit Retry-After; Requests, die nicht innerhalb
+REQUEST_TIMEOUT_S fertig sind -> 504 (wartet der Request nicht mehr, wird er
+vor dem Batch verworfen).
+
+  python src/serve.py --port 8000
+  curl -s localhost:8000/link -H 'content-type: application/json' \\
+       -d '{"texts": ["APT29 used PowerShell to download Cobalt Strike."]}'
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from resource_governor import core_count, limit_thread_env
+
+# muss vor ML Imports wirken
+limit_thread_env(core_count())
+
+from fastapi import FastAPI, HTTPException  # noqa: E402
+from pydantic import BaseModel, Field  # noqa: E402
+
+from candidates import DOCUMENT_INDEX, QUESTION_ENCODER  # noqa: E402
+from dictionary_linker import DENSE_POLICIES, warn_without_bm25  # noqa: E402
+from linker import READER_MODEL, TOP_K, Linker  # noqa: E402
+
+HOST = "127.0.0.1"
+PORT = 8000
+
+# micro-batch limits: a batch is closed at whichever comes first
+MAX_BATCH_TEXTS = 32
+MAX_BATCH_CHARS = 64_000
+MAX_WAIT_MS = 10.0
+
+# backpressure
+MAX_QUEUE = 256
+RETRY_AFTER_S = 1
+REQUEST_TIMEOUT_S = 30.0
+
+# per request
+MAX_TEXTS_PER_REQUEST = 64
+MAX_TEXT_CHARS = 100_000
+
+
+class LinkRequest(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=MAX_TEXTS_PER_REQUEST)
+    # search only these entity-type partitions (e.g. ["TECHNIQUE"]); None = whole index
+    entity_types: Optional[List[str]] = None
+
+
+class LinkedSpan(BaseModel):
+    start: int
+    end: int
+    mention: str
+    kb_id: Optional[str]
+    title: str
+
+
+class LinkResponse(BaseModel):
+    results: List[List[LinkedSpan]]
+    batch_texts: int
+    queue_ms: float
+    latency_ms: float
+
+
+@dataclass
+class Pending:
+    texts: List[str]
+    future: asyncio.Future
+    types: Optional[List[str]] = None
+    enqueued: float = field(default_factory=time.perf_counter)
+    started: float = 0.0
+    batch_texts: int = 0
+
+
+class MicroBatcher:
+    """Bounded request queue + one task that turns it into size/deadline-limited batches."""
+
+    def __init__(self, linker: Linker, max_texts: int = MAX_BATCH_TEXTS, max_chars: int = MAX_BATCH_CHARS,
+                 max_wait_ms: float = MAX_WAIT_MS, max_queue: int = MAX_QUEUE):
+        self.linker = linker
+        self.max_texts = max_texts
+        self.max_chars = max_chars
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        # the models run in exactly one thread; torch parallelizes inside it
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="linker")
+        self._task: Optional[asyncio.Task] = None
+        self._carry: Optional[Pending] = None
+        self.batches = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    def submit(self, texts: List[str], types: Optional[List[str]] = None) -> Pending:
+        """Enqueues without waiting; raises asyncio.QueueFull when the queue is at capacity."""
+        item = Pending(texts, asyncio.get_running_loop().create_future(), types)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return item
+
+    async def _next_batch(self) -> List[Pending]:
+        first = self._carry or await self.queue.get()
+        self._carry = None
+        batch, n_texts, n_chars = [first], len(first.texts), sum(map(len, first.texts))
+        deadline = time.perf_counter() + self.max_wait
+        while n_texts < self.max_texts and n_chars < self.max_chars:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            size = sum(map(len, item.texts))
+            if n_texts + len(item.texts) > self.max_texts or n_chars + size > self.max_chars:
+                # does not fit any more: opens the next batch
+                self._carry = item
+                break
+            batch.append(item)
+            n_texts += len(item.texts)
+            n_chars += size
+        # requests whose client already gave up are not computed
+        return [item for item in batch if not item.future.done()]
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            texts = [t for item in batch for t in item.texts]
+            # requests with different entity types share the batch; the hint travels per text
+            types = [item.types for item in batch for _ in item.texts]
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.linker.link, texts,
+                                                     types if any(types) else None)
+            except Exception as e:  # one broken batch must not stop the service
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            self.batches += 1
+            pos = 0
+            for item in batch:
+                item.started, item.batch_texts = started, len(texts)
+                if not item.future.done():
+                    item.future.set_result(results[pos:pos + len(item.texts)])
+                pos += len(item.texts)
+
+
+def create_app(opts: Dict[str, Any]) -> FastAPI:
+    state: Dict[str, Any] = {"ready": False}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        loop = asyncio.get_running_loop()
+
+        def load() -> Linker:
+            linker = Linker(question_encoder=opts["question_encoder"], document_index=opts["document_index"],
+                            reader_model=opts["reader_model"], top_k=opts["top_k"],
+                            dictionary=opts["dictionary"], dense_policy=opts["dense_policy"], bm25=opts["bm25"])
+            t0 = time.perf_counter()
+            linker.warm_up()
+            print(f"warm-up done in {time.perf_counter() - t0:.2f}s")
+            return linker
+
+        linker = await loop.run_in_executor(None, load)
+        batcher = MicroBatcher(linker, opts["max_batch_texts"], opts["max_batch_chars"], opts["max_wait_ms"],
+                               opts["max_queue"])
+        batcher.start()
+        state.update(ready=True, batcher=batcher)
+        try:
+            yield
+        finally:
+            state["ready"] = False
+            await batcher.stop()
+
+    app = FastAPI(title="CTI entity linking", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health() -> Dict[str, Any]:
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    async def ready() -> Dict[str, Any]:
+        if not state["ready"]:
+            raise HTTPException(status_code=503, detail="loading")
+        batcher: MicroBatcher = state["batcher"]
+        return {"status": "ok", "queue": batcher.queue.qsize(), "max_queue": batcher.queue.maxsize,
+                "batches": batcher.batches, "rejected": batcher.rejected}
+
+    @app.post("/link", response_model=LinkResponse)
+    async def link(request: LinkRequest) -> LinkResponse:
+        if not state["ready"]:
+            raise HTTPException(status_code=503, detail="loading", headers={"Retry-After": str(RETRY_AFTER_S)})
+        too_long = [i for i, t in enumerate(request.texts) if len(t) > opts["max_text_chars"]]
+        if too_long:
+            raise HTTPException(status_code=413,
+                                detail=f"texts {too_long} exceed {opts['max_text_chars']} characters")
+        try:
+            item = state["batcher"].submit(request.texts, request.entity_types)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="queue full",
+                                headers={"Retry-After": str(RETRY_AFTER_S)}) from None
+        try:
+            results = await asyncio.wait_for(asyncio.shield(item.future), opts["request_timeout"])
+        except asyncio.TimeoutError:
+            # cancelled futures are skipped by the batcher
+            item.future.cancel()
+            raise HTTPException(status_code=504, detail="deadline exceeded") from None
+        done = time.perf_counter()
+        return LinkResponse(results=results, batch_texts=item.batch_texts,
+                            queue_ms=round((item.started - item.enqueued) * 1000, 2),
+                            latency_ms=round((done - item.enqueued) * 1000, 2))
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="entity linking HTTP service with dynamic micro-batching")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--question-encoder", default=QUESTION_ENCODER)
+    parser.add_argument("--document-index", default=DOCUMENT_INDEX)
+    parser.add_argument("--reader-model", default=READER_MODEL)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--dictionary", type=Path, default=None,
+                        help="KB documents jsonl: exact ID/title/alias hits pinned, encoder skipped for resolved windows")
+    parser.add_argument("--dense-policy", choices=DENSE_POLICIES, default="unresolved")
+    parser.add_argument("--bm25", type=Path, default=None, help="BM25 index dir: hybrid dense + lexical retrieval")
+    parser.add_argument("--max-batch-texts", type=int, default=MAX_BATCH_TEXTS)
+    parser.add_argument("--max-batch-chars", type=int, default=MAX_BATCH_CHARS)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="batch deadline after its first request")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="queued requests before 503")
+    parser.add_argument("--request-timeout", type=float, default=REQUEST_TIMEOUT_S, help="seconds before 504")
+    parser.add_argument("--max-text-chars", type=int, default=MAX_TEXT_CHARS)
+    args = parser.parse_args()
+    warn_without_bm25(args.dictionary, args.dense_policy, args.bm25)
+
+    # one process: the models are loaded once and shared by all requests through the batcher
+    uvicorn.run(create_app(vars(args)), host=args.host, port=args.port, workers=1)
+
+
+if __name__ == "__main__":
+    main()
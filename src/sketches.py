@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Mergebare Streaming-Sketches mit fester Speichergröße (für dataset_stats.py):
+  HyperLogLog    Kardinalität (eindeutige Mentions/Labels/Dokumente), ~1.04/sqrt(2^p) rel. Fehler
+  QuantileSketch Quantile mit relativer Genauigkeit (DDSketch: log-Buckets), für Längenverteilungen
+
+Beide lassen sich pro Chunk/Worker füllen und danach mit `merge` zusammenführen.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+HLL_PRECISION = 14
+QUANTILE_ACCURACY = 0.01
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    def __init__(self, p: int = HLL_PRECISION):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, value: str) -> None:
+        h = hash64(value)
+        idx = h & (self.m - 1)
+        w = h >> self.p
+        # rank = position of the lowest set bit in the remaining 64-p bits (1-based)
+        rank = (w & -w).bit_length() if w else 64 - self.p + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for v in values:
+            self.add(v)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError(f"cannot merge HLL with p={other.p} into p={self.p}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.exp2(-self.registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # small range: linear counting is (nearly) exact
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """DDSketch for non-negative values: bucket i holds (gamma^(i-1), gamma^i]; zeros counted apart."""
+
+    def __init__(self, accuracy: float = QUANTILE_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.n = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, x: float) -> None:
+        self.n += 1
+        self.total += x
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        if x <= 0:
+            self.zeros += 1
+            return
+        i = math.ceil(math.log(x) / self._log_gamma)
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.accuracy != self.accuracy:
+            raise ValueError("cannot merge quantile sketches with different accuracy")
+        for i, c in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + c
+        self.zeros += other.zeros
+        self.n += other.n
+        self.total += other.total
+        for attr, pick in (("min", min), ("max", max)):
+            a, b = getattr(self, attr), getattr(other, attr)
+            setattr(self, attr, b if a is None else a if b is None else pick(a, b))
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.n == 0:
+            return None
+        rank = q * (self.n - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen > rank:
+                # bucket midpoint (relative error <= accuracy), clamped to the observed range
+                value = 2 * self.gamma ** i / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+        out: Dict[str, Optional[float]] = {
+            "n": self.n,
+            "mean": round(self.total / self.n, 3) if self.n else None,
+            "min": self.min,
+            "max": self.max,
+        }
+        for q in quantiles:
+            v = self.quantile(q)
+            out[f"p{round(q * 100):d}"] = round(v, 2) if v is not None else None
+        return out
@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
+"""
+Reader-Training (relik Reader + Lightning, CPU).
+
+Mit `--pretokenized` werden die Candidates-Dateien einmal in memory-mapped Shards
+tokenisiert (reader_cache.py, Cache pro Tokenizer/Config) und Train/Val direkt
+aus den Shards geladen; ohne Flag lädt relik die jsonl-Dateien selbst.
+Mit `--max-tokens` werden Train-Batches nach Länge gebucketet und unter einem
+Token-Budget geschnitten (reader_batching.py); Tokens/s werden pro Schritt geloggt.
+Packing mehrerer Windows pro Sequenz (`--pack-length`) wird abgelehnt: der
+relik-Reader kennt keine `segment_ids` und würde Spans gegen Candidates fremder
+Windows bewerten; Packing bleibt bis zu einem segment-fähigen Kopf auf
+`reader_batching.py bench` beschränkt.
+
+  python src/train_reader.py
+  python src/train_reader.py --pretokenized --batch-size 16 --num-workers 2
+  python src/train_reader.py --pretokenized --max-tokens 8192
+"""
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
-from omegaconf import OmegaConf
-from relik.reader.reader import Reader
-from lightning.pytorch import Trainer
 
 ROOT = Path(__file__).resolve().parents[1]
 
@@ -14,22 +29,74 @@ TRAIN = ROOT / "data/candidates/relik/train.window.candidates.jsonl"
 VAL = ROOT / "data/candidates/relik/val.window.candidates.jsonl"
 TEST = ROOT / "data/candidates/relik/test.window.candidates.jsonl"
 
-print("Loading config:", CONFIG_PATH)
-cfg = OmegaConf.load(CONFIG_PATH)
+BATCH_SIZE = 16
+NUM_WORKERS = 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="train the relik reader")
+    parser.add_argument("--config", type=Path, default=CONFIG_PATH)
+    parser.add_argument("--pretokenized", action="store_true",
+                        help="train/val from pre-tokenized memory-mapped shards (reader_cache.py)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="with --pretokenized: length-bucketed train batches under this token budget")
+    parser.add_argument("--pack-length", type=int, default=None,
+                        help="not supported: the relik reader has no segment-aware head (see reader_batching.py bench)")
+    args = parser.parse_args()
+    if args.pack_length:
+        parser.error("--pack-length: the relik reader would score spans against candidates of other packed "
+                     "windows; packing is benchmark-only (python src/reader_batching.py bench --pack-length N)")
+
+    from lightning.pytorch import Trainer
+    from omegaconf import OmegaConf
+    from relik.reader.reader import Reader
+
+    print("Loading config:", args.config)
+    cfg = OmegaConf.load(args.config)
+
+    # Override dataset paths
+    cfg.data.train_dataset_path = str(TRAIN)
+    cfg.data.val_dataset_path = str(VAL)
+    cfg.data.test_dataset_path = str(TEST)
+
+    loaders = {}
+    callbacks = []
+    if args.pretokenized:
+        from reader_batching import make_train_dataloader, throughput_callback
+        from reader_cache import READER_TOKENIZER, load_reader_tokenizer, make_dataloader, prepare
+
+        tokenizer = load_reader_tokenizer(OmegaConf.select(cfg, "model.model.transformer_model",
+                                                           default=READER_TOKENIZER))
+        dirs = prepare({"train": TRAIN, "val": VAL}, tokenizer=tokenizer)
+        pad_id = tokenizer.pad_token_id or 0
+        if args.max_tokens:
+            train = make_train_dataloader(dirs["train"], args.max_tokens, num_workers=args.num_workers,
+                                          pad_id=pad_id)
+        else:
+            train = make_dataloader(dirs["train"], args.batch_size, shuffle=True, num_workers=args.num_workers,
+                                    pad_id=pad_id)
+        callbacks.append(throughput_callback())
+        loaders = {
+            "train_dataloaders": train,
+            "val_dataloaders": make_dataloader(dirs["val"], args.batch_size, num_workers=args.num_workers,
+                                               pad_id=pad_id),
+        }
+
+    print("Initializing model...")
+    model = Reader(cfg)
 
-# Override dataset paths
-cfg.data.train_dataset_path = str(TRAIN)
-cfg.data.val_dataset_path = str(VAL)
-cfg.data.test_dataset_path = str(TEST)
+    print("Starting training...")
+    trainer = Trainer(
+        max_epochs=cfg.trainer.max_epochs,
+        accelerator="cpu",
+        devices=1,
+        callbacks=callbacks,
+    )
 
-print("Initializing model...")
-model = Reader(cfg)
+    trainer.fit(model, **loaders)
 
-print("Starting training...")
-trainer = Trainer(
-    max_epochs=cfg.trainer.max_epochs,
-    accelerator="cpu",
-    devices=1,
-)
 
-trainer.fit(model)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Validierung der Pipeline-Ausgaben (processed, windowed, candidates) in parallelen Chunk-Workern.
+
+  processed   jede `doc_span_annotations`-Span: Grenzen, nicht leer, Text == meta.mention
+              (per-mention `meta.mention` und gruppiert `meta.mentions[j].mention`)
+  windows     tokens/token2char_* konsistent, Token-Text == text[token2char - offset],
+              window_labels im Window, jedes `window_labels_tokens` passt zu token2char_*
+              (erster/letzter überlappender Token, wie create_windows.py)
+  candidates  Windows-Checks + span_candidates/-scores gleich lang und absteigend sortiert,
+              Abdeckung: Anteil der Gold-Labels, die in den Candidates stehen
+
+Gepackte Window-Stores (`*.windows`, window_store.py) werden wie die JSONL-Datei geprüft
+und bei den Default-Pfaden bevorzugt, wenn sie aktuell sind (window_store.window_source).
+
+Fehler werden pro Code gezählt und mit wenigen Beispielzeilen (Datei:Zeile) gemeldet.
+
+  python src/validate.py                          # alle vorhandenen Splits aller Stages
+  python src/validate.py data/windowed/relik/val.window.jsonl --min-coverage 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from eval import normalize_label
+from jsonl_io import default_workers, iter_range_lines, loads, plan_byte_ranges
+from window_store import STORE_SUFFIX, WindowStore, window_source
+
+ROOT = Path(__file__).resolve().parents[1]
+STAGE_DIRS = [
+    ("processed", ROOT / "data/processed/relik", "{split}.jsonl"),
+    ("windows", ROOT / "data/windowed/relik", "{split}.window.jsonl"),
+    ("candidates", ROOT / "data/candidates/relik", "{split}.window.candidates.jsonl"),
+]
+KINDS = [kind for kind, _, _ in STAGE_DIRS]
+SPLITS = ["train", "val", "test"]
+
+# sample lines kept per error code
+MAX_SAMPLES = 3
+SNIPPET_CHARS = 160
+
+
+def kind_of(path: Path) -> str:
+    name = path.name
+    if name.endswith(STORE_SUFFIX):
+        name = name[:-len(STORE_SUFFIX)] + ".jsonl"
+    if name.endswith(".window.candidates.jsonl"):
+        return "candidates"
+    if name.endswith(".window.jsonl"):
+        return "windows"
+    return "processed"
+
+
+class Report:
+    """Error counts + sample lines of one chunk / file (mergeable)."""
+
+    def __init__(self):
+        self.lines = 0
+        # physical lines incl. blank ones (for absolute line numbers when merging chunks)
+        self.span_lines = 0
+        self.errors: Counter = Counter()
+        self.samples: Dict[str, List[Tuple[int, str]]] = {}
+        self.gold = 0
+        self.gold_covered = 0
+
+    def error(self, code: str, line_no: int, message: str) -> None:
+        self.errors[code] += 1
+        samples = self.samples.setdefault(code, [])
+        if len(samples) < MAX_SAMPLES:
+            samples.append((line_no, message[:SNIPPET_CHARS]))
+
+    def merge(self, other: "Report", line_offset: int = 0) -> "Report":
+        self.lines += other.lines
+        self.span_lines += other.span_lines
+        self.errors.update(other.errors)
+        for code, samples in other.samples.items():
+            mine = self.samples.setdefault(code, [])
+            for line_no, message in samples:
+                if len(mine) < MAX_SAMPLES:
+                    mine.append((line_no + line_offset, message))
+        self.gold += other.gold
+        self.gold_covered += other.gold_covered
+        return self
+
+    @property
+    def coverage(self) -> Optional[float]:
+        return self.gold_covered / self.gold if self.gold else None
+
+
+# --- checks (line_no is chunk-relative, fixed up when merging) ---
+
+def check_processed(doc: Dict[str, Any], line_no: int, report: Report) -> None:
+    text = doc.get("doc_text")
+    if not isinstance(text, str) or "doc_id" not in doc:
+        report.error("missing_field", line_no, "doc_id/doc_text missing")
+        return
+    spans = doc.get("doc_span_annotations") or []
+    meta = doc.get("meta") or {}
+    grouped = "mentions" in meta
+    metas = meta["mentions"] if grouped else [meta] * len(spans)
+    if len(metas) != len(spans):
+        report.error("meta_count_mismatch", line_no,
+                      f"doc {doc['doc_id']}: {len(spans)} spans vs {len(metas)} meta.mentions")
+    previous = None
+    for (start, end, label), m in zip(spans, metas):
+        if not (0 <= start < end <= len(text)):
+            report.error("span_out_of_bounds", line_no, f"doc {doc['doc_id']}: [{start}, {end}) len={len(text)}")
+            continue
+        mention = m.get("mention")
+        if mention is not None and text[start:end] != mention:
+            report.error("mention_mismatch", line_no,
+                         f"doc {doc['doc_id']}: {text[start:end]!r} vs {mention!r}")
+        if grouped and previous is not None and (start, end) < previous:
+            report.error("spans_unsorted", line_no, f"doc {doc['doc_id']}: [{start}, {end}) after {list(previous)}")
+        previous = (start, end)
+    if not grouped and len(spans) != 1:
+        report.error("span_count", line_no, f"doc {doc['doc_id']}: per-mention doc with {len(spans)} spans")
+
+
+def check_window(w: Dict[str, Any], line_no: int, report: Report) -> bool:
+    """Window structure + labels; False if the window is too broken for further checks."""
+    try:
+        tokens, text, offset = w["tokens"], w["text"], w["offset"]
+        starts, ends = w["token2char_start"], w["token2char_end"]
+    except KeyError as e:
+        report.error("missing_field", line_no, f"window {w.get('doc_id')}/{w.get('window_id')}: {e}")
+        return False
+    where = f"window {w.get('doc_id')}/{w.get('window_id')}"
+    n = len(tokens)
+    if len(starts) != n or len(ends) != n:
+        report.error("token2char_length", line_no, f"{where}: {n} tokens, {len(starts)}/{len(ends)} offsets")
+        return False
+
+    s = [starts[str(i)] for i in range(n)]
+    e = [ends[str(i)] for i in range(n)]
+    for i, tok in enumerate(tokens):
+        if text[s[i] - offset:e[i] - offset] != tok:
+            report.error("token_offset", line_no, f"{where} token {i}: {tok!r} vs {text[s[i] - offset:e[i] - offset]!r}")
+            break
+
+    labels = w.get("window_labels") or []
+    label_tokens = w.get("window_labels_tokens") or []
+    if len(labels) != len(label_tokens):
+        report.error("label_tokens_count", line_no, f"{where}: {len(labels)} labels vs {len(label_tokens)} token labels")
+    for (cs, ce, label), (ts, te, tlabel) in zip(labels, label_tokens):
+        if not (offset <= cs < ce <= offset + len(text)):
+            report.error("label_outside_window", line_no, f"{where}: [{cs}, {ce}) not in [{offset}, {offset + len(text)})")
+            continue
+        if label != tlabel:
+            report.error("label_tokens_label", line_no, f"{where}: {label!r} vs {tlabel!r}")
+        if not (0 <= ts < te <= n):
+            report.error("label_tokens_bounds", line_no, f"{where}: tokens [{ts}, {te}) of {n}")
+            continue
+        # first / last token overlapping the char span (create_windows.label_token_span)
+        first_ok = e[ts] > cs and (ts == 0 or e[ts - 1] <= cs)
+        last_ok = s[te - 1] < ce and (te == n or s[te] >= ce)
+        if not (first_ok and last_ok):
+            report.error("label_tokens_offsets", line_no,
+                         f"{where}: chars [{cs}, {ce}) vs tokens [{ts}, {te}) = chars [{s[ts]}, {e[te - 1]})")
+    return True
+
+
+def check_candidates(w: Dict[str, Any], line_no: int, report: Report) -> None:
+    if not check_window(w, line_no, report):
+        return
+    where = f"window {w.get('doc_id')}/{w.get('window_id')}"
+    cands = w.get("span_candidates")
+    scores = w.get("span_candidates_scores")
+    if cands is None or scores is None:
+        report.error("missing_candidates", line_no, f"{where}: span_candidates/span_candidates_scores missing")
+        return
+    if len(cands) != len(scores):
+        report.error("candidate_scores_length", line_no, f"{where}: {len(cands)} candidates, {len(scores)} scores")
+    if any(b > a for a, b in zip(scores, scores[1:])):
+        report.error("scores_unsorted", line_no, f"{where}: scores not descending")
+    ranked = {normalize_label(c) for c in cands}
+    for _, _, label in w.get("window_labels") or []:
+        report.gold += 1
+        report.gold_covered += normalize_label(label) in ranked
+
+
+CHECKS = {"processed": check_processed, "windows": check_window, "candidates": check_candidates}
+
+
+def validate_range(task: Tuple[str, str, int, int]) -> Tuple[str, int, Report]:
+    path, kind, start, end = task
+    check = CHECKS[kind]
+    report = Report()
+    if Path(path).is_dir():
+        # Window-Store: (start, end) sind Window-Indizes statt Byte-Offsets
+        with WindowStore(Path(path)) as store:
+            for line_no, idx in enumerate(range(start, end), start=1):
+                report.lines += 1
+                report.span_lines += 1
+                check(store[idx].to_dict(), line_no, report)
+        return path, start, report
+    for line_no, line in enumerate(iter_range_lines(Path(path), start, end), start=1):
+        report.span_lines += 1
+        if not line.strip():
+            continue
+        report.lines += 1
+        try:
+            record = loads(line)
+        except ValueError as e:
+            report.error("json", line_no, f"{e}: {line[:80]!r}")
+            continue
+        check(record, line_no, report)
+    return path, start, report
+
+
+def validate(paths: List[Path], workers: int) -> Dict[Path, Report]:
+    tasks = []
+    for path in paths:
+        n_chunks = None if workers == 1 else workers * 2
+        if path.is_dir():
+            with WindowStore(path) as store:
+                n = len(store)
+            step = max(1, -(-n // (n_chunks or 1)))
+            tasks.extend((str(path), kind_of(path), a, min(a + step, n)) for a in range(0, n, step))
+            continue
+        tasks.extend((str(path), kind_of(path), a, b) for a, b in plan_byte_ranges(path, n_chunks=n_chunks))
+
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            results = pool.map(validate_range, tasks)
+    else:
+        results = [validate_range(t) for t in tasks]
+
+    # chunks in file order -> absolute line numbers for the samples
+    reports: Dict[Path, Report] = {}
+    for path, _, chunk in sorted(results, key=lambda r: (r[0], r[1])):
+        report = reports.setdefault(Path(path), Report())
+        report.merge(chunk, line_offset=report.span_lines)
+    return {p: reports[p] for p in paths if p in reports}
+
+
+def default_paths(kinds: List[str], splits: List[str]) -> List[Path]:
+    out = []
+    for kind, directory, pattern in STAGE_DIRS:
+        if kind not in kinds:
+            continue
+        for split in splits:
+            path = directory / pattern.format(split=split)
+            if kind != "processed":
+                path = window_source(path)
+            if path.exists():
+                out.append(path)
+    return out
+
+
+def print_report(reports: Dict[Path, Report], min_coverage: Optional[float]) -> int:
+    failed = 0
+    for path, report in reports.items():
+        try:
+            name = path.relative_to(ROOT)
+        except ValueError:
+            name = path
+        n_errors = sum(report.errors.values())
+        coverage = report.coverage
+        cov = f", gold in candidates {coverage:.4f}" if coverage is not None else ""
+        status = "OK " if not n_errors else "ERR"
+        print(f"[{status}] {name} ({kind_of(path)}): {report.lines} lines, {n_errors} errors{cov}")
+        for code, count in report.errors.most_common():
+            print(f"      {code}: {count}")
+            for line_no, message in report.samples.get(code, []):
+                print(f"        {name}:{line_no}  {message}")
+        if n_errors:
+            failed += 1
+        if min_coverage is not None and coverage is not None and coverage < min_coverage:
+            print(f"      coverage {coverage:.4f} < {min_coverage}")
+            failed += 1
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="validate processed / windowed / candidate jsonl files")
+    parser.add_argument("paths", nargs="*", type=Path, help="files to check (default: all stages and splits)")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=KINDS, help="stages checked by default")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: all cores)")
+    parser.add_argument("--min-coverage", type=float, default=None,
+                        help="fail if the gold-in-candidates coverage of a candidates file is lower")
+    parser.add_argument("--json", type=Path, default=None, help="also write the summary as JSON")
+    args = parser.parse_args()
+
+    paths = args.paths or default_paths(args.kinds, args.splits)
+    if not paths:
+        print("nothing to validate")
+        return
+    for p in paths:
+        if not p.exists():
+            raise FileNotFoundError(f"Missing file: {p}")
+
+    reports = validate(paths, args.workers or default_workers())
+    failed = print_report(reports, args.min_coverage)
+
+    if args.json is not None:
+        summary = {
+            str(p): {"kind": kind_of(p), "lines": r.lines, "errors": dict(r.errors),
+                     "samples": {code: [list(s) for s in samples] for code, samples in r.samples.items()},
+                     "gold_coverage": r.coverage}
+            for p, r in reports.items()
+        }
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Kompaktes Spaltenformat für Window-Dateien (`*.window.jsonl`, `*.window.candidates.jsonl`).
+
+Die vier Offset-Dicts (`token2char_start`, `token2char_end`, `char2token_start`,
+`char2token_end`) machen den Großteil jeder Zeile aus. Im Store liegen sie als
+gepackte int32-Arrays in `.npy`-Sidecars (memory-mapped), der Rest der Zeile
+bleibt JSON:
+
+  <name>.windows/
+    records.jsonl        Zeile ohne Offsets (die vier Keys + words sind null)
+    line_offsets.npy     int64 [n+1]   Byte-Offset jeder Zeile in records.jsonl
+    token_index.npy      int64 [n+1]   Token-Bereich jedes Windows in den Arrays
+    first_token.npy      int32 [n]     Doc-Token-Index des ersten Window-Tokens
+    token_starts.npy     int32 [T]     Doc-Char-Start jedes Tokens
+    token_ends.npy       int32 [T]     Doc-Char-Ende jedes Tokens
+
+Konvertieren:
+  python src/window_store.py pack data/windowed/relik/val.window.jsonl
+  python src/window_store.py unpack data/windowed/relik/val.window.windows out.jsonl
+
+`unpack` erzeugt byte-identisches JSONL. Leser (candidates.py, candidate_store.py,
+validate.py) nehmen über `window_source` den Store, wenn er neben der JSONL-Datei
+liegt und nicht älter ist, sonst die JSONL-Datei.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+STORE_SUFFIX = ".windows"
+OFFSET_KEYS = ("token2char_start", "token2char_end", "char2token_start", "char2token_end")
+
+
+def store_path_for(jsonl_path: Path) -> Path:
+    """data/windowed/relik/val.window.jsonl -> data/windowed/relik/val.window.windows"""
+    return jsonl_path.with_suffix(STORE_SUFFIX)
+
+
+def offset_dicts(starts, ends, first_token: int) -> Dict[str, Dict[str, int]]:
+    """The four relik offset dicts of one window, rebuilt from packed arrays."""
+    starts = [int(x) for x in starts]
+    ends = [int(x) for x in ends]
+    return {
+        "token2char_start": {str(i): s for i, s in enumerate(starts)},
+        "token2char_end": {str(i): e for i, e in enumerate(ends)},
+        "char2token_start": {str(s): first_token + i for i, s in enumerate(starts)},
+        "char2token_end": {str(e): first_token + i for i, e in enumerate(ends)},
+    }
+
+
+def pack(jsonl_path: Path, store_path: Optional[Path] = None) -> Path:
+    """JSONL -> columnar store. Windows whose dicts can't be rebuilt keep them inline."""
+    store_path = store_path or store_path_for(jsonl_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    line_offsets = [0]
+    token_index = [0]
+    first_tokens: List[int] = []
+    starts: List[int] = []
+    ends: List[int] = []
+    kept_inline = 0
+
+    with jsonl_path.open(encoding="utf-8") as fin, (store_path / "records.jsonl").open("wb") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            n = len(rec["token2char_start"])
+            s = [rec["token2char_start"][str(i)] for i in range(n)]
+            e = [rec["token2char_end"][str(i)] for i in range(n)]
+            first = min(rec["char2token_start"].values()) if rec["char2token_start"] else 0
+
+            if offset_dicts(s, e, first) == {k: rec[k] for k in OFFSET_KEYS}:
+                for k in OFFSET_KEYS:
+                    rec[k] = None
+                starts.extend(s)
+                ends.extend(e)
+            else:
+                kept_inline += 1
+            if rec.get("words") == rec.get("tokens"):
+                rec["words"] = None
+
+            first_tokens.append(first)
+            token_index.append(len(starts))
+            data = (json.dumps(rec) + "\n").encode("utf-8")
+            fout.write(data)
+            line_offsets.append(line_offsets[-1] + len(data))
+
+    np.save(store_path / "line_offsets.npy", np.asarray(line_offsets, dtype=np.int64))
+    np.save(store_path / "token_index.npy", np.asarray(token_index, dtype=np.int64))
+    np.save(store_path / "first_token.npy", np.asarray(first_tokens, dtype=np.int32))
+    np.save(store_path / "token_starts.npy", np.asarray(starts, dtype=np.int32))
+    np.save(store_path / "token_ends.npy", np.asarray(ends, dtype=np.int32))
+
+    if kept_inline:
+        print(f"{kept_inline} windows kept their offset dicts inline")
+    return store_path
+
+
+class WindowRecord(Mapping):
+    """Lazy view of one window: JSON is parsed and offset dicts are built only on access."""
+
+    def __init__(self, store: "WindowStore", idx: int):
+        self._store = store
+        self._idx = idx
+        self._rec: Optional[Dict[str, Any]] = None
+
+    def _load(self) -> Dict[str, Any]:
+        if self._rec is None:
+            self._rec = self._store.raw_record(self._idx)
+        return self._rec
+
+    @property
+    def token_starts(self) -> np.ndarray:
+        return self._store.token_starts(self._idx)
+
+    @property
+    def token_ends(self) -> np.ndarray:
+        return self._store.token_ends(self._idx)
+
+    def __getitem__(self, key: str) -> Any:
+        rec = self._load()
+        value = rec[key]
+        if value is None and key in OFFSET_KEYS:
+            value = rec[key] = self._store.offset_dicts(self._idx)[key]
+        elif value is None and key == "words":
+            value = rec["tokens"]
+        return value
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: self[k] for k in self}
+
+
+class WindowStore:
+    """Read-only, memory-mapped window store (see module docstring for the layout)."""
+
+    def __init__(self, store_path: Path):
+        self.path = Path(store_path)
+        self._line_offsets = np.load(self.path / "line_offsets.npy", mmap_mode="r")
+        self._token_index = np.load(self.path / "token_index.npy", mmap_mode="r")
+        self._first_token = np.load(self.path / "first_token.npy", mmap_mode="r")
+        self._starts = np.load(self.path / "token_starts.npy", mmap_mode="r")
+        self._ends = np.load(self.path / "token_ends.npy", mmap_mode="r")
+        self._records = (self.path / "records.jsonl").open("rb")
+
+    def close(self) -> None:
+        self._records.close()
+
+    def __enter__(self) -> "WindowStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._first_token)
+
+    def __getitem__(self, idx: int) -> WindowRecord:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return WindowRecord(self, idx)
+
+    def __iter__(self) -> Iterator[WindowRecord]:
+        for idx in range(len(self)):
+            yield WindowRecord(self, idx)
+
+    def raw_line(self, idx: int) -> bytes:
+        a, b = int(self._line_offsets[idx]), int(self._line_offsets[idx + 1])
+        self._records.seek(a)
+        return self._records.read(b - a)
+
+    def raw_record(self, idx: int) -> Dict[str, Any]:
+        return json.loads(self.raw_line(idx))
+
+    def token_starts(self, idx: int) -> np.ndarray:
+        return self._starts[self._token_index[idx]:self._token_index[idx + 1]]
+
+    def token_ends(self, idx: int) -> np.ndarray:
+        return self._ends[self._token_index[idx]:self._token_index[idx + 1]]
+
+    def offset_dicts(self, idx: int) -> Dict[str, Dict[str, int]]:
+        return offset_dicts(self.token_starts(idx), self.token_ends(idx), int(self._first_token[idx]))
+
+    @property
+    def all_token_starts(self) -> np.ndarray:
+        return self._starts
+
+    @property
+    def all_token_ends(self) -> np.ndarray:
+        return self._ends
+
+    @property
+    def token_index(self) -> np.ndarray:
+        return self._token_index
+
+
+def unpack(store_path: Path, jsonl_path: Path) -> int:
+    """Columnar store -> JSONL (byte-identical to the packed input)."""
+    n = 0
+    with WindowStore(store_path) as store, jsonl_path.open("w", encoding="utf-8") as fout:
+        for window in store:
+            fout.write(json.dumps(window.to_dict()) + "\n")
+            n += 1
+    return n
+
+
+def window_source(jsonl_path: Path) -> Path:
+    """The store next to `jsonl_path` if it exists and is not older than the jsonl, else `jsonl_path`."""
+    jsonl_path = Path(jsonl_path)
+    if jsonl_path.is_dir():
+        return jsonl_path
+    records = store_path_for(jsonl_path) / "records.jsonl"
+    if not records.exists():
+        return jsonl_path
+    if jsonl_path.exists() and records.stat().st_mtime_ns < jsonl_path.stat().st_mtime_ns:
+        return jsonl_path
+    return records.parent
+
+
+def source_stat(path: Path) -> os.stat_result:
+    """stat() of a jsonl file or of a store's records.jsonl (for input fingerprints)."""
+    path = Path(path)
+    return (path / "records.jsonl").stat() if path.is_dir() else path.stat()
+
+
+def iter_windows(path: Path, as_dict: bool = False) -> Iterator[Mapping]:
+    """Windows from either a `*.jsonl` file or a `.windows` store (`as_dict`: plain, mutable dicts)."""
+    path = Path(path)
+    if path.is_dir():
+        with WindowStore(path) as store:
+            for window in store:
+                yield window.to_dict() if as_dict else window
+        return
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_window_lines(path: Path) -> Iterator[str]:
+    """Non-empty jsonl lines (with newline) of a `*.jsonl` file or a `.windows` store."""
+    path = Path(path)
+    if path.is_dir():
+        with WindowStore(path) as store:
+            for window in store:
+                yield json.dumps(window.to_dict()) + "\n"
+        return
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="window jsonl <-> columnar window store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_pack = sub.add_parser("pack")
+    p_pack.add_argument("jsonl", type=Path)
+    p_pack.add_argument("store", type=Path, nargs="?")
+    p_unpack = sub.add_parser("unpack")
+    p_unpack.add_argument("store", type=Path)
+    p_unpack.add_argument("jsonl", type=Path)
+    args = parser.parse_args()
+
+    if args.cmd == "pack":
+        store = pack(args.jsonl, args.store)
+        size_in = args.jsonl.stat().st_size
+        size_out = sum(p.stat().st_size for p in store.iterdir())
+        print(f"packed {args.jsonl} -> {store} ({size_in / 1e6:.1f} MB -> {size_out / 1e6:.1f} MB)")
+    else:
+        n = unpack(args.store, args.jsonl)
+        print(f"unpacked {n} windows -> {args.jsonl}")
+
+
+if __name__ == "__main__":
+    main()